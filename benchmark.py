@@ -0,0 +1,688 @@
+"""任务记录工具的性能基准测试（不需要图形界面）
+
+用法：
+    python benchmark.py run --sizes 1000,10000 --output baseline.json
+    python benchmark.py compare baseline.json
+    python benchmark.py diff
+    python benchmark.py rss --count 1000000
+    python benchmark.py contention --writers 4
+
+run 用合成数据（中文描述）在临时目录中依次测量数据层各操作的耗时和
+内存峰值（各运行一遍），Tk控件用桩对象代替；compare 用基线记录的参数重新测量，
+耗时或内存超出基线一定比例时标记为退化并以非零状态退出。rss 在子进程中
+分别用普通字典和 Task 记录加载同样的任务头，比较常驻内存。contention 让
+多个进程同时向同一个任务文件写入，统计文件锁的持有/等待时间，并检查没有丢失
+操作、分配的ID没有重复。
+"""
+import argparse
+import difflib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import task_manager as tm
+
+# 生成测试文本用的常用汉字
+COMMON_CHARS = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面"
+    "而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把"
+    "性好应开它合还因由其些然前外天政四日那社义事平形相全表间样与关各重新线内数正心反你明看原又么利比或但质"
+)
+# difflib按字符比对的耗时随长度急剧增长，超过此长度时跳过
+DIFFLIB_CHAR_LIMIT = 20000
+# 合成描述从这段语料中截取，避免逐字生成百万级任务的文本
+CORPUS_LENGTH = 1 << 18
+# 判定退化时忽略的绝对差值：耗时（秒）和内存（KB）
+MIN_TIME_DELTA = 0.02
+MIN_MEMORY_DELTA = 64
+# 搜索测试使用的查询
+SEARCH_QUERIES = ["项目", "发布", "的工", "学法", "report", "ticket1", "不存在的词"]
+
+
+def random_text(rng, length):
+    """生成约length个字的中文文本，夹杂句号，不含换行（和实际的长描述一样）"""
+    out = []
+    for _ in range(length):
+        out.append(rng.choice(COMMON_CHARS))
+        if rng.random() < 0.03:
+            out.append("。")
+    return "".join(out)
+
+
+def edit_text(rng, text, edits):
+    """在文本中随机做edits处小改动（替换、插入或删除几个字）"""
+    chars = list(text)
+    for _ in range(edits):
+        i = rng.randrange(len(chars))
+        chars[i:i + rng.randint(0, 5)] = rng.choice(COMMON_CHARS) * rng.randint(0, 5)
+    return "".join(chars)
+
+
+def best_time(func, *args, repeat=3):
+    """多次运行取最短耗时（秒）"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def generate_tasks(count, versions, desc_length, seed):
+    """生成count个合成任务：每个任务versions个版本，描述约desc_length个字
+
+    版本历史按程序的实际方式编码（关键帧+差量），约一半任务已完成，
+    项目和优先级随机分布。
+    """
+    rng = random.Random(seed)
+    corpus = list(rng.choices(COMMON_CHARS, k=CORPUS_LENGTH))
+    for i in range(0, CORPUS_LENGTH, 30):
+        corpus[i] = "。"
+    corpus = "".join(corpus)
+    history = tm.VersionContentCache()
+    tasks = tm.TaskCollection()
+    projects = [f"项目{i}" for i in range(50)] + ["infra", "website", "release"]
+    for i in range(count):
+        start = rng.randrange(CORPUS_LENGTH - desc_length)
+        content = corpus[start:start + desc_length] + f" ticket{i}"
+        stamp = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00"
+        task = {
+            "id": tasks.allocate_id(),
+            "project": rng.choice(projects),
+            "short_desc": corpus[start:start + 8],
+            "priority": rng.choice("高中低"),
+            "create_time": stamp,
+            "modified_time": stamp,
+            "completed": rng.random() < 0.5,
+            "description_history": [],
+        }
+        for n in range(1, versions + 1):
+            if n > 1:
+                # 每个新版本改动几个字
+                pos = rng.randrange(len(content))
+                content = content[:pos] + corpus[start + n:start + n + 4] + content[pos + 2:]
+            task["description_history"].append(history.make_version(
+                task, n, content, timestamp=stamp, action="创建" if n == 1 else "修改", folder_path=""
+            ))
+        tasks.add(tm.Task(task))
+    return tasks
+
+
+class StubVar:
+    """代替 tk.StringVar"""
+
+    def __init__(self, value=""):
+        self.value = value
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+
+class StubTree:
+    """代替 ttk.Treeview：只记录行的内容和顺序"""
+
+    def __init__(self):
+        self.rows = {}
+        self.order = []
+
+    def insert(self, parent, index, iid=None, values=(), tags=()):
+        self.rows[iid] = (values, tags)
+        if index == "end":
+            self.order.append(iid)
+        else:
+            self.order.insert(index, iid)
+        return iid
+
+    def item(self, iid, values=None, tags=None, **kw):
+        old_values, old_tags = self.rows[iid]
+        self.rows[iid] = (old_values if values is None else values, old_tags if tags is None else tags)
+
+    def delete(self, *iids):
+        removed = set(iids)
+        for iid in iids:
+            del self.rows[iid]
+        self.order = [iid for iid in self.order if iid not in removed]
+
+    def move(self, iid, parent, index):
+        self.order.remove(iid)
+        self.order.insert(index, iid)
+
+    def get_children(self, item=""):
+        return tuple(self.order)
+
+    def bbox(self, iid):
+        return (0, 0, 100, 25)
+
+    def yview(self, *args):
+        return (0.0, 1.0)
+
+    def yview_moveto(self, fraction):
+        pass
+
+
+class StubScrollbar:
+    def set(self, first, last):
+        pass
+
+
+class StubMessagebox:
+    """代替 tkinter.messagebox：确认对话框一律回答“是”"""
+
+    def askyesno(self, *args, **kwargs):
+        return True
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def headless_manager(store, tasks):
+    """构造不创建任何窗口的TaskManager，控件由桩对象代替，保存走真实的后台线程"""
+    app = object.__new__(tm.TaskManager)
+    # 没有事件循环：由各步骤在操作后调用 app.refresh.flush()，重绘耗时计入该步骤；
+    # 后台线程转交的回调留在 app.ui_calls 中不执行
+    app.init_state(store.path, lambda func: None, store=store, tasks=tasks)
+    app.task_tree = StubTree()
+    app.list_scrollbar = StubScrollbar()
+    app.status_var = StubVar()
+    app.save_state_var = StubVar()
+    app.rendered_rows = {}
+    app.rendered_order = []
+    app.view_tasks = []
+    app.view_offset = 0
+    app.visible_rows = 20
+    app.virtual_mode = False
+    return app
+
+
+def measure(func, trace_memory):
+    """运行一次func：trace_memory为False时返回耗时（秒），为True时返回期间新分配内存的峰值（KB）
+
+    tracemalloc会让分配密集的代码慢数倍，所以耗时和内存分两遍测量。
+    """
+    if not trace_memory:
+        start = time.perf_counter()
+        func()
+        return round(time.perf_counter() - start, 6)
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] // 1024
+    finally:
+        tracemalloc.stop()
+
+
+def bench_size(count, params, trace_memory):
+    """对一种任务规模依次执行各操作，返回 {操作名: 耗时或内存峰值}"""
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="task_bench_")
+    saved_messagebox = tm.messagebox
+    tm.messagebox = StubMessagebox()
+    try:
+        def step(name, func):
+            results[name] = measure(func, trace_memory)
+
+        state = {}
+        path = os.path.join(workdir, "tasks.json")
+        tasks = generate_tasks(count, params["versions"], params["desc_length"], params["seed"])
+        step("write_snapshot", lambda: tm.JsonTaskStore(path).rewrite(tasks))
+        del tasks
+
+        # 启动时界面只需等第一批任务，耗时应与任务总数无关
+        step("first_chunk", lambda: next(tm.JsonTaskStore(path).iter_load()))
+        store = tm.JsonTaskStore(path)
+        step("load_tasks", lambda: state.update(tasks=store.load()))
+        app = headless_manager(store, state["tasks"])
+        rng = random.Random(params["seed"])
+        ids = list(app.tasks.ids())
+
+        def build_index():
+            index = tm.SearchIndex()
+            history = tm.VersionContentCache(version_reader=store.read_version)
+            for t in app.tasks:
+                index.add_task(t, history.content)
+            app.search_index = index
+
+        step("build_search_index", build_index)
+        step("search", lambda: [app.search_index.search(q) for q in SEARCH_QUERIES])
+
+        def filter_all():
+            for status in ("全部", "未完成", "已完成"):
+                app.filter_status = status
+                app.view_offset = 0
+                app.update_task_list()
+            app.filter_status = "全部"
+
+        step("update_task_list", filter_all)
+
+        def sort_columns():
+            for column in tm.SORT_COLUMNS:
+                app.sort_column = column
+                filter_all()
+            app.sort_column = None
+
+        # 第一次按各列排序（建立排序序列），修改和删除之后再排序一次（增量调整）
+        step("sort_columns", sort_columns)
+
+        def query_rollups():
+            # 统计窗口的几种范围；汇总在此前一步建立，之后的修改步骤都会增量维护
+            rollup = app.tasks.time_rollup()
+            last = max(t.modified_time for t in app.tasks) // tm.ROLLUP_BUCKET_SECONDS
+            for days in tm.STATS_RANGES.values():
+                rollup.query(None if days is None else last - days + 1, last)
+
+        step("build_rollups", app.tasks.time_rollup)
+        step("rollup_query", query_rollups)
+
+        def save_many():
+            ops = []
+            for tid in rng.sample(ids, min(1000, len(ids))):
+                fields = {"modified_time": "2025-01-01 00:00:00"}
+                app.tasks.update(tid, fields)
+                ops.append({"op": "update", "id": tid, "fields": fields})
+            app.save_tasks(ops)
+            app.refresh.flush()
+            app.writer.flush()
+
+        step("save_tasks", save_many)
+        sample = max(1, len(ids) // 100)
+
+        def mark_completed():
+            app.selected_tasks = set(rng.sample(ids, sample))
+            app.mark_tasks_completed()
+            app.refresh.flush()
+            app.writer.flush()
+
+        step("mark_tasks_completed", mark_completed)
+
+        def delete_selected():
+            app.selected_tasks = set(rng.sample(ids, sample))
+            app.delete_tasks()
+            app.refresh.flush()
+            app.writer.flush()
+
+        step("delete_tasks", delete_selected)
+
+        def toggle_selection():
+            # 连续点选：每轮事件循环内的多次标记只重绘一次行和状态栏
+            rendered = [int(iid) for iid in app.rendered_order]
+            for turn in range(20):
+                for tid in rng.sample(rendered, min(10, len(rendered))):
+                    app.selected_tasks ^= {tid}
+                    app.schedule_row_refresh([tid])
+                app.refresh.flush()
+
+        step("toggle_selection", toggle_selection)
+        step("sort_after_changes", sort_columns)
+
+        def clear_completed():
+            app.clear_completed_tasks()
+            app.refresh.flush()
+            app.writer.flush()
+
+        def undo_clear():
+            app.undo_last_batch()
+            app.refresh.flush()
+            app.writer.flush()
+
+        # 清空已完成（约一半任务）后撤销：逆操作只引用被删除的任务，不复制集合
+        step("clear_completed", clear_completed)
+        step("undo_clear_completed", undo_clear)
+
+        def archive_completed():
+            # 与界面中的“归档”相同：写归档（lzma压缩）后从任务集合中删除
+            candidates = tm.archive_candidates(app.tasks, 0)
+            app.archive.add([tm.archive_record(t, store.read_version) for t in candidates])
+            app.on_tasks_archived({t["id"]: (t.modified_time, len(t["description_history"])) for t in candidates}, None)
+            app.refresh.flush()
+            app.writer.flush()
+
+        def archived_page():
+            # “已归档”列表翻到中间一页：只解压这一页所在的分段
+            app.archive.cache.clear()
+            app.filter_status = "已归档"
+            app.view_offset = len(app.archive) // 2
+            app.update_task_list()
+
+        def restore_archived():
+            app.selected_tasks = set(int(iid) for iid in app.rendered_order[:10])
+            app.archive.cache.clear()
+            app.restore_archived_tasks()
+            app.refresh.flush()
+            app.writer.flush()
+            app.filter_status = "全部"
+
+        step("archive_completed", archive_completed)
+        step("archived_page", archived_page)
+        step("restore_archived", restore_archived)
+
+        def diff_versions():
+            for t in rng.sample(list(app.tasks), min(100, len(app.tasks))):
+                history = t["description_history"]
+                tm.diff_texts(app.version_content(t, history[0]), app.version_content(t, history[-1]))
+
+        step("version_diff", diff_versions)
+        app.writer.close()
+        app.archive.close()
+        store.close()
+    finally:
+        tm.messagebox = saved_messagebox
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def run_suite(params, log):
+    """按params测量各规模，返回报告；每次运行使用相同的合成数据和随机序列"""
+    results = {}
+    for count in params["sizes"]:
+        log(f"{count} 个任务:")
+        seconds = bench_size(count, params, trace_memory=False)
+        peaks = bench_size(count, params, trace_memory=True) if params["memory"] else {}
+        results[str(count)] = {}
+        for name, elapsed in seconds.items():
+            results[str(count)][name] = {"seconds": elapsed, "peak_kb": peaks.get(name)}
+            log(f"  {name:<22} {elapsed * 1000:10.1f}ms" + (f" {peaks[name]:>10}KB" if name in peaks else ""))
+    return {
+        "meta": {
+            "created": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "params": params,
+        "results": results,
+    }
+
+
+def find_regressions(baseline, current, threshold):
+    """逐项对比两次测量，返回 [(规模, 操作, 指标, 基线值, 当前值)]"""
+    regressions = []
+    for size, ops in current["results"].items():
+        for name, result in ops.items():
+            old = baseline["results"].get(size, {}).get(name)
+            if old is None:
+                continue
+            for metric, min_delta in (("seconds", MIN_TIME_DELTA), ("peak_kb", MIN_MEMORY_DELTA)):
+                before, after = old.get(metric), result.get(metric)
+                if before is None or after is None:
+                    continue
+                if after > before * (1 + threshold) and after - before > min_delta:
+                    regressions.append((size, name, metric, before, after))
+    return regressions
+
+
+def log_stderr(message):
+    print(message, file=sys.stderr)
+
+
+def bench_run(args):
+    params = {
+        "sizes": [int(size) for size in args.sizes.split(",")],
+        "versions": args.versions,
+        "desc_length": args.desc_length,
+        "seed": args.seed,
+        "memory": not args.no_memory,
+    }
+    report = run_suite(params, log_stderr)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    log_stderr(f"结果已写入 {args.output}")
+
+
+def bench_compare(args):
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    current = run_suite(baseline["params"], log_stderr)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+    regressions = find_regressions(baseline, current, args.threshold)
+    if not regressions:
+        print(f"未发现退化（阈值 {args.threshold:.0%}）")
+        return 0
+    print(f"发现 {len(regressions)} 项退化（阈值 {args.threshold:.0%}）:")
+    for size, name, metric, before, after in regressions:
+        unit = "s" if metric == "seconds" else "KB"
+        print(f"  {size:>8} {name:<22} {metric:<8} {before}{unit} -> {after}{unit} (+{(after / before - 1) if before else 0:.0%})")
+    return 1
+
+
+def difflib_lines(old, new):
+    """原来的对比方式：按行 unified_diff，只能看出哪些行变了"""
+    summary = []
+    for line in difflib.unified_diff(old.splitlines(), new.splitlines(), lineterm=''):
+        if line.startswith('+') and not line.startswith('+++'):
+            summary.append(f"新增: {line[1:]}")
+        elif line.startswith('-') and not line.startswith('---'):
+            summary.append(f"删除: {line[1:]}")
+    return summary
+
+
+def difflib_chars(old, new):
+    """用difflib做到字符粒度的对比，作为同等精度的参照"""
+    return difflib.SequenceMatcher(None, old, new, autojunk=False).get_opcodes()
+
+
+def bench_diff(args):
+    rng = random.Random(args.seed)
+    cases = [(10000, 20), (100000, 50), (100000, 500), (20000, 5000)]
+    print(f"{'字数':>8} {'改动':>6} {'difflib按行':>12} {'difflib按字':>12} {'diff_texts':>12} {'差异段数':>8}")
+    for length, edits in cases:
+        old = random_text(rng, length)
+        new = edit_text(rng, old, edits)
+        lines = best_time(difflib_lines, old, new)
+        chars = best_time(difflib_chars, old, new, repeat=1) if length <= DIFFLIB_CHAR_LIMIT else None
+        ours = best_time(tm.diff_texts, old, new)
+        segments = len(tm.diff_texts(old, new))
+        chars_text = f"{chars * 1000:10.1f}ms" if chars is not None else f"{'跳过':>10}"
+        print(f"{length:>8} {edits:>6} {lines * 1000:10.1f}ms {chars_text} {ours * 1000:10.1f}ms {segments:>8}")
+
+
+def snapshot_lines(count, seed):
+    """生成快照中的任务行（版本内容在旁路文件中，只有版本头），与加载后内存中的形态一致"""
+    rng = random.Random(seed)
+    projects = [f"项目{i}" for i in range(50)] + ["infra", "website", "release"]
+    for i in range(1, count + 1):
+        stamp = f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00:00"
+        project = rng.choice(projects)
+        yield json.dumps({
+            "id": i, "project": project, "short_desc": f"处理第{i}号问题", "priority": rng.choice("高中低"),
+            "create_time": stamp, "modified_time": stamp, "completed": rng.random() < 0.5,
+            "description_history": [{"version": 1, "timestamp": stamp, "action": "创建",
+                                     "folder_path": f"{project}/处理第{i}号问题/v1", "body": [i * 200, 200, 0]}],
+        }, ensure_ascii=False)
+
+
+def current_rss_kb():
+    """当前进程的常驻内存（KB）；没有/proc时退回到峰值"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def rss_child(args):
+    """子进程：按指定的内存模型加载任务，输出增加的常驻内存（KB）"""
+    make = tm.as_task if args.model == "record" else dict
+    before = current_rss_kb()
+    tasks = tm.TaskCollection()
+    for line in snapshot_lines(args.count, args.seed):
+        tasks.add(make(json.loads(line)))
+    print(current_rss_kb() - before)
+
+
+def bench_rss(args):
+    if args.model:
+        rss_child(args)
+        return
+    print(f"{args.count} 个任务的常驻内存：")
+    results = {}
+    for model in ("dict", "record"):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--seed", str(args.seed), "rss",
+             "--count", str(args.count), "--model", model],
+            check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout
+        results[model] = int(output.split()[-1])
+        print(f"  {model:<8} {results[model] / 1024:10.1f}MB  {results[model] * 1024 / args.count:8.0f}B/任务")
+    print(f"  节省 {1 - results['record'] / results['dict']:.0%}")
+
+
+def contention_child(args):
+    """子进程：逐条新建任务并保存，输出分配的ID和每次保存的锁持有时间、总耗时（JSON）"""
+    store = tm.open_task_store(args.path)
+    tasks = store.load()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    ids, holds, waits = [], [], []
+    for i in range(args.ops):
+        tasks.next_id = store.reserve_ids(1, tasks.next_id)
+        task = tm.Task({"id": tasks.allocate_id(), "project": "并发", "short_desc": f"写入进程{os.getpid()}-{i}",
+                        "priority": "中", "create_time": now, "modified_time": now, "completed": False,
+                        "description_history": [{"version": 1, "content": "", "timestamp": now, "action": "创建"}]})
+        tasks.add(task)
+        start = time.perf_counter()
+        external, fresh, _ = store.append([{"op": "add", "task": task}])
+        waits.append(time.perf_counter() - start)
+        if isinstance(store, tm.JsonTaskStore):
+            holds.append(store.file_lock.hold_seconds)
+        if fresh is not None:
+            tasks = fresh
+        for op in external:
+            tm.apply_task_op(tasks, op)
+        ids.append(task["id"])
+        if store.needs_compaction():
+            store.compact(tasks.freeze(), store.external_reads)
+    store.close()
+    print(json.dumps({"ids": ids, "holds": holds, "waits": waits}))
+
+
+def bench_contention(args):
+    if args.path:
+        contention_child(args)
+        return
+    workdir = tempfile.mkdtemp(prefix="tm_bench_")
+    try:
+        path = os.path.join(workdir, "tasks.db" if args.store == "sqlite" else "tasks.json")
+        command = [sys.executable, os.path.abspath(__file__), "contention", "--ops", str(args.ops), "--path", path]
+        children = [subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+                    for _ in range(args.writers)]
+        results = [json.loads(child.communicate()[0]) for child in children]
+        ids = [i for r in results for i in r["ids"]]
+        loaded = tm.open_task_store(path).load()
+        print(f"{args.writers} 个进程各写入 {args.ops} 个任务（{args.store}）：")
+        for name in ("holds", "waits"):
+            values = sorted(v for r in results for v in r[name])
+            if values:
+                print(f"  {'锁持有' if name == 'holds' else '保存耗时'}  中位数 {values[len(values) // 2] * 1000:.2f}ms  "
+                      f"最大 {values[-1] * 1000:.2f}ms")
+        lost = len(ids) - len(loaded)
+        duplicated = len(ids) - len(set(ids))
+        print(f"  丢失 {lost} 个，ID重复 {duplicated} 个")
+        if lost or duplicated:
+            sys.exit(1)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def bench_folders(args):
+    """新版本文件夹由上一版本填充：与完整复制比较耗时和实际占用"""
+    workdir = tempfile.mkdtemp(prefix="tm_bench_", dir=args.dir)
+    try:
+        rng = random.Random(args.seed)
+        first = os.path.join(workdir, "seeded", "1")
+        for i in range(args.files):
+            folder = os.path.join(first, f"dir{i % 10}")
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f"file{i}.bin"), "wb") as f:
+                f.write(rng.randbytes(args.file_kb * 1024))
+        print(f"{args.files} 个文件，每个 {args.file_kb}KB，共 {args.versions} 个版本（{workdir}）")
+        seeded = [(1, first)]
+        copied = [(1, first)]
+        seed_time = copy_time = 0.0
+        counts = {}
+        for ver in range(2, args.versions + 1):
+            start = time.perf_counter()
+            path = os.path.join(workdir, "seeded", str(ver))
+            for method, n in tm.seed_version_folder(seeded[-1][1], path).items():
+                counts[method] = counts.get(method, 0) + n
+            seed_time += time.perf_counter() - start
+            seeded.append((ver, path))
+            start = time.perf_counter()
+            path = os.path.join(workdir, "copied", str(ver))
+            shutil.copytree(copied[-1][1], path)
+            copy_time += time.perf_counter() - start
+            copied.append((ver, path))
+        print("  填充方式: " + ", ".join(f"{tm.SEED_METHOD_NAMES[m]} {n}" for m, n in counts.items()))
+        for name, elapsed, folders in (("填充", seed_time, seeded), ("完整复制", copy_time, copied)):
+            start = time.perf_counter()
+            report = tm.folder_disk_usage(folders)
+            usage_time = time.perf_counter() - start
+            print(f"  {name:<8} {elapsed * 1000:10.1f}ms  文件大小 {tm.format_size(sum(r[2] for r in report)):>9}  "
+                  f"实际占用 {tm.format_size(sum(r[3] for r in report)):>9}  统计耗时 {usage_time * 1000:.1f}ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="任务记录工具的性能基准测试")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="测量数据层各操作并写出JSON基线")
+    run_parser.add_argument("--sizes", default="1000,10000,100000",
+                            help="任务数量，逗号分隔（默认1000,10000,100000；可加1000000）")
+    run_parser.add_argument("--versions", type=int, default=3, help="每个任务的版本数")
+    run_parser.add_argument("--desc-length", type=int, default=200, help="详细描述的字数")
+    run_parser.add_argument("--no-memory", action="store_true", help="不统计内存峰值（省去第二遍运行）")
+    run_parser.add_argument("--output", default="benchmark_baseline.json", help="结果文件")
+    compare_parser = subparsers.add_parser("compare", help="按基线的参数重新测量并标记退化")
+    compare_parser.add_argument("baseline", help="run 生成的基线文件")
+    compare_parser.add_argument("--threshold", type=float, default=0.25, help="超出基线多少比例算退化（默认0.25）")
+    compare_parser.add_argument("--output", help="同时保存本次结果")
+    subparsers.add_parser("diff", help="版本对比：diff_texts 与 difflib 的耗时对比")
+    rss_parser = subparsers.add_parser("rss", help="比较字典与Task记录两种内存模型的常驻内存")
+    rss_parser.add_argument("--count", type=int, default=1000000, help="任务数量（默认1000000）")
+    rss_parser.add_argument("--model", choices=("dict", "record"), help=argparse.SUPPRESS)
+    contention_parser = subparsers.add_parser("contention", help="多个进程同时写入同一任务文件")
+    contention_parser.add_argument("--writers", type=int, default=4, help="写入进程数（默认4）")
+    contention_parser.add_argument("--ops", type=int, default=500, help="每个进程新建的任务数（默认500）")
+    contention_parser.add_argument("--store", choices=("json", "sqlite"), default="json", help="存储格式")
+    contention_parser.add_argument("--path", help=argparse.SUPPRESS)
+    folders_parser = subparsers.add_parser("folders", help="新版本文件夹的填充（reflink/硬链接）与完整复制对比")
+    folders_parser.add_argument("--files", type=int, default=200, help="上一版本中的文件数（默认200）")
+    folders_parser.add_argument("--file-kb", type=int, default=256, help="每个文件的大小（KB，默认256）")
+    folders_parser.add_argument("--versions", type=int, default=5, help="版本数（默认5）")
+    folders_parser.add_argument("--dir", help="测试目录所在位置（默认系统临时目录，可指定Btrfs/XFS上的目录测试reflink）")
+    args = parser.parse_args(argv)
+    if args.command == "diff":
+        bench_diff(args)
+    elif args.command == "rss":
+        bench_rss(args)
+    elif args.command == "contention":
+        bench_contention(args)
+    elif args.command == "folders":
+        bench_folders(args)
+    elif args.command == "compare":
+        sys.exit(bench_compare(args))
+    else:
+        if args.command is None:
+            # 未指定子命令时按 run 的默认参数运行
+            args = parser.parse_args(list(sys.argv[1:] if argv is None else argv) + ["run"])
+        bench_run(args)
+
+
+if __name__ == "__main__":
+    main()
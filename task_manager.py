@@ -1,16 +1,3661 @@
+import time
 import tkinter as tk
-from tkinter import messagebox, ttk, filedialog
+from tkinter import messagebox, ttk
 import json
 import os
-from datetime import datetime
-import difflib
+import errno
+import stat
+from datetime import datetime, timedelta
 import re
-import subprocess
-import platform
-import uuid
+import sys
+import threading
+import mmap
+import queue
+import select
+import struct
+import bisect
+import itertools
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import operator
+import atexit
+from collections import OrderedDict, deque
+from array import array
+
+# 模块开始执行的时间，用于统计启动到首次绘制窗口的耗时；以上导入都是
+# 标准库模块（合计几十毫秒），不计入
+STARTUP_TIME = time.perf_counter()
+
+# 筛选结果超过该行数时启用虚拟列表：Treeview中只保留可见行和少量预留行
+VIRTUAL_LIST_THRESHOLD = 1000
+# 虚拟列表在可见区域之外额外渲染的行数
+VIRTUAL_LIST_OVERSCAN = 10
+# 可点击排序的列及其排序字段：先按该列，相同时依次按后面的字段，最后按ID
+SORT_COLUMNS = {
+    "project": ("project", "priority", "modified_time"),
+    "priority": ("priority", "modified_time"),
+    "create_time": ("create_time",),
+    "modified_time": ("modified_time",),
+}
+# 排序序列中待调整的任务不超过该数量时逐个用bisect移动，否则一次归并
+SORT_INSORT_LIMIT = 256
+# 统计汇总的时间桶长度（秒），按天分桶
+ROLLUP_BUCKET_SECONDS = 24 * 3600
+# 完成周期的分档上限（天），最后一档为其余
+LEAD_TIME_BINS = (1, 3, 7, 30)
+LEAD_TIME_BIN_SECONDS = tuple(days * 24 * 3600 for days in LEAD_TIME_BINS)
+LEAD_TIME_LABELS = ("1天内", "1-3天", "3-7天", "7-30天", "30天以上")
+# 统计窗口的日期范围选项 -> 包括今天在内的天数（None为全部）
+STATS_RANGES = {"最近7天": 7, "最近30天": 30, "最近90天": 90, "最近一年": 365, "全部": None}
+# 可撤销的批量操作（新建、标记完成、删除、清空已完成）最多保留的步数
+UNDO_LIMIT = 20
+# 操作日志超过该大小（字节）时在后台压缩成新快照
+JOURNAL_COMPACT_THRESHOLD = 4 * 1024 * 1024
+# 压缩时旁路文件中已无任务引用的内容超过该比例（且文件不小于下限）时，改写一个新的旁路文件
+BODIES_DEAD_RATIO = 0.5
+BODIES_SHRINK_MIN_BYTES = 1024 * 1024
+# 版本历史每隔多少个版本保存一次完整内容（关键帧），其余版本只存差量
+HISTORY_KEYFRAME_INTERVAL = 16
+# 已还原版本内容的LRU缓存容量
+VERSION_CACHE_SIZE = 256
+# 差量编码时按字符比对的最大长度，超过后按行比对
+DELTA_CHAR_DIFF_LIMIT = 2000
+# 后台保存的合并窗口（秒）：窗口内的多次修改合并成一次写入
+SAVE_DEBOUNCE_SECONDS = 0.3
+# UI线程检查后台回调的间隔（毫秒）
+UI_POLL_INTERVAL_MS = 50
+# 创建/打开文件夹的后台线程数
+FOLDER_WORKERS = 4
+# 归档：默认归档完成超过多少天的任务、每个分段文件的任务数、内存中缓存的已解压分段数
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_SEGMENT_TASKS = 200
+ARCHIVE_CACHE_SEGMENTS = 8
+ARCHIVE_INDEX_MAGIC = b"TMARCH01"
+# lzma压缩级别：3比默认的6快约3倍，压缩后只大约20%
+ARCHIVE_XZ_PRESET = 3
+# 新版本文件夹由上一版本填充时，进度回调的最小间隔（秒）
+SEED_PROGRESS_SECONDS = 0.2
+SEED_METHOD_NAMES = {"reflink": "共享数据块", "hardlink": "硬链接", "copy": "复制", "symlink": "符号链接"}
+# Linux ioctl：FICLONE 让两个文件共享数据块；FS_IOC_FIEMAP 读取文件的物理区段
+FICLONE = 0x40049409
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_MAX_OFFSET = 2 ** 64 - 1
+FIEMAP_EXTENT_COUNT = 64
+FIEMAP_EXTENT_LAST = 0x1
+FIEMAP_EXTENT_SHARED = 0x2000
+# 位置未知、延迟分配或内联在元数据中的区段，物理位置不能用来去重
+FIEMAP_EXTENT_NO_PHYSICAL = 0x2 | 0x4 | 0x200
+# 搜索框输入停顿多久后执行搜索（毫秒）
+SEARCH_DEBOUNCE_MS = 200
+# 版本对比时Myers算法每段的最大搜索步数，超过后按启发式切分，保证耗时与长度成线性关系
+DIFF_SEARCH_LIMIT = 64
+# 版本对比结果的缓存条数
+DIFF_CACHE_SIZE = 64
+# SQLite变更表保留的最近操作条数，落后更多的实例改为整体重新加载
+SQLITE_OPS_KEEP = 10000
+# 监视数据文件：inotify不可用时轮询文件大小和修改时间的间隔（秒），以及合并连续变化的等待时间（秒）
+WATCH_POLL_SECONDS = 1.0
+WATCH_DEBOUNCE_SECONDS = 0.1
+# inotify事件：IN_MODIFY | IN_MOVED_TO | IN_CREATE | IN_DELETE
+INOTIFY_MASK = 0x2 | 0x80 | 0x100 | 0x200
+# 批量导入时每批读入和校验的记录数
+IMPORT_CHUNK_SIZE = 1000
+# 批量导入时最多报告的错误条数
+IMPORT_ERROR_LIMIT = 20
+# 启动时后台线程每批交给界面的任务数，以及加载期间刷新列表的最小间隔（毫秒）
+LOAD_CHUNK_SIZE = 2000
+LOAD_REFRESH_MS = 300
+# 耗时追踪：开启用的环境变量、默认输出文件、环形缓冲区容量和状态栏刷新间隔（毫秒）
+TRACE_ENV_VAR = "TASK_MANAGER_TRACE"
+TRACE_DEFAULT_FILE = "task_manager_trace.json"
+TRACE_BUFFER_SIZE = 10000
+TRACE_STATUS_INTERVAL_MS = 200
+# 开启追踪时包装的TaskManager方法、存储方法和模块函数
+TRACED_METHODS = ("feed_loaded_tasks", "save_tasks", "update_task_list", "render_rows", "show_task_detail",
+                  "generate_folder_path", "provision_folders", "provision_version_folder", "open_task_folder",
+                  "on_tasks_archived", "restore_archived_tasks", "show_statistics")
+TRACED_ARCHIVE_METHODS = ("add", "read_segment", "remove")
+TRACED_STORE_METHODS = ("load", "append", "write_snapshot", "rewrite", "commit_batch", "read_version")
+TRACED_FUNCTIONS = ("make_folder", "seed_version_folder", "folder_disk_usage", "launch_file_manager", "diff_texts")
+# 导出CSV的列：每行一个版本
+EXPORT_CSV_COLUMNS = ("id", "project", "short_desc", "priority", "completed", "create_time", "modified_time",
+                      "version", "timestamp", "action", "folder_path", "content")
+
+
+def upgrade_legacy_task(t):
+    """补全旧版本数据缺失的字段"""
+    if "description_history" not in t:
+        t["description_history"] = [{"version": 1, "timestamp": t["create_time"], "action": "创建"}]
+    if "modified_time" not in t:
+        t["modified_time"] = t["create_time"]
+    return t
+
+
+# 内存中的时间字段存为自1970-01-01起的整数秒（按字面值换算，不涉及时区）
+TIME_RE = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}\Z")
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+# 优先级在内存中存为序号，序号顺序即优先级从高到低
+PRIORITY_LEVELS = ("高", "中", "低")
+PRIORITY_CODES = {p: i for i, p in enumerate(PRIORITY_LEVELS)}
+# completed_time 是标记完成的时间，之前的数据中没有
+TASK_FIELDS = ("id", "project", "short_desc", "priority", "create_time", "modified_time", "completed",
+               "completed_time", "description_history")
+VERSION_FIELDS = ("version", "content", "delta", "timestamp", "action", "folder_path", "body")
+
+
+def pack_time(value):
+    """把 "YYYY-MM-DD HH:MM:SS" 换算成整数秒；其他格式的值原样保留"""
+    return parse_time_text(value) if value.__class__ is str else value
+
+
+@functools.lru_cache(maxsize=4096)
+def parse_time_text(value):
+    # 同一任务的创建、修改和版本时间大多相同，缓存后换算一次，结果也共用同一个整数对象
+    if TIME_RE.match(value):
+        try:
+            return (datetime(int(value[:4]), int(value[5:7]), int(value[8:10]),
+                             int(value[11:13]), int(value[14:16]), int(value[17:])) - EPOCH) // ONE_SECOND
+        except ValueError:
+            pass
+    return value
+
+
+def unpack_time(value):
+    """pack_time的逆运算，显示和保存时才格式化"""
+    if value.__class__ is int:
+        return (EPOCH + timedelta(seconds=value)).isoformat(" ")
+    return value
+
+
+def pack_priority(value):
+    return PRIORITY_CODES.get(value, value)
+
+
+def unpack_priority(value):
+    return PRIORITY_LEVELS[value] if value.__class__ is int else value
+
+
+def pack_text(value):
+    """项目名、版本操作等取值很少的字符串驻留，相同的值共用一个对象"""
+    return sys.intern(value) if value.__class__ is str else value
+
+
+def pack_history(history):
+    return [as_version(v) for v in history]
+
+
+def pack_body(ref):
+    return tuple(ref)
+
+
+class Record:
+    """用 __slots__ 保存固定字段的记录，按字典的方式访问
+
+    子类在 packers/unpackers 中指定字段存入和读出时的转换；r["key"]、
+    r.get、r.update、dict(r) 等读写的都是原来的值，属性上保存紧凑的
+    值。未赋值的字段视为不存在，不在 fields 中的字段放在 extra 字典里，
+    因此与JSON格式无损往返。
+    """
+
+    __slots__ = ()
+    fields = ()
+    field_set = frozenset()
+    packers = {}
+    unpackers = {}
+
+    def __init__(self, mapping=()):
+        self.extra = None
+        # 与update相同，展开写以加快加载
+        field_set, packers = self.field_set, self.packers
+        for key, value in (mapping.items() if hasattr(mapping, "items") else mapping):
+            if key in field_set:
+                pack = packers.get(key)
+                setattr(self, key, value if pack is None else pack(value))
+            else:
+                self[key] = value
+
+    def __getitem__(self, key):
+        if key in self.field_set:
+            try:
+                value = getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            unpack = self.unpackers.get(key)
+            return value if unpack is None else unpack(value)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in self.field_set:
+            pack = self.packers.get(key)
+            setattr(self, key, value if pack is None else pack(value))
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.field_set:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in self.field_set:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def keys(self):
+        keys = [k for k in self.fields if hasattr(self, k)]
+        if self.extra:
+            keys.extend(self.extra)
+        return keys
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key, *default):
+        try:
+            value = self[key]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[key]
+        return value
+
+    def update(self, mapping=(), **kwargs):
+        items = mapping.items() if hasattr(mapping, "items") else mapping
+        for key, value in itertools.chain(items, kwargs.items()):
+            self[key] = value
+
+    def to_dict(self):
+        return {k: self[k] for k in self.keys()}
+
+    def copy(self):
+        """浅复制：属性上的紧凑值直接共用，extra另复制一份"""
+        clone = object.__new__(type(self))
+        for key in self.fields:
+            try:
+                setattr(clone, key, getattr(self, key))
+            except AttributeError:
+                pass
+        clone.extra = None if self.extra is None else dict(self.extra)
+        return clone
+
+
+class Version(Record):
+    """版本记录；时间存为整数秒，旁路文件引用存为元组"""
+
+    __slots__ = VERSION_FIELDS + ("extra",)
+    fields = VERSION_FIELDS
+    field_set = frozenset(VERSION_FIELDS)
+    packers = {"timestamp": pack_time, "action": pack_text, "body": pack_body}
+    unpackers = {"timestamp": unpack_time}
+
+
+class Task(Record):
+    """任务记录；项目名驻留、优先级存为序号、时间存为整数秒，版本为Version
+
+    排序、统计等需要紧凑值的地方直接读属性（t.priority、t.create_time）。
+    """
+
+    __slots__ = TASK_FIELDS + ("extra",)
+    fields = TASK_FIELDS
+    field_set = frozenset(TASK_FIELDS)
+    packers = {"project": pack_text, "priority": pack_priority, "create_time": pack_time,
+               "modified_time": pack_time, "completed_time": pack_time, "description_history": pack_history}
+    unpackers = {"priority": unpack_priority, "create_time": unpack_time, "modified_time": unpack_time,
+                 "completed_time": unpack_time}
+
+    def copy(self):
+        """浅复制；版本列表另复制一份，版本记录本身共用"""
+        clone = super().copy()
+        if hasattr(self, "description_history"):
+            clone.description_history = list(self.description_history)
+        return clone
+
+    def to_dict(self):
+        record = super().to_dict()
+        if "description_history" in record:
+            record["description_history"] = [v.to_dict() if isinstance(v, Record) else v
+                                             for v in record["description_history"]]
+        return record
+
+
+def as_version(ver):
+    return ver if isinstance(ver, Version) else Version(ver)
+
+
+def as_task(task):
+    return task if isinstance(task, Task) else Task(task)
+
+
+def record_json(obj):
+    """json.dumps 的 default 参数：把Task/Version转为字典"""
+    if isinstance(obj, Record):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# 各排序字段的取值：直接读Task属性上的紧凑值，无法换算的值排在最前（时间）或最后（优先级）
+SORT_FIELD_VALUES = {
+    "project": lambda t: t.project if t.project.__class__ is str else "",
+    "priority": lambda t: t.priority if t.priority.__class__ is int else len(PRIORITY_LEVELS),
+    "create_time": lambda t: t.create_time if t.create_time.__class__ is int else float("-inf"),
+    "modified_time": lambda t: t.modified_time if t.modified_time.__class__ is int else float("-inf"),
+}
+
+
+ID_OF_KEY = operator.itemgetter(-1)
+
+
+class SortOrder:
+    """按一组字段排好序的任务序列，供列表按列排序使用
+
+    order 是有序的排序键列表（键的最后一项是任务ID），keys 记录每个
+    任务当前的键。任务增删改时只记下ID，下次读取时再调整：数量少时
+    用bisect逐个移动，数量多时把新键整体排序后与原序列归并，都不必
+    重新排序全部任务。按完成状态筛选后的任务列表也缓存起来，序列或
+    完成状态变化时作废。
+    """
+
+    def __init__(self, fields, tasks):
+        self.fields = fields
+        self.fields_set = frozenset(fields)
+        self.values = [SORT_FIELD_VALUES[f] for f in fields]
+        self.tasks = tasks
+        self.changed = set()
+        # 完成状态筛选（None为全部）-> 按顺序排列的任务列表
+        self.views = {}
+        self.keys = {t.id: self.key(t) for t in tasks}
+        self.order = sorted(self.keys.values())
+
+    def key(self, task):
+        return tuple(value(task) for value in self.values) + (task.id,)
+
+    def mark(self, task_id):
+        self.changed.add(task_id)
+        self.views.clear()
+
+    def refresh(self):
+        changed, self.changed = self.changed, set()
+        if not changed:
+            return
+        self.views.clear()
+        keys, order = self.keys, self.order
+        if len(changed) <= SORT_INSORT_LIMIT:
+            for tid in changed:
+                old = keys.pop(tid, None)
+                if old is not None:
+                    del order[bisect.bisect_left(order, old)]
+                task = self.tasks.get(tid)
+                if task is not None:
+                    keys[tid] = key = self.key(task)
+                    bisect.insort(order, key)
+            return
+        order = [k for k in order if k[-1] not in changed]
+        fresh = []
+        for tid in changed:
+            keys.pop(tid, None)
+            task = self.tasks.get(tid)
+            if task is not None:
+                keys[tid] = key = self.key(task)
+                fresh.append(key)
+        fresh.sort()
+        # 两段各自有序，Timsort按两个有序段归并，耗时是线性的
+        order.extend(fresh)
+        order.sort()
+        self.order = order
+
+    def tasks_in_order(self, completed=None, ids=None):
+        """按顺序返回任务，可按完成状态和ID集合（搜索结果）过滤
+
+        返回的列表可能是缓存，调用方不能修改。
+        """
+        self.refresh()
+        by_id = self.tasks.by_id
+        members = by_id if completed is None else self.tasks.status_members[completed]
+        if ids is not None and len(ids) * 8 < len(self.order):
+            # 结果较少时只对结果排序
+            found = sorted(self.keys[tid] for tid in ids if tid in members)
+            return [members[k[-1]] for k in found]
+        if ids is not None:
+            ordered = filter(ids.__contains__, map(ID_OF_KEY, self.order))
+            return list(map(members.__getitem__, filter(members.__contains__, ordered)))
+        view = self.views.get(completed)
+        if view is None:
+            # 用map/filter在C层完成，百万任务时也只需几十毫秒
+            ordered = map(ID_OF_KEY, self.order)
+            if completed is not None:
+                ordered = filter(members.__contains__, ordered)
+            view = self.views[completed] = list(map(members.__getitem__, ordered))
+        return view
+
+
+class TimeRollup:
+    """按天分桶的统计汇总，供统计窗口使用
+
+    每个序列是一个 array('q')，下标为距 base 的天数，所有序列覆盖同一段
+    日期。任务增删改时由 TaskCollection 增减对应桶的计数，查询任意日期
+    范围只需对各序列切片求和，耗时与天数相关，与任务数无关。序列按
+    (指标, 键) 命名：
+      ("created", 项目)、("completed", 项目)、("edits", 项目)：新建、完成、修改次数
+      ("lead", 项目)：完成周期（秒）之和，除以完成数即平均周期
+      ("created_priority", 优先级)、("completed_priority", 优先级)：优先级构成
+      ("lead_bin", 档位)：完成周期分布，档位见 LEAD_TIME_BINS
+    数据中没有单独的完成时间，已完成任务的修改时间即视为完成时间。
+    """
+
+    def __init__(self, tasks=()):
+        self.base = None
+        self.size = 0
+        self.series = {}
+        # 每次计数加一，窗口据此判断是否需要重绘
+        self.changes = 0
+        tasks = list(tasks)
+        # 先按创建和修改时间的范围一次分配好，避免逐天扩展
+        created = [t.create_time for t in tasks if t.create_time.__class__ is int]
+        modified = [t.modified_time for t in tasks if t.modified_time.__class__ is int]
+        if created and modified:
+            self.reserve(min(created) // ROLLUP_BUCKET_SECONDS, max(modified) // ROLLUP_BUCKET_SECONDS)
+        for t in tasks:
+            self.count_task(t, 1)
+            self.count_versions(t, t.description_history[1:], 1)
+
+    def reserve(self, first, last):
+        """扩展所有序列，使其覆盖第first到last天"""
+        if self.base is None:
+            self.base = first
+        front = max(self.base - first, 0)
+        back = max(last - (self.base + self.size - 1), 0)
+        if not (front or back):
+            return
+        for arr in self.series.values():
+            if front:
+                arr[0:0] = array("q", bytes(8 * front))
+            if back:
+                arr.frombytes(bytes(8 * back))
+        self.base -= front
+        self.size += front + back
+
+    def day(self, seconds):
+        """时间（整数秒）所在的天，必要时扩展序列；无法换算的时间返回None"""
+        if seconds.__class__ is not int:
+            return None
+        day = seconds // ROLLUP_BUCKET_SECONDS
+        if self.base is None or not self.base <= day < self.base + self.size:
+            self.reserve(day, day)
+        return day
+
+    def add(self, key, day, amount):
+        arr = self.series.get(key)
+        if arr is None:
+            arr = self.series[key] = array("q", bytes(8 * self.size))
+        arr[day - self.base] += amount
+
+    def count_task(self, task, delta):
+        """把任务的新建、完成计入（delta=1）或移出（delta=-1）对应的桶"""
+        self.changes += 1
+        project, priority = task.project, task.priority
+        created = self.day(task.create_time)
+        if created is not None:
+            self.add(("created", project), created, delta)
+            self.add(("created_priority", priority), created, delta)
+        if not task.completed:
+            return
+        done = self.day(task.modified_time)
+        if done is None:
+            return
+        self.add(("completed", project), done, delta)
+        self.add(("completed_priority", priority), done, delta)
+        if created is not None:
+            lead = max(task.modified_time - task.create_time, 0)
+            self.add(("lead", project), done, delta * lead)
+            self.add(("lead_bin", bisect.bisect_right(LEAD_TIME_BIN_SECONDS, lead)), done, delta)
+
+    def count_versions(self, task, versions, delta):
+        """把任务的若干版本作为修改计入或移出（第一个版本是创建，不算修改）"""
+        self.changes += 1
+        key = ("edits", task.project)
+        for ver in versions:
+            day = self.day(getattr(ver, "timestamp", None))
+            if day is not None:
+                self.add(key, day, delta)
+
+    def query(self, first=None, last=None):
+        """第first到last天（含两端，None为不限）各序列的合计 {键: 合计}，省略合计为0的序列"""
+        if self.base is None:
+            return {}
+        lo = 0 if first is None else max(first - self.base, 0)
+        hi = self.size if last is None else min(last - self.base + 1, self.size)
+        if lo >= hi:
+            return {}
+        totals = {}
+        for key, arr in self.series.items():
+            n = sum(arr[lo:hi])
+            if n:
+                totals[key] = n
+        return totals
+
+
+def parse_day(text):
+    """"YYYY-MM-DD" -> 自1970-01-01起的天数，空白为None，格式不对时抛出ValueError"""
+    text = text.strip()
+    if not text:
+        return None
+    return (datetime.strptime(text, "%Y-%m-%d") - EPOCH).days
+
+
+def format_day(day):
+    return (EPOCH + timedelta(days=day)).strftime("%Y-%m-%d")
+
+
+class TaskSnapshot:
+    """TaskCollection在某一时刻的只读视图（写时复制），由 TaskCollection.freeze() 建立
+
+    建立时只复制ID到任务的映射，不复制任务。之后集合原地修改某个任务
+    之前，先把修改前的副本交给快照（preserve）。后台线程遍历时优先用
+    这些副本，否则自己复制当前的任务，复制完再查一次：期间集合开始
+    修改它的话，副本一定已经留下。UI线程只需复制被修改的任务。
+    """
+
+    def __init__(self, tasks):
+        self.owner = tasks
+        self.by_id = dict(tasks.by_id)
+        self.next_id = tasks.next_id
+        self.saved = {}
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __iter__(self):
+        """依次生成各任务在快照时刻的副本（Task.copy），可在后台线程中调用"""
+        saved = self.saved
+        for tid, task in self.by_id.items():
+            copy = saved.get(tid)
+            if copy is None:
+                copy = task.copy()
+                copy = saved.get(tid, copy)
+            yield copy
+
+    def preserve(self, task):
+        tid = task.id
+        if tid not in self.saved and self.by_id.get(tid) is task:
+            self.saved[tid] = task.copy()
+
+    def release(self):
+        """用完后解除冻结（可在后台线程中调用）"""
+        if self.owner.frozen is self:
+            self.owner.frozen = None
+
+
+class TaskCollection:
+    """内存中的任务集合：按任务ID索引，按ID顺序遍历
+
+    ID单调分配、删除后不再复用（next_id随数据一起持久化），通常插入
+    顺序就是ID顺序；撤销删除或合并其他实例新建的任务时加回较小的ID，
+    下次遍历前重新排一次。
+    集合同时维护实时计数（总数、已完成、按优先级、按项目）、按完成状态
+    划分的成员集合和各排序列的有序序列，修改任务的completed/priority/
+    project/modified_time必须通过update、增删版本必须通过add_version/
+    remove_versions，计数、排序、统计汇总和快照（freeze）才能保持同步。
+    """
+
+    def __init__(self, tasks=(), next_id=1):
+        self.by_id = {}
+        self.next_id = next_id
+        self.completed_count = 0
+        self.priority_counts = {}
+        self.project_counts = {}
+        # 完成状态 -> {任务ID: 任务}
+        self.status_members = {False: {}, True: {}}
+        # 排序列 -> SortOrder，第一次按该列排序时建立
+        self.sort_orders = {}
+        # 按天分桶的统计汇总（TimeRollup），第一次打开统计窗口时建立
+        self.rollup = None
+        # 后台压缩正在使用的快照（TaskSnapshot），原地修改任务前先留下副本
+        self.frozen = None
+        # 加入过ID小于末尾任务的任务，by_id需要重新按ID排列
+        self.unordered = False
+        for t in tasks:
+            self.add(t)
+
+    def __iter__(self):
+        self.restore_order()
+        return iter(self.by_id.values())
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, task_id):
+        return task_id in self.by_id
+
+    def get(self, task_id):
+        return self.by_id.get(task_id)
+
+    def ids(self):
+        self.restore_order()
+        return self.by_id.keys()
+
+    def restore_order(self):
+        if self.unordered:
+            # 大部分已经有序，排序接近线性
+            self.by_id = dict(sorted(self.by_id.items()))
+            self.unordered = False
+
+    def allocate_id(self):
+        task_id = self.next_id
+        self.next_id += 1
+        return task_id
+
+    def count_task(self, task, delta):
+        """把任务计入（delta=1）或移出（delta=-1）各项计数"""
+        completed = bool(task["completed"])
+        if completed:
+            self.completed_count += delta
+        if delta > 0:
+            self.status_members[completed][task["id"]] = task
+        else:
+            self.status_members[completed].pop(task["id"], None)
+        for counts, key in ((self.priority_counts, task["priority"]), (self.project_counts, task["project"])):
+            n = counts.get(key, 0) + delta
+            if n:
+                counts[key] = n
+            else:
+                del counts[key]
+        if self.rollup is not None:
+            self.rollup.count_task(task, delta)
+
+    def count_edits(self, task, delta):
+        """把任务的修改版本计入或移出统计汇总"""
+        if self.rollup is not None:
+            self.rollup.count_versions(task, task.description_history[1:], delta)
+
+    def add(self, task):
+        old = self.by_id.get(task["id"])
+        if old is not None:
+            self.count_task(old, -1)
+            self.count_edits(old, -1)
+        elif self.by_id and task["id"] < next(reversed(self.by_id)):
+            self.unordered = True
+        self.by_id[task["id"]] = task
+        self.count_task(task, 1)
+        self.count_edits(task, 1)
+        for order in self.sort_orders.values():
+            order.mark(task["id"])
+        if task["id"] >= self.next_id:
+            self.next_id = task["id"] + 1
+
+    def update(self, task_id, fields):
+        """修改任务字段并同步计数，返回被修改的任务（不存在时为None）"""
+        task = self.by_id.get(task_id)
+        if task is None:
+            return None
+        # 修改次数按项目统计，只在项目或版本列表变化时重新计入
+        recount = "project" in fields or "description_history" in fields
+        self.preserve(task)
+        self.count_task(task, -1)
+        if recount:
+            self.count_edits(task, -1)
+        task.update(fields)
+        self.count_task(task, 1)
+        if recount:
+            self.count_edits(task, 1)
+        for order in self.sort_orders.values():
+            if not order.fields_set.isdisjoint(fields):
+                order.mark(task_id)
+            elif "completed" in fields:
+                order.views.clear()
+        return task
+
+    def remove(self, task_ids):
+        """删除指定ID的任务，返回被删除的任务列表"""
+        removed = []
+        for tid in task_ids:
+            t = self.by_id.pop(tid, None)
+            if t is not None:
+                self.count_task(t, -1)
+                self.count_edits(t, -1)
+                removed.append(t)
+        if removed:
+            for order in self.sort_orders.values():
+                order.changed.update(t["id"] for t in removed)
+                order.views.clear()
+        return removed
+
+    def add_version(self, task_id, version):
+        """给任务追加一个版本，修改时间随之更新为版本时间，返回任务（不存在时为None）"""
+        task = self.by_id.get(task_id)
+        if task is None:
+            return None
+        version = as_version(version)
+        self.preserve(task)
+        task["description_history"].append(version)
+        if self.rollup is not None:
+            self.rollup.count_versions(task, (version,), 1)
+        return self.update(task_id, {"modified_time": version["timestamp"]})
+
+    def remove_versions(self, task_id, versions):
+        """从任务历史中撤下指定的版本记录（按对象比较），返回任务（不存在时为None）"""
+        task = self.by_id.get(task_id)
+        if task is None:
+            return None
+        removed = {id(v) for v in versions}
+        self.update(task_id, {"description_history": [v for v in task["description_history"] if id(v) not in removed]})
+        return task
+
+    def preserve(self, task):
+        """原地修改任务之前调用：有快照时先给快照留下修改前的副本"""
+        snapshot = self.frozen
+        if snapshot is not None:
+            snapshot.preserve(task)
+
+    def freeze(self):
+        """建立当前时刻的快照（TaskSnapshot），供后台线程遍历；同一时刻只有一个"""
+        self.restore_order()
+        self.frozen = TaskSnapshot(self)
+        return self.frozen
+
+    def batch(self, label=""):
+        """开始一组修改，用于 with 语句，见 TaskBatch"""
+        return TaskBatch(self, label)
+
+    def with_status(self, completed):
+        """按ID顺序返回指定完成状态的任务，耗时与结果数量相关"""
+        members = self.status_members[bool(completed)]
+        return [members[tid] for tid in sorted(members)]
+
+    def sort_order(self, column):
+        """取按列排序的序列（SORT_COLUMNS中的列），第一次使用时建立，之后增量维护"""
+        order = self.sort_orders.get(column)
+        if order is None:
+            order = self.sort_orders[column] = SortOrder(SORT_COLUMNS[column], self)
+        return order
+
+    def time_rollup(self):
+        """按天分桶的统计汇总，第一次使用时建立，之后随修改增量维护"""
+        if self.rollup is None:
+            self.rollup = TimeRollup(self.by_id.values())
+        return self.rollup
+
+    def stats(self):
+        """当前计数的快照，供状态栏、导出和报表使用"""
+        return {
+            "total": len(self.by_id),
+            "completed": self.completed_count,
+            "pending": len(self.by_id) - self.completed_count,
+            "by_priority": dict(self.priority_counts),
+            "by_project": dict(self.project_counts),
+        }
+
+
+class TaskBatch:
+    """TaskCollection上的一组修改（事务），由 TaskCollection.batch() 创建
+
+    通过 add/update/remove 修改集合，同时记下要写入日志的操作 ops 和
+    撤销用的逆操作 inverse（倒序应用即还原）。逆操作只引用被删除的
+    任务对象和被修改字段的旧值，撤销“清空已完成”等大批删除也不需要
+    复制任务集合。with 块中抛出异常时自动撤销已做的修改。
+    """
+
+    def __init__(self, tasks, label):
+        self.tasks = tasks
+        self.label = label
+        self.ops = []
+        self.inverse = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            revert_task_ops(self.tasks, self.inverse)
+            self.ops, self.inverse = [], []
+
+    def __len__(self):
+        return len(self.ops)
+
+    def add(self, task):
+        self.tasks.add(task)
+        self.ops.append({"op": "add", "task": task})
+        self.inverse.append({"op": "delete", "ids": [task["id"]]})
+
+    def update(self, task_id, fields):
+        """修改任务字段（只记录值确实改变的字段），返回任务（不存在时为None）"""
+        task = self.tasks.get(task_id)
+        if task is None:
+            return None
+        old = {k: task[k] for k in fields if k in task}
+        fields = {k: v for k, v in fields.items() if old.get(k, v) != v or k not in old}
+        if fields:
+            self.tasks.update(task_id, fields)
+            self.ops.append({"op": "update", "id": task_id, "fields": fields})
+            self.inverse.append({"op": "update", "id": task_id, "fields": {k: old[k] for k in fields if k in old}})
+        return task
+
+    def remove(self, task_ids):
+        """删除任务（ID可以是任意可迭代对象），返回被删除的任务列表"""
+        removed = self.tasks.remove(task_ids)
+        if removed:
+            self.ops.append({"op": "delete", "ids": [t["id"] for t in removed]})
+            self.inverse.append({"op": "restore", "tasks": removed})
+        return removed
+
+    def touched_ids(self):
+        """本批次添加、修改或删除的任务ID"""
+        ids = set()
+        for op in self.ops:
+            if op["op"] == "add":
+                ids.add(op["task"]["id"])
+            elif op["op"] == "update":
+                ids.add(op["id"])
+            elif op["op"] == "delete":
+                ids.update(op["ids"])
+        return ids
+
+    def revert(self, inverse):
+        """按倒序应用另一组修改的逆操作（撤销），本批次同样记下日志操作和逆操作"""
+        for op in reversed(inverse):
+            if op["op"] == "restore":
+                for task in op["tasks"]:
+                    self.add(task)
+            elif op["op"] == "update":
+                self.update(op["id"], op["fields"])
+            elif op["op"] == "delete":
+                self.remove(op["ids"])
+
+
+def revert_task_ops(tasks, inverse):
+    """直接按倒序应用逆操作（不记录），用于事务出错时回滚"""
+    TaskBatch(tasks, "").revert(inverse)
+
+
+def apply_task_op(tasks, op):
+    """把一条日志操作应用到任务集合上（加载时重放日志用）"""
+    kind = op["op"]
+    if kind == "add":
+        tasks.add(as_task(upgrade_legacy_task(op["task"])))
+        return
+    if kind == "delete":
+        tasks.remove(op["ids"])
+        return
+    if kind == "update":
+        tasks.update(op["id"], op["fields"])
+    elif kind == "version":
+        tasks.add_version(op["id"], op["version"])
+
+
+def encode_delta(old, new):
+    """计算把old变为new的差量
+
+    差量是一个列表：正整数表示从old复制若干字符，负整数表示跳过old中
+    若干字符，字符串表示插入的文本。先去掉公共前后缀，剩余部分较短时
+    按字符比对，较长时按行比对。
+    """
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    limit -= prefix
+    while suffix < limit and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    old_mid = old[prefix:len(old) - suffix]
+    new_mid = new[prefix:len(new) - suffix]
+
+    delta = []
+
+    def emit(item):
+        # 合并相邻的同类操作
+        if delta and type(delta[-1]) is type(item) and (isinstance(item, str) or (delta[-1] > 0) == (item > 0)):
+            delta[-1] += item
+        else:
+            delta.append(item)
+
+    if prefix:
+        emit(prefix)
+    if old_mid and new_mid:
+        if len(old_mid) + len(new_mid) <= DELTA_CHAR_DIFF_LIMIT:
+            a, b = old_mid, new_mid
+        else:
+            a, b = old_mid.splitlines(keepends=True), new_mid.splitlines(keepends=True)
+        join = "".join
+        for tag, i1, i2, j1, j2 in myers_opcodes(a, b):
+            if tag == "equal":
+                emit(len(join(a[i1:i2])))
+            else:
+                if i2 > i1:
+                    emit(-len(join(a[i1:i2])))
+                if j2 > j1:
+                    emit(join(b[j1:j2]))
+    elif old_mid:
+        emit(-len(old_mid))
+    elif new_mid:
+        emit(new_mid)
+    if suffix:
+        emit(suffix)
+    return delta
+
+
+def apply_delta(old, delta):
+    """把encode_delta得到的差量应用到old上"""
+    parts = []
+    pos = 0
+    for item in delta:
+        if isinstance(item, str):
+            parts.append(item)
+        elif item > 0:
+            parts.append(old[pos:pos + item])
+            pos += item
+        else:
+            pos -= item
+    return "".join(parts)
+
+
+def is_delta_version(ver):
+    """版本记录是否以差量存储（内容在旁路文件中时看引用上的标记）"""
+    return "delta" in ver or ("body" in ver and bool(ver["body"][2]))
+
+
+class VersionContentCache:
+    """按差量存储的版本内容的还原与LRU缓存
+
+    版本记录带 "content" 的是关键帧，带 "delta" 的需要从前一个关键帧
+    开始依次应用差量还原；带 "body" 的内容还在旁路文件中，通过
+    version_reader（JsonTaskStore.read_version）按需读取。还原结果按
+    (任务ID, 版本号) 缓存。
+    """
+
+    def __init__(self, capacity=VERSION_CACHE_SIZE, version_reader=None):
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        self.version_reader = version_reader
+
+    def payload(self, ver):
+        """版本的内容或差量；内容不在内存中时从旁路文件读取"""
+        if self.version_reader is not None:
+            return self.version_reader(ver)
+        return ver
+
+    def content(self, task, ver):
+        """取任意版本的完整内容"""
+        # 只读一次：其他线程可能正把内容换成旁路文件中的引用
+        text = ver.get("content")
+        if text is not None:
+            return text
+        key = (task["id"], ver["version"])
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            return cached
+        if not is_delta_version(ver):
+            # 内容已换成引用时从旁路文件读取；旧数据中没有内容的版本为空
+            text = self.payload(ver).get("content", "")
+            self.put(key, text)
+            return text
+        history = task["description_history"]
+        index = ver["version"] - 1
+        if not (0 <= index < len(history) and history[index] is ver):
+            index = next(i for i, v in enumerate(history) if v is ver)
+        # 向前找到最近的关键帧或已缓存的版本
+        start = index
+        text = None
+        while start > 0:
+            start -= 1
+            prev = history[start]
+            text = self.cache.get((task["id"], prev["version"]))
+            if text is not None:
+                break
+            if not is_delta_version(prev):
+                text = self.payload(prev).get("content", "")
+                break
+        if text is None:
+            text = ""
+        for v in history[start + 1:index + 1]:
+            text = apply_delta(text, self.payload(v)["delta"])
+        self.put(key, text)
+        return text
+
+    def put(self, key, text):
+        self.cache[key] = text
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.capacity:
+            self.cache.popitem(last=False)
+
+    def invalidate(self, task_id=None):
+        """丢弃某个任务（task_id为None时为全部任务）的缓存内容，版本号被重新分配后使用"""
+        if task_id is None:
+            self.cache.clear()
+            return
+        for key in [key for key in self.cache if key[0] == task_id]:
+            del self.cache[key]
+
+    def make_version(self, task, version_num, content, **fields):
+        """生成新版本记录：距上一个关键帧满 HISTORY_KEYFRAME_INTERVAL 个版本时存完整内容，否则存差量"""
+        history = task["description_history"]
+        since_keyframe = 0
+        for v in reversed(history):
+            if not is_delta_version(v):
+                break
+            since_keyframe += 1
+        ver = Version({"version": version_num})
+        if not history or since_keyframe + 1 >= HISTORY_KEYFRAME_INTERVAL:
+            ver["content"] = content
+        else:
+            ver["delta"] = encode_delta(self.content(task, history[-1]), content)
+            self.put((task["id"], version_num), content)
+        ver.update(fields)
+        return ver
+
+    def reencode(self, task):
+        """把任务的全部历史重新按关键帧+差量编码（转换旧文件用）"""
+        contents = [self.content(task, v) for v in task["description_history"]]
+        history = task["description_history"]
+        task["description_history"] = []
+        for ver, content in zip(history, contents):
+            fields = {k: v for k, v in ver.items() if k not in ("version", "content", "delta", "body")}
+            task["description_history"].append(self.make_version(task, ver["version"], content, **fields))
+
+
+# 按句切分文本（换行和中文句末标点），作为差异比对的第一层粒度
+DIFF_SEGMENT_RE = re.compile(r"[^\n。！？；]*[\n。！？；]|[^\n。！？；]+")
+
+
+def middle_snake(a, alo, ahi, b, blo, bhi, max_d):
+    """Myers算法的中间蛇形：从两端同时搜索，只用线性空间
+
+    返回 (蛇形起点x, 起点y, 终点x, 终点y)，坐标相对alo/blo。搜索超过
+    max_d 步仍未相遇时，改为在正向走得最远的位置切分（结果可能不是
+    最短编辑，但总耗时与长度成线性关系）。
+    """
+    n, m = ahi - alo, bhi - blo
+    delta = n - m
+    odd = delta & 1
+    limit = min((n + m + 1) // 2, max_d)
+    offset = limit + 1
+    forward = [0] * (2 * offset + 1)
+    backward = [0] * (2 * offset + 1)
+    for d in range(limit + 1):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1) and x + backward[offset + delta - k] >= n:
+                return x0, y0, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d and x + forward[offset + delta - k] >= n:
+                return n - x, m - y, n - x0, m - y0
+    best = None
+    for k in range(-limit, limit + 1, 2):
+        x = forward[offset + k]
+        y = x - k
+        if x <= n and 0 <= y <= m and (best is None or x + y > best[0] + best[1]):
+            best = (x, y)
+    return best[0], best[1], best[0], best[1]
+
+
+def myers_opcodes(a, b, max_d=DIFF_SEARCH_LIMIT):
+    """比较两个序列，返回与 difflib.SequenceMatcher.get_opcodes 相同格式的操作列表
+
+    使用线性空间的Myers算法分治求最短编辑脚本。
+    """
+    ops = []
+
+    def emit(tag, i1, i2, j1, j2):
+        if i1 == i2 and j1 == j2:
+            return
+        if ops and ops[-1][0] == tag:
+            ops[-1] = (tag, ops[-1][1], i2, ops[-1][3], j2)
+        else:
+            ops.append((tag, i1, i2, j1, j2))
+
+    # 用显式栈代替递归，按从前到后的顺序处理各段
+    stack = [("diff", 0, len(a), 0, len(b))]
+    while stack:
+        kind, alo, ahi, blo, bhi = stack.pop()
+        if kind == "equal":
+            emit("equal", alo, ahi, blo, bhi)
+            continue
+        start_a, start_b = alo, blo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        end_a, end_b = ahi, bhi
+        while ahi > alo and bhi > blo and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        emit("equal", start_a, alo, start_b, blo)
+        tail = ("equal", ahi, end_a, bhi, end_b)
+        if alo == ahi or blo == bhi:
+            emit("delete", alo, ahi, blo, blo)
+            emit("insert", ahi, ahi, blo, bhi)
+            stack.append(tail)
+            continue
+        x0, y0, x1, y1 = middle_snake(a, alo, ahi, b, blo, bhi, max_d)
+        stack.append(tail)
+        stack.append(("diff", alo + x1, ahi, blo + y1, bhi))
+        stack.append(("equal", alo + x0, alo + x1, blo + y0, blo + y1))
+        stack.append(("diff", alo, alo + x0, blo, blo + y0))
+
+    # 相邻的删除和插入合并为替换
+    merged = []
+    for op in ops:
+        if merged and merged[-1][0] != "equal" and op[0] != "equal":
+            prev = merged[-1]
+            merged[-1] = ("replace", prev[1], op[2], prev[3], op[4])
+        else:
+            merged.append(op)
+    return merged
+
+
+def diff_texts(old, new):
+    """比较两个版本的内容，返回 [(标记, 文本), ...]，标记为 equal/delete/insert
+
+    先按句比对，变化的句子再按字符细化，长段落中的小改动也能精确定位。
+    """
+    old_segments = DIFF_SEGMENT_RE.findall(old)
+    new_segments = DIFF_SEGMENT_RE.findall(new)
+    result = []
+
+    def add(tag, text):
+        if not text:
+            return
+        if result and result[-1][0] == tag:
+            result[-1] = (tag, result[-1][1] + text)
+        else:
+            result.append((tag, text))
+
+    for tag, i1, i2, j1, j2 in myers_opcodes(old_segments, new_segments):
+        if tag == "equal":
+            add("equal", "".join(old_segments[i1:i2]))
+        elif tag == "delete":
+            add("delete", "".join(old_segments[i1:i2]))
+        elif tag == "insert":
+            add("insert", "".join(new_segments[j1:j2]))
+        else:
+            a = "".join(old_segments[i1:i2])
+            b = "".join(new_segments[j1:j2])
+            for ctag, c1, c2, d1, d2 in myers_opcodes(a, b):
+                if ctag == "equal":
+                    add("equal", a[c1:c2])
+                else:
+                    add("delete", a[c1:c2])
+                    add("insert", b[d1:d2])
+    return result
+
+
+class VersionDiffService:
+    """任意两个版本的差异对比：在后台线程计算，结果按 (任务ID, 旧版本号, 新版本号) 缓存
+
+    版本写入后通常不再修改，缓存按LRU淘汰；与其他实例的版本冲突时，
+    本实例未写入的版本会顺延版本号（见 TaskManager.merge_external），
+    同一个版本号换成了别的内容，这时调用 invalidate 丢弃该任务的结果。
+    回调通过 dispatch 转交UI线程执行。
+    """
+
+    def __init__(self, dispatch, capacity=DIFF_CACHE_SIZE):
+        self.dispatch = dispatch
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        # 正在计算的对比 -> 等待结果的回调
+        self.pending = {}
+        # 作废次数：任务ID -> 次数，全部作废时 epoch 加一。两者都计入缓存键，
+        # 作废前发出、之后才算完的对比不会被当作新结果命中
+        self.generations = {}
+        self.epoch = 0
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="diff")
+
+    def request(self, key, load_texts, callback):
+        """请求一次对比；load_texts() 返回 (旧内容, 新内容)，只在未命中缓存时调用
+
+        callback(结果, 异常) 在UI线程中执行，结果为 diff_texts 的返回值。
+        """
+        key = key + (self.epoch, self.generations.get(key[0], 0))
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.cache.move_to_end(key)
+            callback(cached, None)
+            return
+        if key in self.pending:
+            self.pending[key].append(callback)
+            return
+        self.pending[key] = [callback]
+        old, new = load_texts()
+        future = self.pool.submit(diff_texts, old, new)
+        future.add_done_callback(lambda f: self.dispatch(self.finished, key, f))
+
+    def finished(self, key, future):
+        error = future.exception()
+        result = None
+        if error is None:
+            result = future.result()
+            self.cache[key] = result
+            while len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+        for callback in self.pending.pop(key, []):
+            callback(result, error)
+
+    def invalidate(self, task_id=None):
+        """丢弃某个任务（task_id为None时为全部任务）的对比结果，版本号被重新分配后使用"""
+        if task_id is None:
+            self.epoch += 1
+            self.cache.clear()
+            return
+        self.generations[task_id] = self.generations.get(task_id, 0) + 1
+        for key in [key for key in self.cache if key[0] == task_id]:
+            del self.cache[key]
+
+    def close(self):
+        self.pool.shutdown(wait=False)
+
+
+# 中日韩文字（按字切分并生成二元组）与ASCII单词
+CJK_RUN_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+")
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def search_tokens(text):
+    """把文本切分成索引词：中文按单字和相邻二字，ASCII按单词（小写）"""
+    tokens = set(WORD_RE.findall(text.lower()))
+    for run in CJK_RUN_RE.findall(text):
+        tokens.update(run)
+        tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class SearchIndex:
+    """任务全文搜索的倒排索引（索引词 -> 任务ID集合）
+
+    覆盖项目、简易描述和全部历史版本内容。新增任务和新版本时增量
+    更新；修改项目或简易描述时重新索引该任务，删除任务时从倒排表中
+    去掉它。这两种情况需要扫描全部索引词（不另存每个任务的索引词，
+    省下一份与倒排表同样大的内存），它们远比新增版本少见。
+    """
+
+    def __init__(self):
+        self.postings = {}
+        # 已排序的ASCII索引词，用于输入过程中的前缀匹配
+        self.words = []
+
+    def add_text(self, task_id, text):
+        self.add_tokens(task_id, search_tokens(text))
+
+    def add_tokens(self, task_id, tokens):
+        for token in tokens:
+            ids = self.postings.get(token)
+            if ids is None:
+                self.postings[token] = {task_id}
+                if token[0] < "\x80":
+                    bisect.insort(self.words, token)
+            else:
+                ids.add(task_id)
+
+    def task_tokens(self, task, content):
+        """任务全部内容的索引词；content(task, ver) 返回版本的完整内容"""
+        # 各版本的内容大多相同，合并成一段文本后只切分一次
+        texts = [task["project"], task["short_desc"]]
+        texts.extend(content(task, ver) for ver in task["description_history"])
+        return search_tokens("\n".join(texts))
+
+    def add_task(self, task, content):
+        """索引任务的全部内容"""
+        self.add_tokens(task["id"], self.task_tokens(task, content))
+
+    def remove_ids(self, task_ids, keep=()):
+        """从倒排表中去掉这些任务（keep中的索引词除外），不再有任务的索引词一并删除"""
+        empty = []
+        for token, ids in self.postings.items():
+            if token not in keep and not ids.isdisjoint(task_ids):
+                ids.difference_update(task_ids)
+                if not ids:
+                    empty.append(token)
+        for token in empty:
+            del self.postings[token]
+            if token[0] < "\x80":
+                del self.words[bisect.bisect_left(self.words, token)]
+
+    def apply(self, op, tasks, content):
+        """根据一条修改操作增量更新索引"""
+        kind = op["op"]
+        if kind == "add":
+            self.add_task(op["task"], content)
+        elif kind == "version":
+            task = tasks.get(op["id"])
+            if task is not None:
+                self.add_text(task["id"], content(task, op["version"]))
+        elif kind == "update":
+            task = tasks.get(op["id"])
+            if task is not None and ("project" in op["fields"] or "short_desc" in op["fields"]):
+                # 旧的项目名、描述中的词不再匹配该任务
+                tokens = self.task_tokens(task, content)
+                self.remove_ids({task["id"]}, keep=tokens)
+                self.add_tokens(task["id"], tokens)
+        elif kind == "delete":
+            self.remove_ids(set(op["ids"]))
+
+    def search(self, query):
+        """返回同时包含查询中所有词的任务ID集合；最后一个ASCII词按前缀匹配"""
+        query = query.lower()
+        terms = []
+        for run in CJK_RUN_RE.findall(query):
+            if len(run) == 1:
+                terms.append(run)
+            else:
+                terms.extend(run[i:i + 2] for i in range(len(run) - 1))
+        words = WORD_RE.findall(query)
+        # 之前的词已经输入完整，按整词匹配；最后一个词可能还在输入中
+        terms.extend(words[:-1])
+        candidate_sets = [self.postings.get(term, set()) for term in terms]
+        if words:
+            # 前缀匹配：取所有以该词开头的索引词的并集
+            word = words[-1]
+            matched = set()
+            for i in range(bisect.bisect_left(self.words, word), len(self.words)):
+                if not self.words[i].startswith(word):
+                    break
+                matched |= self.postings[self.words[i]]
+            candidate_sets.append(matched)
+        if not candidate_sets:
+            return None
+        candidate_sets.sort(key=len)
+        result = set(candidate_sets[0])
+        for ids in candidate_sets[1:]:
+            result &= ids
+            if not result:
+                break
+        return result
+
+    def save(self, path, seq, live_ids):
+        """保存索引（只保留仍存在的任务），seq用于加载时判断索引是否最新"""
+        postings = {}
+        for token, ids in self.postings.items():
+            ids = [tid for tid in ids if tid in live_ids]
+            if ids:
+                postings[token] = ids
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"format": 1, "seq": seq, "postings": postings}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, seq):
+        """读取已保存的索引；文件不存在或与数据不一致时返回None"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("format") != 1 or data.get("seq") != seq:
+            return None
+        index = cls()
+        index.postings = {token: set(ids) for token, ids in data["postings"].items()}
+        index.words = sorted(token for token in index.postings if token[0] < "\x80")
+        return index
+
+
+class FileLock:
+    """跨进程的建议锁（POSIX用fcntl.flock，Windows用msvcrt.locking），用于 with 语句
+
+    同一进程内的多个线程另由线程锁互斥。锁文件本身还用来保存多个实例
+    共用的任务ID计数器（见 JsonTaskStore.reserve_ids）。hold_seconds
+    记录最近一次持有锁的时长。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.thread_lock = threading.Lock()
+        self.acquired_at = 0.0
+        self.hold_seconds = 0.0
+
+    def acquire(self, blocking=True):
+        if not self.thread_lock.acquire(blocking):
+            return False
+        try:
+            if self.file is None:
+                self.file = open(self.path, "a+b")
+            if os.name == "nt":
+                import msvcrt
+                while True:
+                    try:
+                        self.file.seek(0)
+                        msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+                        break
+                    except OSError:
+                        if not blocking:
+                            raise
+                        time.sleep(0.005)
+            else:
+                import fcntl
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            self.thread_lock.release()
+            if blocking:
+                raise
+            return False
+        self.acquired_at = time.perf_counter()
+        return True
+
+    def release(self):
+        self.hold_seconds = time.perf_counter() - self.acquired_at
+        try:
+            if os.name == "nt":
+                import msvcrt
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def close(self):
+        with self.thread_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def file_identity(path, f=None):
+    """文件的标识 (设备, inode, 大小, 修改时间)，用于发现文件被其他实例替换；文件不存在时为None"""
+    try:
+        st = os.fstat(f.fileno()) if f is not None else os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def open_if_exists(path, mode, **kwargs):
+    try:
+        return open(path, mode, **kwargs)
+    except FileNotFoundError:
+        return None
+
+
+def split_version_conflicts(ops, latest_version, conflicted):
+    """分出与其他实例写入的新版本冲突的版本操作
+
+    latest_version(任务ID) 返回文件中该任务已有的最大版本号；版本号
+    不大于它的版本是基于旧内容生成的，不能写入（差量会接错）。任务一旦
+    冲突，其后的版本操作都拒绝，直到界面重新生成的版本（带 "rebase"
+    标记）到来。返回 (可写入的操作, 被拒绝的操作)。
+    """
+    accepted, rejected = [], []
+    for op in ops:
+        if op["op"] == "version":
+            tid = op["id"]
+            if op.pop("rebase", False):
+                conflicted.discard(tid)
+            if tid in conflicted or latest_version(tid) >= op["version"]["version"]:
+                conflicted.add(tid)
+                rejected.append(op)
+                continue
+        accepted.append(op)
+    return accepted, rejected
+
+
+class JsonTaskStore:
+    """任务存储：tasks.json快照 + 追加写的操作日志
+
+    每次修改只把对应的操作（add/update/version/delete）追加到
+    tasks.json.journal 并fsync；加载时在快照之上重放日志。日志超过
+    JOURNAL_COMPACT_THRESHOLD 后在后台线程写出新快照，通过原子改名替换。
+
+    快照只保存版本头，版本内容（完整内容或差量）追加写入旁路文件
+    tasks.json.bodies，版本头中的 "body": [偏移, 长度, 是否差量] 指向它；
+    打开详情窗口等需要内容时再通过mmap按需读取。旁路文件被整体改写时
+    换一个新的代号（快照头中的 "bodies"），其他实例据此整体重新加载。
+
+    多个实例可以同时使用同一个文件：追加日志、替换快照和分配ID时持有
+    tasks.json.lock 上的文件锁（只持有几毫秒）。追加前先读出其他实例
+    在上次读取位置之后追加的操作（乐观并发：没有变化时只多一次stat），
+    连同本次被拒绝的冲突版本一起返回给调用方合并；日志被其他实例压缩
+    换掉且缺少中间的操作时，改为整体重新加载。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + ".journal"
+        # 压缩期间被换下的旧日志，新快照落盘后改名保留一份（直到下次压缩），
+        # 其他实例即使在压缩完成后才读取，也能从中读完自己没读到的部分
+        self.old_journal_path = path + ".journal.old"
+        self.prev_journal_path = path + ".journal.prev"
+        self.bodies_path = path + ".bodies"
+        self.bodies_lock = threading.Lock()
+        self.bodies_file = None
+        self.bodies_map = None
+        # 压缩写入的版本内容尚未换成引用（等调用方 publish_bodies），期间不再压缩
+        self.unpublished = False
+        # 改写旁路文件时，内存中的引用换成新文件的之前，读取固定在旧文件的映射上
+        self.bodies_retired = False
+        # 已写好、随快照一起替换的新旁路文件及其代号
+        self.pending_bodies = None
+        self.pending_generation = None
+        # 当前旁路文件的代号（整体改写时更换），内存中的引用都指向这一代文件
+        self.bodies_generation = None
+        self.seq = 0
+        self.next_id = 1
+        self.journal = None
+        self.lock = threading.Lock()
+        self.compact_thread = None
+        self.compact_error = None
+        # 多实例：文件锁（锁文件里保存共用的ID计数器）、压缩锁、已读到的日志位置和快照标识
+        self.file_lock = FileLock(path + ".lock")
+        self.compact_lock = FileLock(path + ".compact.lock")
+        self.journal_id = None
+        self.journal_offset = 0
+        self.snapshot_id = None
+        # 任务ID -> 文件中的最大版本号（只记加载之后写入的版本），以及处于冲突中的任务
+        self.version_heads = {}
+        self.conflicted = set()
+        # 读到其他实例修改的次数；调用方合并了全部这些修改后才能用内存中的任务压缩
+        self.external_reads = 0
+
+    def load(self, resolve_bodies=False, files=None):
+        """加载任务；resolve_bodies为True时把旁路文件中的版本内容读回内存（迁移、转换用）"""
+        tasks = TaskCollection()
+        for ops in self.iter_load(files=files):
+            for op in ops:
+                apply_task_op(tasks, op)
+        tasks.next_id = max(tasks.next_id, self.next_id)
+        if resolve_bodies:
+            for t in tasks:
+                for ver in t["description_history"]:
+                    if "body" in ver:
+                        ver.update(self.read_body(ver.pop("body")))
+        return tasks
+
+    def open_files(self):
+        """打开快照、旧日志、日志和旁路文件（持有文件锁时调用），不存在的为None"""
+        return (open_if_exists(self.path, "r", encoding="utf-8"),
+                [open_if_exists(path, "rb") for path in (self.old_journal_path, self.journal_path)],
+                open_if_exists(self.bodies_path, "rb"))
+
+    def iter_load(self, chunk_size=LOAD_CHUNK_SIZE, files=None, merge_journal=False):
+        """逐批读取任务，每批是一组可以用 apply_task_op 依次应用的操作
+
+        快照中的任务作为add操作，之后是需要重放的日志操作。快照每行
+        一个任务，可以边读边解析，不必先把整个文件读入内存；旧格式的
+        文件整体解析。全部读完后 self.seq、self.next_id 才是最终值。
+        files 是已经持有文件锁时由 open_files 打开的文件。
+        merge_journal为True时（导出用）每批只有add操作、任务已是最终
+        状态：日志操作按任务分组，应用到所在的那批快照任务上，日志中
+        新增的任务在最后一批；内存中只有一批任务和日志操作。
+        """
+        snapshot_seq = 0
+        self.next_id = 1
+        self.version_heads = {}
+        self.conflicted = set()
+        # 在锁内同时打开快照和日志，保证读到的是同一时刻的一组文件，随后在锁外读取
+        if files is None:
+            with self.file_lock:
+                files = self.open_files()
+        snapshot, journals, bodies = files
+        self.snapshot_id = file_identity(self.path, snapshot)
+        # 快照中的引用指向同时打开的这个旁路文件，读取内容时一直用它
+        with self.bodies_lock:
+            self.close_bodies()
+            self.bodies_file = bodies
+        self.bodies_generation = None
+        records = ()
+        if snapshot is not None:
+            header = snapshot.readline()
+            if header.startswith('{"format": 2,') and header.rstrip().endswith('"tasks": ['):
+                meta = json.loads(header.rstrip() + "]}")
+                snapshot_seq = meta.get("seq", 0)
+                self.next_id = meta.get("next_id", 1)
+                self.bodies_generation = meta.get("bodies")
+                records = self.iter_snapshot_lines(snapshot)
+            else:
+                with snapshot as f:
+                    f.seek(0)
+                    data = json.load(f)
+                if isinstance(data, list):
+                    # 旧格式：直接是任务列表
+                    records = data
+                else:
+                    records = data["tasks"]
+                    snapshot_seq = data.get("seq", 0)
+                    self.next_id = data.get("next_id", 1)
+        # 日志与快照来自同一时刻，先读出日志不影响结果
+        ops = self.read_journals(journals, snapshot_seq)
+        records = iter(records)
+        if not merge_journal:
+            stream = itertools.chain(({"op": "add", "task": t} for t in records), ops)
+            yield from iter(lambda: list(itertools.islice(stream, chunk_size)), [])
+            return
+        pending = {}
+        for op in ops:
+            if op["op"] == "delete":
+                for tid in op["ids"]:
+                    pending.setdefault(tid, []).append(dict(op, ids=[tid]))
+            else:
+                pending.setdefault(op["task"]["id"] if op["op"] == "add" else op["id"], []).append(op)
+        for chunk in iter(lambda: list(itertools.islice(records, chunk_size)), []):
+            tasks = TaskCollection()
+            for t in chunk:
+                apply_task_op(tasks, {"op": "add", "task": t})
+                for op in pending.pop(t["id"], ()):
+                    apply_task_op(tasks, op)
+            if tasks:
+                yield [{"op": "add", "task": t} for t in tasks]
+        # 剩下的是日志中新增的任务（以及对已不存在的任务的操作），按日志顺序应用
+        tasks = TaskCollection()
+        for op in ops:
+            target = op["ids"] if op["op"] == "delete" else [op["task"]["id"] if op["op"] == "add" else op["id"]]
+            if any(tid in pending for tid in target):
+                apply_task_op(tasks, op)
+        if tasks:
+            yield [{"op": "add", "task": t} for t in tasks]
+
+    def iter_snapshot_lines(self, f):
+        """逐行解析快照中的任务，读到结尾或文件结束时关闭文件"""
+        with f:
+            for line in f:
+                line = line.rstrip().rstrip(",")
+                if line.startswith("]"):
+                    break
+                yield json.loads(line)
+
+    def read_journals(self, journals, snapshot_seq):
+        """读取旧日志和日志中快照之后的操作，同时确定 self.seq 和下次读取的位置"""
+        self.seq = snapshot_seq
+        self.journal_id, self.journal_offset = None, 0
+        result = []
+        for f in journals:
+            if f is None:
+                continue
+            with f:
+                ops, offset = self.read_journal_lines(f)
+                self.journal_id, self.journal_offset = file_identity(None, f)[:2], offset
+            for op in ops:
+                if op["seq"] > snapshot_seq:
+                    result.append(op)
+                    self.seq = max(self.seq, op["seq"])
+        if journals[1] is None:
+            # 只有旧日志（其他实例正在压缩）时，后续从新日志的开头读
+            self.journal_id, self.journal_offset = None, 0
+        return result
+
+    def read_body(self, ref):
+        """通过mmap读取旁路文件中的一条版本内容"""
+        with self.bodies_lock:
+            return self.read_body_locked(ref)
+
+    def read_body_locked(self, ref):
+        return json.loads(self.read_body_bytes(ref).decode("utf-8"))
+
+    def read_body_bytes(self, ref):
+        """旁路文件中一条内容的原始字节（持有 bodies_lock 时调用）"""
+        offset, length = ref[0], ref[1]
+        if not self.bodies_retired and (self.bodies_map is None or offset + length > len(self.bodies_map)):
+            # 文件在压缩时会追加内容，超出当前映射范围时重新映射。打开的文件
+            # 一直保留：其他实例整体改写旁路文件后，重新加载之前仍从原来的文件读
+            if self.bodies_file is None:
+                self.bodies_file = open(self.bodies_path, "rb")
+            if self.bodies_map is not None:
+                self.bodies_map.close()
+            self.bodies_map = mmap.mmap(self.bodies_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.bodies_map[offset:offset + length]
+
+    def retire_bodies(self):
+        """改写旁路文件之前调用：把整个旧文件映射好并固定，直到 publish_bodies
+
+        新文件替换旧文件后，内存中的版本引用仍指向旧文件，读取继续走
+        这个映射；publish_bodies 换上新引用的同时解除固定。
+        """
+        with self.bodies_lock:
+            self.close_bodies()
+            f = open_if_exists(self.bodies_path, "rb")
+            if f is not None:
+                if os.fstat(f.fileno()).st_size:
+                    self.bodies_file = f
+                    self.bodies_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    f.close()
+            self.bodies_retired = True
+
+    def discard_pending_bodies(self):
+        """改写旁路文件失败：删除写了一半的新文件，解除旧文件的固定"""
+        if self.pending_bodies is not None:
+            if os.path.exists(self.pending_bodies):
+                os.remove(self.pending_bodies)
+            self.pending_bodies = self.pending_generation = None
+        with self.bodies_lock:
+            if self.bodies_retired:
+                self.close_bodies()
+                self.bodies_retired = False
+
+    def bodies_mostly_dead(self, tasks):
+        """旁路文件中是否大部分内容已没有任务引用（被删除、归档或改写后的旧内容）"""
+        try:
+            size = os.path.getsize(self.bodies_path)
+        except OSError:
+            return False
+        if size < BODIES_SHRINK_MIN_BYTES:
+            return False
+        live = 0
+        for t in tasks:
+            for ver in t["description_history"]:
+                if "body" in ver and "content" not in ver and "delta" not in ver:
+                    live += ver["body"][1]
+        return size - live > size * BODIES_DEAD_RATIO
+
+    def close_bodies(self):
+        if self.bodies_map is not None:
+            self.bodies_map.close()
+            self.bodies_map = None
+        if self.bodies_file is not None:
+            self.bodies_file.close()
+            self.bodies_file = None
+
+    def write_bodies(self, tasks, f, copy_refs=False):
+        """把版本内容追加到旁路文件f，返回 (只含版本头的任务副本, [(版本记录, 引用)])
+
+        不修改传入的版本记录（可能是UI线程正在使用的对象）；内存中的
+        记录由调用方随后通过 publish_bodies 换成引用，释放内容占用的内存。
+        copy_refs为True时（写新的旁路文件）已在旧文件中的内容也复制过来，
+        这些版本同样换成新引用。
+        """
+        offset = f.tell()
+        headers = []
+        moved = []
+        for t in tasks:
+            history = []
+            for ver in t["description_history"]:
+                if copy_refs and "body" in ver and "content" not in ver and "delta" not in ver:
+                    old = ver["body"]
+                    with self.bodies_lock:
+                        data = self.read_body_bytes(old)
+                    f.write(data)
+                    ref = [offset, len(data), old[2]]
+                    moved.append((ver, ref))
+                    ver = dict(ver, body=ref)
+                    offset += len(data)
+                elif "content" in ver or "delta" in ver:
+                    is_delta = "delta" in ver
+                    payload = {"delta": ver["delta"]} if is_delta else {"content": ver["content"]}
+                    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                    f.write(data)
+                    ref = [offset, len(data), int(is_delta)]
+                    moved.append((ver, ref))
+                    ver = {k: v for k, v in ver.items() if k not in ("content", "delta")}
+                    ver["body"] = ref
+                    offset += len(data)
+                history.append(ver)
+            headers.append(dict(t, description_history=history))
+        f.flush()
+        os.fsync(f.fileno())
+        return headers, moved
+
+    def publish_bodies(self, moved):
+        """把已写入旁路文件的版本记录换成引用，释放内存中的内容
+
+        与 read_version 持有同一把锁，其他线程不会读到换到一半的记录。
+        """
+        with self.bodies_lock:
+            for ver, ref in moved:
+                ver["body"] = ref
+                ver.pop("content", None)
+                ver.pop("delta", None)
+            self.unpublished = False
+            if self.bodies_retired:
+                # 引用都已指向新文件，下次读取时重新映射
+                self.close_bodies()
+                self.bodies_retired = False
+
+    def read_version(self, ver):
+        """版本的内容或差量（{"content": …} 或 {"delta": …}），内容不在内存中时从旁路文件读取
+
+        可在任何线程中调用：与 publish_bodies 互斥，读到的要么是内存中的
+        内容，要么是已经落盘的引用。
+        """
+        with self.bodies_lock:
+            for key in ("content", "delta"):
+                value = ver.get(key)
+                if value is not None:
+                    return {key: value}
+            ref = ver.get("body")
+            if ref is None:
+                return {}
+            return self.read_body_locked(ref)
+
+    def read_journal_lines(self, f, offset=0):
+        """从offset开始读取日志中完整的行，返回 (操作列表, 最后一个完整行之后的位置)"""
+        f.seek(offset)
+        ops = []
+        for line in f:
+            if not line.endswith(b"\n"):
+                # 其他实例正在写的行，或崩溃时未写完的最后一行
+                break
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                break
+            offset += len(line)
+        return ops, offset
+
+    def read_journal_tail(self, path, offset):
+        f = open_if_exists(path, "rb")
+        if f is None:
+            return [], 0
+        with f:
+            return self.read_journal_lines(f, offset)
+
+    def read_external(self):
+        """读取其他实例在上次读取之后写入的操作（持有文件锁时调用）
+
+        日志没变时只需一次stat。日志被换掉时先从旧日志（或上次压缩保留
+        的日志）读完剩下的部分；快照被替换且其中包含没读到的操作，或
+        旁路文件被整体改写（内存中的引用已失效）时返回None，需要整体
+        重新加载。
+        """
+        journal_id = file_identity(self.journal_path)
+        if journal_id is not None and journal_id[:2] == self.journal_id and journal_id[2] == self.journal_offset:
+            external = []
+        elif journal_id is not None and journal_id[:2] == self.journal_id:
+            external, self.journal_offset = self.read_journal_tail(self.journal_path, self.journal_offset)
+        else:
+            external = []
+            if self.journal_id is not None:
+                rotated = [(path, file_identity(path)) for path in (self.old_journal_path, self.prev_journal_path)]
+                found = [path for path, ident in rotated if ident is not None and ident[:2] == self.journal_id]
+                if found:
+                    external, _ = self.read_journal_tail(found[0], self.journal_offset)
+                elif rotated[0][1] is not None:
+                    # 读过的日志已被并入未完成压缩留下的旧日志，找不到原来的位置
+                    return None
+            self.journal_id = journal_id[:2] if journal_id is not None else None
+            self.journal_offset = 0
+            if journal_id is not None:
+                tail, self.journal_offset = self.read_journal_tail(self.journal_path, 0)
+                external.extend(tail)
+        snapshot_id = file_identity(self.path)
+        if snapshot_id != self.snapshot_id:
+            self.snapshot_id = snapshot_id
+            with open(self.path, "r", encoding="utf-8") as f:
+                header = f.readline().rstrip()
+            meta = json.loads(header + "]}") if header.endswith('"tasks": [') else {}
+            snapshot_seq = meta.get("seq", 0)
+            known = max([self.seq] + [op["seq"] for op in external if op["seq"] <= snapshot_seq])
+            if snapshot_seq > known or meta.get("bodies") != self.bodies_generation:
+                return None
+        external = [op for op in external if op["seq"] > self.seq]
+        if external:
+            self.external_reads += 1
+        for op in external:
+            self.seq = max(self.seq, op["seq"])
+            if op["op"] == "version":
+                self.note_version(op["id"], op["version"]["version"])
+            elif op["op"] == "add":
+                self.next_id = max(self.next_id, op["task"]["id"] + 1)
+        return external
+
+    def note_version(self, task_id, number):
+        if number > self.version_heads.get(task_id, 0):
+            self.version_heads[task_id] = number
+
+    def is_current(self):
+        """（持有文件锁时调用）文件自上次读取以来没有被其他实例修改"""
+        journal_id = file_identity(self.journal_path)
+        current = (journal_id[:3] == (*self.journal_id, self.journal_offset)) if journal_id and self.journal_id \
+            else journal_id is None
+        return current and file_identity(self.path) == self.snapshot_id
+
+    def reload(self):
+        """整体重新加载（持有文件锁时调用），并以加载结果作为各任务的最新版本号"""
+        with self.bodies_lock:
+            # 旁路文件可能已被其他实例整体重写
+            self.close_bodies()
+        tasks = self.load(files=self.open_files())
+        self.external_reads += 1
+        self.version_heads = {t["id"]: max(v["version"] for v in t["description_history"])
+                              for t in tasks if t["description_history"]}
+        return tasks
+
+    def reserve_ids(self, count, floor=1):
+        """为新任务分配count个连续ID并返回第一个；计数器存在锁文件中，多个实例分配的ID不会重复"""
+        with self.file_lock:
+            f = self.file_lock.file
+            f.seek(0)
+            try:
+                stored = int(f.read() or 1)
+            except ValueError:
+                stored = 1
+            first = max(stored, floor, self.next_id)
+            f.truncate(0)
+            f.write(str(first + count).encode("ascii"))
+            f.flush()
+        self.next_id = first + count
+        return first
+
+    def watched_paths(self):
+        """其他实例修改数据时会变化的文件（供 FileWatcher 监视）"""
+        return [self.path, self.journal_path]
+
+    def read_changes(self):
+        """读取其他实例在上次读取之后写入的修改，返回 (操作, 重新加载的任务集合或None)
+
+        文件监视发现变化时调用。文件没有被其他实例修改时（包括本实例
+        自己的写入）只需几次stat，不加锁；只有快照被换掉且缺少中间的
+        操作时才整体重新加载。
+        """
+        if self.is_current():
+            return [], None
+        with self.lock, self.file_lock:
+            external = self.read_external()
+            if external is None:
+                return [], self.reload()
+            return external, None
+
+    def append(self, ops):
+        """把一组操作追加到日志并落盘
+
+        先合并其他实例的修改再写入，返回 (其他实例的操作, 重新加载的
+        任务集合或None, 因版本冲突未写入的操作)。
+        """
+        with self.lock, self.file_lock:
+            fresh = None
+            external = self.read_external()
+            if external is None:
+                fresh, external = self.reload(), []
+            ops, rejected = split_version_conflicts(ops, lambda tid: self.version_heads.get(tid, 0), self.conflicted)
+            if self.journal is not None and file_identity(None, self.journal)[:2] != self.journal_id:
+                # 日志已被其他实例换掉，写到新日志里
+                self.journal.close()
+                self.journal = None
+            if self.journal is None:
+                self.journal = open(self.journal_path, "ab")
+                self.journal_id = file_identity(None, self.journal)[:2]
+            if self.journal.seek(0, os.SEEK_END) != self.journal_offset:
+                # 崩溃留下的半行：截掉，避免新内容接在后面变成无法解析的一行
+                self.journal.truncate(self.journal_offset)
+            lines = []
+            for op in ops:
+                self.seq += 1
+                op["seq"] = self.seq
+                if op["op"] == "version":
+                    self.note_version(op["id"], op["version"]["version"])
+                lines.append(json.dumps(op, ensure_ascii=False, default=record_json) + "\n")
+            data = "".join(lines).encode("utf-8")
+            self.journal.write(data)
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.journal_offset += len(data)
+        return external, fresh, rejected
+
+    def needs_compaction(self):
+        if self.unpublished or (self.compact_thread is not None and self.compact_thread.is_alive()):
+            return False
+        try:
+            return os.path.getsize(self.journal_path) > JOURNAL_COMPACT_THRESHOLD
+        except OSError:
+            return False
+
+    def compact(self, snapshot, merged_reads, on_bodies=None, fresh_bodies=False, retained=()):
+        """在后台把任务快照写成新快照文件，完成后丢弃已合入快照的日志
+
+        snapshot 是 TaskCollection.freeze() 得到的快照，必须恰好包含已经
+        append 的全部操作（调用方在保存线程中、写完之前提交的操作后调用，
+        见 PersistenceWorker.run_after_written）；压缩结束或跳过时释放。
+        merged_reads 是建立快照时调用方已合并的 external_reads 次数。快照
+        缺少其他实例的修改、文件在上次读取后又被修改，或其他实例正在
+        压缩时跳过，等下次再压缩。返回是否开始了压缩。
+
+        写入旁路文件的版本记录在压缩完成后以 on_bodies([(版本记录, 引用)])
+        交给调用方，由读取内容的线程（UI线程）调用 publish_bodies 换成引用；
+        on_bodies 为None时在压缩线程中直接换。fresh_bodies为True（如归档
+        移走大量任务后），或旁路文件大部分内容已没有引用时，改写一个只含
+        当前任务内容的新旁路文件，否则只追加。retained 是不在快照中、但
+        之后可能加回的任务（撤销删除用），改写时它们的内容同样复制过去，
+        引用随 on_bodies 一起更换。
+        """
+        if self.unpublished or not self.compact_lock.acquire(blocking=False):
+            snapshot.release()
+            return False
+        try:
+            with self.lock:
+                if merged_reads != self.external_reads:
+                    self.compact_lock.release()
+                    snapshot.release()
+                    return False
+                with self.file_lock:
+                    if not self.is_current():
+                        self.compact_lock.release()
+                        snapshot.release()
+                        return False
+                    seq = self.seq
+                    self.rotate_journal()
+        except BaseException:
+            self.compact_lock.release()
+            snapshot.release()
+            raise
+        self.compact_error = None
+        self.compact_thread = threading.Thread(target=self.run_compaction,
+                                               args=(snapshot, seq, on_bodies, fresh_bodies, retained),
+                                               daemon=True)
+        self.compact_thread.start()
+        return True
+
+    def rotate_journal(self):
+        """把当前日志改名为旧日志，之后的操作写入新日志（持有文件锁时调用）"""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if os.path.exists(self.old_journal_path):
+            # 上次压缩未完成，把当前日志并入旧日志，保证不丢操作
+            if os.path.exists(self.journal_path):
+                with open(self.journal_path, "rb") as src, open(self.old_journal_path, "ab") as dst:
+                    dst.write(src.read())
+                    dst.flush()
+                    os.fsync(dst.fileno())
+                os.remove(self.journal_path)
+        elif os.path.exists(self.journal_path):
+            os.replace(self.journal_path, self.old_journal_path)
+        self.journal_id, self.journal_offset = None, 0
+
+    def run_compaction(self, snapshot, seq, on_bodies, fresh_bodies, retained):
+        try:
+            # 任务在这里（后台线程）才逐个复制，UI线程只复制期间被修改的任务
+            tasks = list(snapshot)
+            fresh_bodies = fresh_bodies or self.bodies_mostly_dead(itertools.chain(tasks, retained))
+            tmp_path, moved = self.write_snapshot(tasks, seq, snapshot.next_id, fresh_bodies=fresh_bodies,
+                                                  retained=retained)
+            with self.file_lock:
+                self.install_snapshot(tmp_path)
+                os.replace(self.old_journal_path, self.prev_journal_path)
+            if on_bodies is None or not moved:
+                self.publish_bodies(moved)
+            else:
+                self.unpublished = True
+                on_bodies(moved)
+        except Exception as e:
+            # 旧日志和旧旁路文件仍在，下次加载或压缩时不会丢数据
+            self.discard_pending_bodies()
+            self.compact_error = e
+        finally:
+            snapshot.release()
+            self.compact_lock.release()
+
+    def rewrite(self, tasks):
+        """同步写出完整快照并清空日志（批量转换数据后使用）
+
+        序号加一，其他实例读到新快照时整体重新加载。
+        """
+        if self.compact_thread is not None:
+            self.compact_thread.join()
+        with self.compact_lock, self.lock, self.file_lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            self.seq += 1
+            try:
+                tmp_path, moved = self.write_snapshot(list(tasks), self.seq, tasks.next_id, fresh_bodies=True)
+                self.install_snapshot(tmp_path)
+            except BaseException:
+                self.discard_pending_bodies()
+                raise
+            self.publish_bodies(moved)
+            self.remove_journals()
+
+    def commit_batch(self, tasks, ops, fresh_bodies=False):
+        """一次提交大批修改（批量导入、归档用）
+
+        不逐条写日志，而是直接写出已包含这些修改的新快照并原子替换，
+        中途失败时原数据不受影响。tasks 加载之后其他实例写入的操作先
+        合并进来；需要整体重新加载时，把ops重新应用到加载结果上再写出。
+        写快照期间一直持有文件锁，其他实例的保存会等待到提交完成。
+        fresh_bodies 见 write_snapshot（归档删除大量任务后使用）。
+        """
+        if self.compact_thread is not None:
+            self.compact_thread.join()
+        with self.compact_lock, self.lock, self.file_lock:
+            external = self.read_external()
+            if external is None:
+                tasks = self.reload()
+                external = ops
+            for op in external:
+                apply_task_op(tasks, op)
+            tasks.next_id = max(tasks.next_id, self.next_id)
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            self.seq += len(ops)
+            try:
+                tmp_path, moved = self.write_snapshot(list(tasks), self.seq, tasks.next_id, fresh_bodies=fresh_bodies)
+                self.install_snapshot(tmp_path)
+            except BaseException:
+                self.discard_pending_bodies()
+                raise
+            self.publish_bodies(moved)
+            self.remove_journals()
+
+    def remove_journals(self):
+        for path in (self.journal_path, self.old_journal_path, self.prev_journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.journal_id, self.journal_offset = None, 0
+
+    def install_snapshot(self, tmp_path):
+        """用写好的临时文件原子替换快照（持有文件锁时调用）；改写了旁路文件时先替换它"""
+        if self.pending_bodies is not None:
+            os.replace(self.pending_bodies, self.bodies_path)
+            self.bodies_generation = self.pending_generation
+            self.pending_bodies = self.pending_generation = None
+        os.replace(tmp_path, self.path)
+        fsync_dir(os.path.dirname(os.path.abspath(self.path)))
+        self.snapshot_id = file_identity(self.path)
+
+    def write_snapshot(self, tasks, seq, next_id, fresh_bodies=False, retained=()):
+        """把快照写入临时文件并fsync（每个任务占一行），返回 (临时文件路径, 写入旁路文件的版本)
+
+        临时文件由 install_snapshot 替换；版本列表交给 publish_bodies。
+
+        版本内容先追加到旁路文件并落盘；fresh_bodies为True时改为写一个
+        全新的旁路文件（丢弃已删除、已归档任务留下的内容），与快照一起
+        由 install_snapshot 替换，在此之前读取固定在旧文件上（retire_bodies）；
+        新文件换一个随机的代号写入快照头；retained 中任务的内容也复制到
+        新文件（不写入快照）。调用方持有 compact_lock，多个实例不会同时
+        写旁路文件。
+        """
+        generation = self.bodies_generation
+        if fresh_bodies:
+            self.retire_bodies()
+            self.pending_bodies = self.bodies_path + ".tmp"
+            self.pending_generation = generation = os.urandom(8).hex()
+            with open(self.pending_bodies, "wb") as bf:
+                headers, moved = self.write_bodies(itertools.chain(tasks, retained), bf, copy_refs=True)
+            tasks = headers[:len(tasks)]
+        else:
+            with open(self.bodies_path, "ab") as bf:
+                tasks, moved = self.write_bodies(tasks, bf)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(f'{{"format": 2, "seq": {seq}, "next_id": {next_id}, '
+                    f'"bodies": {json.dumps(generation)}, "tasks": [\n')
+            last = len(tasks) - 1
+            for i, t in enumerate(tasks):
+                f.write(json.dumps(t, ensure_ascii=False, default=record_json) + (",\n" if i < last else "\n"))
+            f.write("]}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp_path, moved
+
+    def close(self):
+        if self.compact_thread is not None:
+            self.compact_thread.join()
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+        with self.bodies_lock:
+            self.close_bodies()
+        self.file_lock.close()
+        self.compact_lock.close()
+
+
+# 任务表中有独立列的字段，其余字段放入extra(JSON)以保证无损往返
+TASK_COLUMNS = ("id", "project", "short_desc", "priority", "create_time", "modified_time", "completed")
+VERSION_COLUMNS = ("version", "content", "timestamp", "action", "folder_path")
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    project TEXT NOT NULL,
+    short_desc TEXT NOT NULL,
+    priority TEXT NOT NULL,
+    create_time TEXT NOT NULL,
+    modified_time TEXT NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    extra TEXT
+);
+CREATE TABLE IF NOT EXISTS versions (
+    task_id INTEGER NOT NULL REFERENCES tasks(id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    content TEXT,
+    timestamp TEXT,
+    action TEXT,
+    folder_path TEXT,
+    extra TEXT,
+    PRIMARY KEY (task_id, version)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+-- 最近写入的操作，供其他实例增量合并（只保留最近 SQLITE_OPS_KEEP 条）
+CREATE TABLE IF NOT EXISTS ops (
+    seq INTEGER PRIMARY KEY,
+    op TEXT NOT NULL
+);
+-- 筛选和排序都在内存中完成，之前建立的这些索引没有查询用到，只增加写入开销
+DROP INDEX IF EXISTS idx_tasks_completed;
+DROP INDEX IF EXISTS idx_tasks_priority;
+DROP INDEX IF EXISTS idx_tasks_project;
+DROP INDEX IF EXISTS idx_tasks_modified_time;
+"""
+
+
+class SQLiteTaskStore:
+    """任务存储：SQLite数据库（tasks表 + versions表）
+
+    与JsonTaskStore接口一致；每批操作在一个事务内提交。写事务用
+    BEGIN IMMEDIATE 开始，多个实例的写入由数据库锁串行化；每个实例
+    通过ops表读取其他实例写入的操作，落后太多（ops表已删去中间的
+    操作）时整体重新加载。
+    """
+
+    def __init__(self, path):
+        import sqlite3
+        self.path = path
+        # 写入在后台保存线程中进行，读取可能来自UI线程，由self.lock串行化
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute("PRAGMA foreign_keys = ON")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+        self.seq = int(self.get_meta("seq", 0))
+        self.next_id = int(self.get_meta("next_id", 1))
+        self.compact_error = None
+        self.conflicted = set()
+        self.external_reads = 0
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def load(self, resolve_bodies=False):
+        """加载任务；版本内容在versions表中随任务一起读出，resolve_bodies无需处理
+
+        在一个读事务内完成，读到的任务和 self.seq 对应同一时刻的数据。
+        """
+        in_transaction = self.conn.in_transaction
+        if not in_transaction:
+            self.conn.execute("BEGIN")
+        try:
+            return self.read_tasks()
+        finally:
+            if not in_transaction:
+                self.conn.commit()
+
+    def read_tasks(self):
+        self.seq = int(self.get_meta("seq", 0))
+        self.next_id = max(self.next_id, int(self.get_meta("next_id", 1)))
+        tasks = TaskCollection(next_id=self.next_id)
+        for row in self.conn.execute(
+                "SELECT id, project, short_desc, priority, create_time, modified_time, completed, extra "
+                "FROM tasks ORDER BY id"):
+            t = dict(zip(TASK_COLUMNS, row))
+            t["completed"] = bool(t["completed"])
+            if row[-1]:
+                t.update(json.loads(row[-1]))
+            t["description_history"] = []
+            tasks.add(Task(t))
+        for row in self.conn.execute(
+                "SELECT task_id, version, content, timestamp, action, folder_path, extra "
+                "FROM versions ORDER BY task_id, version"):
+            ver = {k: v for k, v in zip(VERSION_COLUMNS, row[1:]) if v is not None}
+            if row[-1]:
+                ver.update(json.loads(row[-1]))
+            tasks.get(row[0])["description_history"].append(Version(ver))
+        return tasks
+
+    def iter_load(self, chunk_size=LOAD_CHUNK_SIZE, merge_journal=False):
+        """逐批生成add操作（与JsonTaskStore.iter_load一致，没有要重放的日志）；数据库查询本身一次完成"""
+        tasks = list(self.load())
+        for i in range(0, len(tasks), chunk_size):
+            yield [{"op": "add", "task": t} for t in tasks[i:i + chunk_size]]
+
+    def insert_task(self, t):
+        extra = {k: v for k, v in t.items() if k not in TASK_COLUMNS and k != "description_history"}
+        self.conn.execute(
+            "INSERT INTO tasks (id, project, short_desc, priority, create_time, modified_time, completed, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (t["id"], t["project"], t["short_desc"], t["priority"], t["create_time"], t["modified_time"],
+             int(t["completed"]), json.dumps(extra, ensure_ascii=False) if extra else None))
+        for ver in t["description_history"]:
+            self.insert_version(t["id"], ver)
+        self.next_id = max(self.next_id, t["id"] + 1)
+
+    def insert_version(self, task_id, ver):
+        extra = {k: v for k, v in ver.items() if k not in VERSION_COLUMNS}
+        self.conn.execute(
+            "INSERT INTO versions (task_id, version, content, timestamp, action, folder_path, extra) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task_id, ver["version"], ver.get("content"), ver.get("timestamp"), ver.get("action"),
+             ver.get("folder_path"), json.dumps(extra, ensure_ascii=False) if extra else None))
+
+    def apply(self, op):
+        kind = op["op"]
+        if kind in ("update", "version") and \
+                self.conn.execute("SELECT 1 FROM tasks WHERE id = ?", (op["id"],)).fetchone() is None:
+            # 任务已被其他实例删除
+            return
+        if kind == "add":
+            self.insert_task(op["task"])
+        elif kind == "update":
+            fields = {k: v for k, v in op["fields"].items() if k in TASK_COLUMNS and k != "id"}
+            if "completed" in fields:
+                fields["completed"] = int(fields["completed"])
+            # 没有单独一列的字段（如 completed_time）合并进 extra
+            others = {k: v for k, v in op["fields"].items() if k not in TASK_COLUMNS}
+            if others:
+                row = self.conn.execute("SELECT extra FROM tasks WHERE id = ?", (op["id"],)).fetchone()
+                extra = json.loads(row[0]) if row[0] else {}
+                extra.update(others)
+                fields["extra"] = json.dumps(extra, ensure_ascii=False)
+            if fields:
+                assignments = ", ".join(f"{k} = ?" for k in fields)
+                self.conn.execute(f"UPDATE tasks SET {assignments} WHERE id = ?", (*fields.values(), op["id"]))
+        elif kind == "version":
+            self.insert_version(op["id"], op["version"])
+            self.conn.execute("UPDATE tasks SET modified_time = ? WHERE id = ?",
+                              (op["version"]["timestamp"], op["id"]))
+        elif kind == "delete":
+            self.conn.executemany("DELETE FROM tasks WHERE id = ?", [(tid,) for tid in op["ids"]])
+
+    def read_external(self):
+        """读取其他实例写入的操作（在写事务内调用）；中间的操作已不在ops表时返回None"""
+        self.next_id = max(self.next_id, int(self.get_meta("next_id", 1)))
+        current = int(self.get_meta("seq", 0))
+        if current <= self.seq:
+            return []
+        rows = self.conn.execute("SELECT seq, op FROM ops WHERE seq > ? ORDER BY seq", (self.seq,)).fetchall()
+        if not rows or rows[0][0] != self.seq + 1 or rows[-1][0] != current:
+            return None
+        self.seq = current
+        self.external_reads += 1
+        return [json.loads(op) for _, op in rows]
+
+    def watched_paths(self):
+        return [self.path, self.path + "-wal"]
+
+    def read_changes(self):
+        """读取其他实例写入的修改（与 JsonTaskStore.read_changes 一致），在一个读事务内完成"""
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                external = self.read_external()
+                if external is None:
+                    fresh = self.read_tasks()
+                    self.external_reads += 1
+                    return [], fresh
+                return external, None
+            finally:
+                self.conn.commit()
+
+    def latest_version(self, task_id):
+        row = self.conn.execute("SELECT MAX(version) FROM versions WHERE task_id = ?", (task_id,)).fetchone()
+        return row[0] or 0
+
+    def append(self, ops):
+        """在一个事务内应用一组操作
+
+        返回值与 JsonTaskStore.append 一致：(其他实例的操作, 重新加载的
+        任务集合或None, 因版本冲突未写入的操作)。
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                fresh = None
+                external = self.read_external()
+                if external is None:
+                    fresh, external = self.read_tasks(), []
+                    self.external_reads += 1
+                ops, rejected = split_version_conflicts(ops, self.latest_version, self.conflicted)
+                rows = []
+                for op in ops:
+                    self.apply(op)
+                    self.seq += 1
+                    rows.append((self.seq, json.dumps(op, ensure_ascii=False, default=record_json)))
+                self.conn.executemany("INSERT INTO ops (seq, op) VALUES (?, ?)", rows)
+                self.conn.execute("DELETE FROM ops WHERE seq <= ?", (self.seq - SQLITE_OPS_KEEP,))
+                self.save_meta()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+        return external, fresh, rejected
+
+    def commit_batch(self, tasks, ops, fresh_bodies=False):
+        """一次提交大批修改（批量导入、归档用），在同一个事务内完成"""
+        self.append(ops)
+
+    def save_meta(self):
+        self.conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                              [("seq", str(self.seq)), ("next_id", str(self.next_id))])
+
+    def reserve_ids(self, count, floor=1):
+        """为新任务分配count个连续ID并返回第一个（meta表中的计数器在多个实例间共用）"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                first = max(int(self.get_meta("next_id", 1)), floor, self.next_id)
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_id', ?)",
+                                  (str(first + count),))
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+        self.next_id = first + count
+        return first
+
+    def rewrite(self, tasks):
+        """重写全部版本记录（批量转换数据后使用）
+
+        序号加一但不记入ops表，其他实例发现缺少这条操作后整体重新加载。
+        """
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM versions")
+                for t in tasks:
+                    for ver in t["description_history"]:
+                        self.insert_version(t["id"], ver)
+                self.seq = int(self.get_meta("seq", 0)) + 1
+                self.save_meta()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+    def import_tasks(self, tasks):
+        """批量写入任务（迁移用），一次提交"""
+        with self.conn:
+            for t in tasks:
+                self.insert_task(t)
+            self.next_id = max(self.next_id, tasks.next_id)
+            self.save_meta()
+
+    def count_tasks(self):
+        """返回 (任务总数, 已完成数)"""
+        with self.lock:
+            total, completed = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(completed), 0) FROM tasks").fetchone()
+        return total, completed
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, snapshot, merged_reads, on_bodies=None, fresh_bodies=False, retained=()):
+        snapshot.release()
+        return False
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def fsync_dir(path):
+    """改名后同步目录项（Windows不支持，忽略）"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def open_segment(path, mode="rb"):
+    """按扩展名打开归档分段：.xz 用lzma，.gz 用gzip（Python未带lzma时使用）"""
+    if path.endswith(".xz"):
+        import lzma
+        return lzma.open(path, mode, preset=ARCHIVE_XZ_PRESET if "w" in mode else None)
+    import gzip
+    return gzip.open(path, mode)
+
+
+def archive_record(task, version_reader=None):
+    """任务的独立副本（字典），版本内容经 version_reader（JsonTaskStore.read_version）读回，写入归档用"""
+    history = []
+    for ver in list(task["description_history"]):
+        if version_reader is not None:
+            # 只读不会被换掉的字段，内容另经 version_reader 读取
+            record = {k: ver[k] for k in ver.keys() if k not in ("content", "delta", "body")}
+            record.update(version_reader(ver))
+            ver = record
+        history.append(dict(ver))
+    return dict(task, description_history=history)
+
+
+def completion_time(task):
+    """任务标记完成的时间（整数秒）；没有记录的旧数据取最后修改时间，无法换算时为None"""
+    if isinstance(task, Task):
+        done = getattr(task, "completed_time", task.modified_time)
+    else:
+        done = pack_time(task.get("completed_time", task["modified_time"]))
+    return done if done.__class__ is int else None
+
+
+def archive_candidates(tasks, days, now=None):
+    """标记完成超过days天的已完成任务，按ID顺序"""
+    cutoff = pack_time((now or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")) - days * 86400
+    candidates = []
+    for t in tasks.with_status(True):
+        done = completion_time(t)
+        if done is not None and done <= cutoff:
+            candidates.append(t)
+    return candidates
+
+
+class TaskArchive:
+    """已完成任务的归档：压缩的分段文件 + 紧凑的ID/时间索引
+
+    归档目录（任务文件名加 .archive）中，每次归档按 ARCHIVE_SEGMENT_TASKS
+    个任务一段写出新的分段文件（lzma压缩，每行一个任务，版本内容完整
+    写入），写出后不再修改，分段编号也不复用。index 文件是按ID排序的
+    三个整数数组：任务ID、所在分段和完成时间，每个任务24字节；翻页和
+    恢复时只解压用到的分段，并缓存最近用过的几段。恢复的任务从索引中
+    移除，分段中的任务全部恢复后删除该分段。
+
+    修改索引时持有 任务文件名.archive.lock 上的文件锁，多个实例可以
+    同时使用；其他实例改过索引后，refresh() 会重新读取。
+    """
+
+    def __init__(self, path):
+        self.dir = path + ".archive"
+        self.index_path = os.path.join(self.dir, "index")
+        self.file_lock = FileLock(path + ".archive.lock")
+        self.ids = array("q")
+        self.segments = array("q")
+        self.times = array("q")
+        self.next_segment = 1
+        self.index_id = None
+        # ids_by_time() 的结果，索引变化时清空
+        self.by_time = None
+        # 分段号 -> {任务ID: Task}，最近用过的在最后
+        self.cache = OrderedDict()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, task_id):
+        i = bisect.bisect_left(self.ids, task_id)
+        return i < len(self.ids) and self.ids[i] == task_id
+
+    def refresh(self):
+        """索引文件被（其他实例）修改过时重新读取"""
+        index_id = file_identity(self.index_path)
+        if index_id == self.index_id:
+            return
+        ids, segments, times = array("q"), array("q"), array("q")
+        next_segment = 1
+        if index_id is not None:
+            with open(self.index_path, "rb") as f:
+                magic, next_segment, count = struct.unpack("<8sqq", f.read(24))
+                if magic != ARCHIVE_INDEX_MAGIC:
+                    raise ValueError(f"无法识别的归档索引: {self.index_path}")
+                for column in (ids, segments, times):
+                    column.fromfile(f, count)
+                    if sys.byteorder == "big":
+                        column.byteswap()
+        self.ids, self.segments, self.times = ids, segments, times
+        self.next_segment = next_segment
+        self.index_id = index_id
+        self.by_time = None
+
+    def write_index(self, entries):
+        """用 [(任务ID, 分段, 时间)] 原子替换索引（持有文件锁时调用）"""
+        entries.sort()
+        columns = [array("q", column) for column in zip(*entries)] or [array("q"), array("q"), array("q")]
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(struct.pack("<8sqq", ARCHIVE_INDEX_MAGIC, self.next_segment, len(entries)))
+            for column in columns:
+                if sys.byteorder == "big":
+                    column = array("q", column)
+                    column.byteswap()
+                column.tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.index_path)
+        fsync_dir(self.dir)
+        self.ids, self.segments, self.times = columns
+        self.index_id = file_identity(self.index_path)
+        self.by_time = None
+
+    def segment_path(self, segment):
+        path = os.path.join(self.dir, f"segment-{segment:06d}")
+        return path + ".xz" if not os.path.exists(path + ".gz") else path + ".gz"
+
+    def add(self, records):
+        """把任务（archive_record 得到的字典）写入新的分段并加入索引，返回写入的任务数
+
+        按完成时间从新到旧分段，与“已归档”列表的顺序一致，翻一页只需解压一两段。
+        """
+        if not records:
+            return 0
+        stamps = {t["id"]: completion_time(t) or 0 for t in records}
+        records = sorted(records, key=lambda t: (-stamps[t["id"]], t["id"]))
+        try:
+            import lzma  # noqa: F401
+            suffix = ".xz"
+        except ImportError:
+            suffix = ".gz"
+        os.makedirs(self.dir, exist_ok=True)
+        with self.file_lock:
+            self.refresh()
+            entries = {tid: (tid, seg, t) for tid, seg, t in zip(self.ids, self.segments, self.times)}
+            for start in range(0, len(records), ARCHIVE_SEGMENT_TASKS):
+                segment = self.next_segment
+                self.next_segment += 1
+                path = os.path.join(self.dir, f"segment-{segment:06d}{suffix}")
+                tmp_path = os.path.join(self.dir, f"segment-{segment:06d}.tmp{suffix}")
+                with open_segment(tmp_path, "wb") as f:
+                    for t in records[start:start + ARCHIVE_SEGMENT_TASKS]:
+                        f.write((json.dumps(t, ensure_ascii=False, default=record_json) + "\n").encode("utf-8"))
+                        entries[t["id"]] = (t["id"], segment, stamps[t["id"]])
+                with open(tmp_path, "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, path)
+            self.write_index(list(entries.values()))
+        return len(records)
+
+    def read_segment(self, segment):
+        tasks = self.cache.get(segment)
+        if tasks is not None:
+            self.cache.move_to_end(segment)
+            return tasks
+        tasks = {}
+        with open_segment(self.segment_path(segment)) as f:
+            for line in f:
+                t = as_task(json.loads(line))
+                tasks[t["id"]] = t
+        self.cache[segment] = tasks
+        if len(self.cache) > ARCHIVE_CACHE_SEGMENTS:
+            self.cache.popitem(last=False)
+        return tasks
+
+    def read(self, task_ids):
+        """按ID读取归档的任务，返回 {任务ID: Task}；只解压这些任务所在的分段"""
+        by_segment = {}
+        for tid in task_ids:
+            i = bisect.bisect_left(self.ids, tid)
+            if i < len(self.ids) and self.ids[i] == tid:
+                by_segment.setdefault(self.segments[i], []).append(tid)
+        found = {}
+        for segment, ids in by_segment.items():
+            tasks = self.read_segment(segment)
+            found.update((tid, tasks[tid]) for tid in ids if tid in tasks)
+        return found
+
+    def get(self, task_id):
+        return self.read([task_id]).get(task_id)
+
+    def ids_by_time(self):
+        """按完成时间从新到旧（相同时按ID）排列的任务ID"""
+        if self.by_time is None:
+            order = sorted(range(len(self.ids)), key=lambda i: (-self.times[i], self.ids[i]))
+            self.by_time = [self.ids[i] for i in order]
+        return self.by_time
+
+    def remove(self, task_ids):
+        """从索引中移除任务（恢复后调用），删除已没有任务的分段"""
+        removed = set(task_ids)
+        with self.file_lock:
+            self.refresh()
+            entries = [e for e in zip(self.ids, self.segments, self.times) if e[0] not in removed]
+            old_segments = set(self.segments)
+            self.write_index(entries)
+            for segment in old_segments - set(self.segments):
+                self.cache.pop(segment, None)
+                try:
+                    os.remove(self.segment_path(segment))
+                except FileNotFoundError:
+                    pass
+        for segment in list(self.cache):
+            # 恢复的任务对象已交给任务集合，不再从缓存中取出
+            if not removed.isdisjoint(self.cache[segment]):
+                del self.cache[segment]
+
+    def close(self):
+        self.file_lock.close()
+
+
+class ArchivedView:
+    """“已归档”列表：按完成时间从新到旧，切片时才解压所需的分段（虚拟列表只取可见的几十行）"""
+
+    def __init__(self, archive, exclude=()):
+        self.archive = archive
+        # exclude 中的任务（恢复后尚未从归档中移除的）不再列出
+        self.order = [tid for tid in archive.ids_by_time() if tid not in exclude] if exclude else archive.ids_by_time()
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            ids = self.order[index]
+            tasks = self.archive.read(ids)
+            return [tasks[tid] for tid in ids if tid in tasks]
+        return self.archive.get(self.order[index])
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+def archive_tasks_file(tasks_path, days):
+    """把任务文件中完成超过days天的任务移入归档，返回归档的任务数
+
+    先写归档（分段和索引落盘），再从任务文件中删除；中途失败时任务
+    最多在两处各有一份，不会丢失。
+    """
+    store = open_task_store(tasks_path)
+    archive = TaskArchive(tasks_path)
+    try:
+        tasks = store.load()
+        reader = getattr(store, "read_version", None)
+        candidates = archive_candidates(tasks, days)
+        archive.add([archive_record(t, reader) for t in candidates])
+        if candidates:
+            ids = [t["id"] for t in candidates]
+            tasks.remove(ids)
+            store.commit_batch(tasks, [{"op": "delete", "ids": ids}], fresh_bodies=True)
+        return len(candidates)
+    finally:
+        archive.close()
+        store.close()
+
+
+def restore_tasks_file(tasks_path, task_ids):
+    """把归档中的任务恢复到任务文件，返回恢复的任务数"""
+    store = open_task_store(tasks_path)
+    archive = TaskArchive(tasks_path)
+    try:
+        found = archive.read(task_ids)
+        if found:
+            store.append([{"op": "add", "task": found[tid]} for tid in sorted(found)])
+            archive.remove(found)
+        return len(found)
+    finally:
+        archive.close()
+        store.close()
+
+
+def freeze_op(op):
+    """提交给后台线程前复制操作中会被继续修改的部分（任务字典和版本列表）"""
+    if op["op"] == "add":
+        task = op["task"]
+        return dict(op, task=dict(task, description_history=list(task["description_history"])))
+    return op
+
+
+def coalesce_ops(ops):
+    """合并同一任务上连续的字段修改，减少写入量"""
+    merged = []
+    # 任务ID -> 该任务最近一条update在merged中的位置
+    last_update = {}
+    for op in ops:
+        if op["op"] == "update":
+            index = last_update.get(op["id"])
+            if index is not None:
+                merged[index] = dict(merged[index], fields=dict(merged[index]["fields"], **op["fields"]))
+                continue
+            last_update[op["id"]] = len(merged)
+        elif op["op"] == "delete":
+            for tid in op["ids"]:
+                last_update.pop(tid, None)
+        else:
+            last_update.pop(op.get("id"), None)
+        merged.append(op)
+    return merged
+
+
+class PersistenceWorker:
+    """后台持久化线程
+
+    UI线程只把操作放入队列；后台线程收到第一条操作后再等待
+    SAVE_DEBOUNCE_SECONDS，把这段时间内的所有操作合并成一次写入。
+    写入结果通过 on_saved / on_error 回调通知（在后台线程中调用，
+    调用方负责转交给UI线程）。写入时读到的其他实例的修改和被拒绝的
+    冲突版本通过 on_external(其他实例的操作, 重新加载的任务或None,
+    被拒绝的操作) 通知，先于对应的 on_saved。
+    """
+
+    def __init__(self, store, on_saved, on_error, delay=SAVE_DEBOUNCE_SECONDS, on_external=None):
+        self.store = store
+        self.on_saved = on_saved
+        self.on_error = on_error
+        self.on_external = on_external
+        self.delay = delay
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def submit(self, ops):
+        self.queue.put([freeze_op(op) for op in ops])
+
+    def flush(self):
+        """阻塞直到已提交的操作全部写入"""
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def run_after_written(self, func):
+        """已提交的操作全部写入后在后台线程中调用func()，不阻塞调用方"""
+        self.queue.put(func)
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            batch = []
+            waiters = []
+            deadline = time.monotonic() + self.delay
+            while True:
+                if isinstance(item, threading.Event) or callable(item):
+                    # flush请求或写完后要执行的函数：不再等待，立即写入
+                    waiters.append(item)
+                    break
+                batch.extend(item)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # close() 总是先flush，这里不会丢操作
+                    self.queue.put(None)
+                    break
+            if batch:
+                self.write(batch)
+            for done in waiters:
+                if isinstance(done, threading.Event):
+                    done.set()
+                else:
+                    done()
+
+    def write(self, batch):
+        try:
+            ops = coalesce_ops(batch)
+            external, fresh, rejected = self.store.append(ops)
+        except Exception as e:
+            self.on_error(e, len(batch))
+            return
+        if self.on_external is not None and (external or fresh is not None or rejected):
+            self.on_external(external, fresh, rejected)
+        self.on_saved(len(batch), len(ops))
+
+
+class FileWatcher:
+    """监视数据文件，发现变化后在后台线程中调用 on_change()
+
+    Linux上通过ctypes使用inotify监视文件所在目录（文件被改名替换也能
+    收到事件），短时间内的连续变化合并为一次回调；其他系统或inotify
+    不可用时，每隔 WATCH_POLL_SECONDS 比较一次文件的大小和修改时间。
+    """
+
+    def __init__(self, paths, on_change, poll_interval=WATCH_POLL_SECONDS, debounce=WATCH_DEBOUNCE_SECONDS):
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.names = {os.fsencode(os.path.basename(path)) for path in self.paths}
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.stopped = threading.Event()
+        self.inotify_fd = self.open_inotify(os.path.dirname(self.paths[0]))
+        if self.inotify_fd is not None:
+            target, args = self.watch_inotify, ()
+        else:
+            # 在启动线程之前记下文件状态，之后的修改都能发现
+            target, args = self.watch_polling, ([file_identity(path) for path in self.paths],)
+        self.thread = threading.Thread(target=target, args=args, name="watcher", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def open_inotify(directory):
+        """打开inotify并监视目录，不支持时返回None"""
+        if not sys.platform.startswith("linux"):
+            return None
+        try:
+            import ctypes
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(directory), INOTIFY_MASK) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def read_events(self):
+        """读出已到达的inotify事件，返回其中是否有被监视的文件"""
+        matched = False
+        while True:
+            try:
+                data = os.read(self.inotify_fd, 65536)
+            except BlockingIOError:
+                return matched
+            offset = 0
+            while offset < len(data):
+                # struct inotify_event: wd, mask, cookie, len，之后是以NUL补齐的文件名
+                _, _, _, length = struct.unpack_from("iIII", data, offset)
+                offset += 16
+                if data[offset:offset + length].rstrip(b"\0") in self.names:
+                    matched = True
+                offset += length
+
+    def watch_inotify(self):
+        try:
+            while not self.stopped.is_set():
+                readable, _, _ = select.select([self.inotify_fd], [], [], self.poll_interval)
+                if not readable or not self.read_events():
+                    continue
+                # 一次保存会产生多个事件，稍等片刻一并处理
+                if self.stopped.wait(self.debounce):
+                    break
+                self.read_events()
+                self.on_change()
+        finally:
+            os.close(self.inotify_fd)
+
+    def watch_polling(self, identities):
+        while not self.stopped.wait(self.poll_interval):
+            current = [file_identity(path) for path in self.paths]
+            if current != identities:
+                identities = current
+                self.on_change()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class Tracer:
+    """可选的耗时追踪（--trace 或环境变量 TASK_MANAGER_TRACE 开启）
+
+    instrument() 把类的方法或模块中的函数替换为计时包装，每次调用
+    记入环形缓冲区并累计次数和总耗时；dump() 写出Chrome追踪格式的JSON，
+    可在 chrome://tracing 或 Perfetto 中查看。未开启时不安装任何包装。
+    """
+
+    def __init__(self, path, capacity=TRACE_BUFFER_SIZE):
+        self.path = path
+        self.events = deque(maxlen=capacity)
+        # 名称 -> [调用次数, 总耗时（秒）]
+        self.stats = {}
+        self.thread_names = {}
+        self.last = None
+        # 随追踪一起写入 otherData 的其他统计（如界面重绘次数）
+        self.other = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def traced(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, start, time.perf_counter() - start)
+        return traced
+
+    def instrument(self, target, names, prefix=""):
+        """包装target（类或模块）上存在的同名函数"""
+        for name in names:
+            func = getattr(target, name, None)
+            if func is not None:
+                setattr(target, name, self.wrap(prefix + name, func))
+
+    def record(self, name, start, duration):
+        thread = threading.current_thread()
+        with self.lock:
+            self.events.append((name, start, duration, thread.ident))
+            self.thread_names[thread.ident] = thread.name
+            stat = self.stats.setdefault(name, [0, 0.0])
+            stat[0] += 1
+            stat[1] += duration
+            self.last = (name, duration)
+
+    def dump(self, path=None):
+        """写出Chrome追踪格式的文件，返回文件路径"""
+        path = path or self.path
+        with self.lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+            stats = {name: {"count": count, "total_ms": round(total * 1000, 3)}
+                     for name, (count, total) in self.stats.items()}
+        pid = os.getpid()
+        trace = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                 for tid, name in thread_names.items()]
+        trace.extend({"name": name, "ph": "X", "pid": pid, "tid": tid,
+                      "ts": round(start * 1e6, 3), "dur": round(duration * 1e6, 3)}
+                     for name, start, duration, tid in events)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms", "otherData": dict(self.other, stats=stats)},
+                      f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return path
+
+
+class RefreshScheduler:
+    """合并界面刷新：修改只把区域标记为需要重绘，空闲时每个区域只重绘一次
+
+    schedule 为 root.after_idle 一类的函数，同一轮事件循环中第一次标记时
+    调用一次。区域按注册顺序重绘；covers 是重绘该区域时顺带完成的区域
+    （重新筛选列表时已刷新了行和状态栏），这些区域在本轮跳过。
+    requested/painted 分别统计各区域被标记和实际重绘的次数，两者之差
+    就是省下的重绘。
+    """
+
+    def __init__(self, schedule):
+        self.schedule = schedule
+        # 区域 -> (重绘函数, 顺带完成的区域)，按注册顺序重绘
+        self.painters = {}
+        self.dirty = set()
+        self.pending = False
+        self.requested = {}
+        self.painted = {}
+
+    def register(self, region, paint, covers=()):
+        self.painters[region] = (paint, tuple(covers))
+        self.requested.setdefault(region, 0)
+        self.painted.setdefault(region, 0)
+
+    def mark(self, *regions):
+        """标记区域需要重绘（未注册的区域抛出KeyError）"""
+        for region in regions:
+            self.requested[region] += 1
+            self.dirty.add(region)
+        if not self.pending:
+            self.pending = True
+            self.schedule(self.flush)
+
+    def flush(self):
+        """重绘所有标记过的区域，每个一次"""
+        self.pending = False
+        dirty, self.dirty = self.dirty, set()
+        for region, (paint, covers) in self.painters.items():
+            if region in dirty:
+                dirty.difference_update(covers)
+                self.painted[region] += 1
+                paint()
+
+    def saved(self):
+        """省下的重绘次数"""
+        return sum(self.requested.values()) - sum(self.painted.values())
+
+    def counts(self):
+        """{区域: {"requested": 标记次数, "painted": 重绘次数}}"""
+        return {region: {"requested": self.requested[region], "painted": self.painted[region]}
+                for region in self.painters}
+
+
+def make_folder(folder_path):
+    """创建文件夹（已存在时不处理），失败时抛出异常"""
+    if not os.path.isdir(folder_path):
+        os.makedirs(folder_path, exist_ok=True)
+
+
+def reflink_file(src, dst):
+    """让dst与src共享数据块（Linux上的Btrfs、XFS等），之后修改任一个不影响另一个
+
+    文件系统不支持时抛出OSError，不留下dst。
+    """
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.EOPNOTSUPP, "仅Linux支持reflink")
+    import fcntl
+    import shutil
+    with open(src, "rb") as fsrc, open(dst, "xb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def clone_file(src, dst, methods):
+    """把src复制为dst，按methods的顺序尝试 reflink、硬链接、普通复制，返回所用的方式
+
+    某种方式失败时（通常是文件系统不支持，或跨设备）从methods中移除，
+    同一批的其余文件不再尝试；普通复制失败时抛出异常。
+    """
+    import shutil
+    for method in list(methods):
+        try:
+            if method == "reflink":
+                reflink_file(src, dst)
+            elif method == "hardlink":
+                os.link(src, dst)
+            else:
+                shutil.copy2(src, dst)
+            return method
+        except OSError:
+            if method == "copy":
+                raise
+            methods.remove(method)
+
+
+def seed_version_folder(src, dst, on_progress=None):
+    """创建新版本文件夹dst，并用上一版本文件夹src中的文件填充，返回 {方式: 文件数}
+
+    文件优先用reflink共享数据块，不支持时用硬链接（两个版本是同一个
+    文件，原地修改会同时改动两边；多数程序保存时会写新文件替换，不受
+    影响），最后才完整复制。dst中已有的文件不覆盖。src为None或不存在时
+    只创建空文件夹。on_progress(已处理文件数, 文件总数) 在调用线程中
+    执行，间隔不小于 SEED_PROGRESS_SECONDS。
+    """
+    make_folder(dst)
+    if not src or not os.path.isdir(src) or os.path.abspath(src) == os.path.abspath(dst):
+        return {}
+    files = []
+    for root, dirs, names in os.walk(src):
+        target = os.path.normpath(os.path.join(dst, os.path.relpath(root, src)))
+        os.makedirs(target, exist_ok=True)
+        # 指向目录的符号链接不会被遍历，和文件一起按链接处理
+        names.extend(d for d in dirs if os.path.islink(os.path.join(root, d)))
+        files.extend((os.path.join(root, name), os.path.join(target, name)) for name in names)
+    methods = ["reflink", "hardlink", "copy"]
+    counts = {}
+    last_report = time.perf_counter()
+    for done, (source, target) in enumerate(files, 1):
+        if not os.path.lexists(target):
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+                method = "symlink"
+            else:
+                method = clone_file(source, target, methods)
+            counts[method] = counts.get(method, 0) + 1
+        now = time.perf_counter()
+        if on_progress is not None and (now - last_report >= SEED_PROGRESS_SECONDS or done == len(files)):
+            last_report = now
+            on_progress(done, len(files))
+    return counts
+
+
+def file_extents(fd):
+    """用FIEMAP读取文件的物理区段，返回 [(物理偏移, 长度, 标志)]；不支持时抛出OSError"""
+    import fcntl
+    extents = []
+    start = 0
+    while True:
+        buf = bytearray(struct.pack("=QQIIII", start, FIEMAP_MAX_OFFSET - start, 0, 0, FIEMAP_EXTENT_COUNT, 0))
+        buf.extend(bytes(56 * FIEMAP_EXTENT_COUNT))
+        fcntl.ioctl(fd, FS_IOC_FIEMAP, buf)
+        mapped = struct.unpack_from("=I", buf, 20)[0]
+        if not mapped:
+            return extents
+        for i in range(mapped):
+            logical, physical, length, flags = struct.unpack_from("=QQQ16xI", buf, 32 + 56 * i)
+            extents.append((physical, length, flags))
+        if flags & FIEMAP_EXTENT_LAST:
+            return extents
+        start = logical + length
+
+
+class ExtentSet:
+    """已计入的物理区段（有序、互不相交），add() 返回新区段中此前未计入的字节数"""
+
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+
+    def add(self, start, end):
+        # 与 [start, end) 相交或相接的已有区段为 [i, j)
+        i = bisect.bisect_left(self.ends, start)
+        j = bisect.bisect_right(self.starts, end)
+        covered = sum(max(0, min(e, end) - max(s, start)) for s, e in zip(self.starts[i:j], self.ends[i:j]))
+        new = end - start - covered
+        if i < j:
+            start, end = min(start, self.starts[i]), max(end, self.ends[j - 1])
+        self.starts[i:j] = [start]
+        self.ends[i:j] = [end]
+        return new
+
+
+def folder_disk_usage(folders):
+    """按版本统计文件夹的磁盘占用，多个版本共享的数据只计一次
+
+    folders 为按版本从旧到新排列的 [(版本号, 路径)]，返回
+    [(版本号, 文件数, 文件大小合计, 新占用字节数)]。新占用是该版本中
+    没有被更早的版本计入过的空间：硬链接按 (设备, inode) 去重；Linux上
+    再用FIEMAP按物理区段去重，reflink得到的文件以及之后部分修改过的
+    文件也只计不同的部分。各版本新占用之和即全部版本实际占用的空间。
+    """
+    seen_inodes = set()
+    # 设备 -> 已计入的共享区段；不支持FIEMAP的设备记为None
+    shared = {}
+    report = []
+    for version, folder in folders:
+        files = size = new = 0
+        for root, dirs, names in os.walk(folder):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                files += 1
+                size += st.st_size
+                if (st.st_dev, st.st_ino) in seen_inodes:
+                    continue
+                seen_inodes.add((st.st_dev, st.st_ino))
+                new += file_new_bytes(path, st, shared)
+        report.append((version, files, size, new))
+    return report
+
+
+def file_new_bytes(path, st, shared):
+    """文件占用中尚未计入的字节数；只有标记为共享的区段需要按物理位置去重"""
+    blocks = getattr(st, "st_blocks", None)
+    allocated = st.st_size if blocks is None else blocks * 512
+    if not sys.platform.startswith("linux") or shared.get(st.st_dev, True) is None:
+        return allocated
+    try:
+        with open(path, "rb") as f:
+            extents = file_extents(f.fileno())
+    except OSError as e:
+        if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL):
+            shared[st.st_dev] = None
+        return allocated
+    total = 0
+    for physical, length, flags in extents:
+        if flags & FIEMAP_EXTENT_SHARED and not flags & FIEMAP_EXTENT_NO_PHYSICAL:
+            total += shared.setdefault(st.st_dev, ExtentSet()).add(physical, physical + length)
+        else:
+            total += length
+    return total
+
+
+def format_size(n):
+    """字节数显示为 B/KB/MB/GB"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f}{unit}" if unit == "B" else f"{n:.1f}{unit}"
+        n /= 1024
+
+
+def launch_file_manager(folder_path):
+    """用系统文件管理器打开文件夹，失败时抛出异常"""
+    if not os.path.exists(folder_path):
+        raise FileNotFoundError("文件夹不存在！")
+    # 只在打开文件夹时才用到，推迟导入以加快启动
+    import platform
+    import subprocess
+    system = platform.system()
+    if system == "Windows":
+        # Windows：使用 explorer 打开
+        subprocess.Popen(["explorer", folder_path])
+    elif system == "Darwin":
+        # macOS：使用 open 打开
+        subprocess.Popen(["open", folder_path])
+    elif system == "Linux":
+        # Linux：使用 xdg-open 打开
+        subprocess.Popen(["xdg-open", folder_path])
+    else:
+        raise OSError("暂不支持该操作系统的文件夹打开操作！")
+
+
+def open_task_store(path):
+    """按文件扩展名选择存储后端：.db/.sqlite/.sqlite3 使用SQLite，其余为JSON"""
+    if os.path.splitext(path)[1].lower() in (".db", ".sqlite", ".sqlite3"):
+        return SQLiteTaskStore(path)
+    return JsonTaskStore(path)
+
+
+def migrate_json_to_sqlite(json_path, db_path):
+    """把tasks.json（含日志和旧格式记录）一次性迁移到SQLite，返回迁移的任务数"""
+    tasks = JsonTaskStore(json_path).load(resolve_bodies=True)
+    store = SQLiteTaskStore(db_path)
+    try:
+        if store.count_tasks()[0]:
+            raise ValueError(f"{db_path} 中已有任务，拒绝覆盖")
+        store.import_tasks(tasks)
+    finally:
+        store.close()
+    return len(tasks)
+
+
+def convert_history(path):
+    """把已有任务文件的版本历史转换为关键帧+差量编码，返回 (转换前, 转换后) 的历史数据字节数"""
+    store = open_task_store(path)
+    try:
+        tasks = store.load(resolve_bodies=True)
+        cache = VersionContentCache()
+        before = after = 0
+        for t in tasks:
+            before += len(json.dumps(t["description_history"], ensure_ascii=False, default=record_json).encode("utf-8"))
+            cache.reencode(t)
+            after += len(json.dumps(t["description_history"], ensure_ascii=False, default=record_json).encode("utf-8"))
+        store.rewrite(tasks)
+    finally:
+        store.close()
+    return before, after
+
+
+def task_folder_path(base_dir, project, short_desc, ver):
+    """生成合法的版本文件夹路径：基础目录/项目/简易描述/版本号"""
+    # 替换非法字符
+    safe_project = re.sub(r'[\\/:*?"<>|]', '_', project.strip())
+    safe_desc = re.sub(r'[\\/:*?"<>|]', '_', short_desc.strip())
+    safe_ver = re.sub(r'[\\/:*?"<>|]', '_', ver.strip())
+    return os.path.join(base_dir, safe_project, safe_desc, safe_ver)
+
+
+def data_file_format(path, formats, fmt=None):
+    """确定导入/导出文件的格式：显式指定优先，否则按扩展名判断"""
+    if fmt is None:
+        fmt = os.path.splitext(path)[1].lower().lstrip(".")
+        fmt = {"json": "jsonl", "ndjson": "jsonl", "markdown": "md"}.get(fmt, fmt)
+    if fmt not in formats:
+        raise ValueError(f"无法识别的文件格式: {path}（支持 {'/'.join(formats)}）")
+    return fmt
+
+
+def read_import_records(path, fmt):
+    """逐条读取待导入的记录，生成 (行号, 记录)
+
+    JSONL每行一个任务；CSV每行一个版本，id列相同的相邻行属于同一个
+    任务（导出的CSV可原样导入），没有id列时每行是一个任务。
+    """
+    import csv
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        if fmt == "jsonl":
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line)
+                except ValueError as e:
+                    yield line_no, e
+            return
+        record = None
+        reader = csv.DictReader(f)
+        for row in reader:
+            ver = {
+                "content": row.get("content") or row.get("description") or "",
+                "timestamp": row.get("timestamp"),
+                "action": row.get("action"),
+                "folder_path": row.get("folder_path"),
+            }
+            task_id = (row.get("id") or "").strip()
+            if record is not None and task_id and task_id == record[1].get("id"):
+                record[1]["description_history"].append(ver)
+                continue
+            if record is not None:
+                yield record
+            record = (reader.line_num, dict(row, id=task_id, description_history=[ver]))
+        if record is not None:
+            yield record
+
+
+def parse_import_time(value, default, name):
+    if value in (None, ""):
+        return default
+    try:
+        return datetime.strptime(str(value).strip(), "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        raise ValueError(f"{name} 格式应为 YYYY-MM-DD HH:MM:SS: {value}")
+
+
+def parse_import_record(record, now):
+    """校验并整理一条导入记录，返回 (任务字段, 版本列表)；不合法时抛出ValueError"""
+    if isinstance(record, ValueError):
+        raise ValueError(f"JSON格式错误: {record}")
+    if not isinstance(record, dict):
+        raise ValueError("每条记录必须是一个对象")
+    short_desc = str(record.get("short_desc") or "").strip()
+    if not short_desc:
+        raise ValueError("简易描述(short_desc)不能为空")
+    project = str(record.get("project") or "").strip() or "未分类"
+    priority = str(record.get("priority") or "中").strip()
+    if priority not in ("高", "中", "低"):
+        raise ValueError(f"优先级(priority)必须是 高/中/低: {priority}")
+    completed = record.get("completed", False)
+    if not isinstance(completed, bool):
+        value = str(completed).strip().lower()
+        if value in ("1", "true", "yes", "是", "已完成"):
+            completed = True
+        elif value in ("", "0", "false", "no", "否", "未完成"):
+            completed = False
+        else:
+            raise ValueError(f"无法识别的完成状态(completed): {completed}")
+    create_time = parse_import_time(record.get("create_time"), now, "create_time")
+
+    history = record.get("description_history")
+    if history is None:
+        history = [{"content": record.get("description") or ""}]
+    if not isinstance(history, list) or not history:
+        raise ValueError("版本历史(description_history)必须是非空列表")
+    versions = []
+    for n, ver in enumerate(history, 1):
+        if not isinstance(ver, dict) or not isinstance(ver.get("content", ""), str):
+            raise ValueError(f"第{n}个版本必须包含文本内容(content)")
+        versions.append({
+            "content": ver.get("content", ""),
+            "timestamp": parse_import_time(ver.get("timestamp"), create_time, f"第{n}个版本的timestamp"),
+            "action": ver.get("action") or ("创建" if n == 1 else "修改"),
+            "folder_path": ver.get("folder_path") or None,
+        })
+    fields = {
+        "project": project,
+        "short_desc": short_desc,
+        "priority": priority,
+        "create_time": create_time,
+        "modified_time": parse_import_time(record.get("modified_time"), versions[-1]["timestamp"], "modified_time"),
+        "completed": completed,
+    }
+    return fields, versions
+
+
+def import_tasks_file(tasks_path, source, fmt=None, base_dir=None, create_folders=True, on_progress=None):
+    """把JSONL/CSV文件中的任务批量导入任务数据文件，不需要启动界面
+
+    记录按 IMPORT_CHUNK_SIZE 条一批读入、校验并分配ID（每批向存储预留
+    一段ID，与同时运行的界面实例不会重复）；全部记录都合法时才一次性
+    提交，有错误时不写入任何数据并抛出ValueError。版本文件夹在提交后
+    批量创建。on_progress(已处理条数) 可选。
+    返回 (导入的任务数, 创建失败的文件夹列表)。
+    """
+    fmt = data_file_format(source, ("jsonl", "csv"), fmt)
+    base_dir = os.path.abspath(base_dir or os.getcwd())
+    store = open_task_store(tasks_path)
+    try:
+        tasks = store.load()
+        history = VersionContentCache()
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        ops = []
+        folders = []
+        errors = []
+        processed = 0
+        records = read_import_records(source, fmt)
+        while True:
+            chunk = list(itertools.islice(records, IMPORT_CHUNK_SIZE))
+            if not chunk:
+                break
+            if not errors:
+                tasks.next_id = store.reserve_ids(len(chunk), tasks.next_id)
+            for line_no, record in chunk:
+                try:
+                    fields, versions = parse_import_record(record, now)
+                except ValueError as e:
+                    errors.append(f"第{line_no}行: {e}")
+                    continue
+                if errors:
+                    # 已有错误时只继续校验，不再构建任务
+                    continue
+                task = Task({"id": tasks.allocate_id(), **fields, "description_history": []})
+                for n, ver in enumerate(versions, 1):
+                    folder_path = ver["folder_path"]
+                    if folder_path is None:
+                        folder_path = task_folder_path(base_dir, task["project"], task["short_desc"], str(n))
+                        folders.append(folder_path)
+                    task["description_history"].append(history.make_version(
+                        task, n, ver["content"],
+                        timestamp=ver["timestamp"], action=ver["action"], folder_path=folder_path
+                    ))
+                tasks.add(task)
+                ops.append({"op": "add", "task": task})
+            if len(errors) >= IMPORT_ERROR_LIMIT:
+                break
+            processed += len(chunk)
+            if on_progress is not None:
+                on_progress(processed)
+        if errors:
+            more = f"\n……（至少{len(errors)}处错误）" if len(errors) >= IMPORT_ERROR_LIMIT else ""
+            raise ValueError("\n".join(errors[:IMPORT_ERROR_LIMIT]) + more)
+        if ops:
+            store.commit_batch(tasks, ops)
+    finally:
+        store.close()
+
+    failures = []
+    if create_folders and folders:
+        with ThreadPoolExecutor(max_workers=FOLDER_WORKERS) as pool:
+            for path, future in [(path, pool.submit(make_folder, path)) for path in dict.fromkeys(folders)]:
+                if future.exception() is not None:
+                    failures.append((path, future.exception()))
+    return len(ops), failures
+
+
+def export_tasks(tasks, content, fmt):
+    """把任务及完整版本历史逐条导出为 jsonl/csv/md 文本片段（生成器）
+
+    content(task, ver) 返回版本的完整内容；每次只处理一个任务，
+    内存占用与任务总数无关。
+    """
+    if fmt == "csv":
+        import csv
+        import io
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def csv_row(values):
+            writer.writerow(values)
+            text = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return text
+
+        yield csv_row(EXPORT_CSV_COLUMNS)
+    elif fmt == "md":
+        yield "# 任务导出\n"
+    for t in tasks:
+        history = [(ver, content(t, ver)) for ver in t["description_history"]]
+        if fmt == "jsonl":
+            record = {k: v for k, v in t.items() if k != "description_history"}
+            record["description_history"] = [
+                dict({k: v for k, v in ver.items() if k not in ("content", "delta", "body")}, content=text)
+                for ver, text in history
+            ]
+            yield json.dumps(record, ensure_ascii=False) + "\n"
+        elif fmt == "csv":
+            status = "已完成" if t["completed"] else "未完成"
+            for ver, text in history:
+                yield csv_row((t["id"], t["project"], t["short_desc"], t["priority"], status,
+                               t["create_time"], t["modified_time"], ver["version"], ver.get("timestamp"),
+                               ver.get("action"), ver.get("folder_path"), text))
+        else:
+            status = "已完成" if t["completed"] else "未完成"
+            lines = [
+                f"\n## #{t['id']} {t['short_desc']}\n",
+                f"- 项目: {t['project']}",
+                f"- 优先级: {t['priority']}",
+                f"- 状态: {status}",
+                f"- 创建时间: {t['create_time']}",
+                f"- 修改时间: {t['modified_time']}",
+            ]
+            for ver, text in history:
+                lines.append(f"\n### v{ver['version']} {ver.get('timestamp', '')} {ver.get('action', '')}\n")
+                # 内容逐行引用，避免其中的 # 等字符破坏文档结构
+                lines.extend(f"> {line}" if line else ">" for line in (text.splitlines() or [""]))
+            yield "\n".join(lines) + "\n"
+
+
+def export_tasks_file(tasks_path, out, fmt):
+    """把任务数据文件流式导出到已打开的文本文件out，返回导出的任务数
+
+    任务逐批读出（已应用日志），不把全部任务读入内存。
+    """
+    store = open_task_store(tasks_path)
+    try:
+        history = VersionContentCache(version_reader=getattr(store, "read_version", None))
+        count = 0
+
+        def tasks():
+            nonlocal count
+            for ops in store.iter_load(merge_journal=True):
+                count += len(ops)
+                for op in ops:
+                    yield op["task"]
+
+        for chunk in export_tasks(tasks(), history.content, fmt):
+            out.write(chunk)
+        return count
+    finally:
+        store.close()
+
 
 class TaskManager:
-    def __init__(self, root):
+    def __init__(self, root, tasks_file="tasks.json", auto_open_folders=True, tracer=None,
+                 archive_days=ARCHIVE_AFTER_DAYS):
         self.root = root
         self.root.title("任务记录工具")
         self.root.geometry("900x600")
@@ -26,69 +3671,361 @@ class TaskManager:
         # 全局字体设置
         self.root.option_add("*Font", f"SimHei {self.font_size}")
 
-        self.tasks = []
-        self.tasks_file = "tasks.json"
+        self.init_state(tasks_file, self.root.after_idle, tracer=tracer, archive_days=archive_days)
+        # 新建任务/版本后是否自动打开文件夹
+        self.auto_open_var = tk.BooleanVar(value=auto_open_folders)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.root.after(UI_POLL_INTERVAL_MS, self.poll_ui_calls)
+        self.create_widgets()
+        self.update_task_list()
+        self.root.after_idle(self.on_first_paint)
+        self.load_tasks()
+        # 注释掉窗口大小变化时的字体缩放，保持14号不变
+        # self.root.bind("<Configure>", self.on_window_resize)
+
+    def init_state(self, tasks_file, idle, store=None, tasks=None, tracer=None,
+                   archive_days=ARCHIVE_AFTER_DAYS):
+        """建立与窗口无关的状态：任务集合、存储、后台保存、搜索和撤销
+
+        idle(func) 安排空闲时重绘；store、tasks 默认按 tasks_file 打开、
+        为空集合（任务随后在后台加载）。基准测试不创建窗口，直接调用它。
+        """
+        self.tasks = TaskCollection() if tasks is None else tasks
+        self.tasks_file = tasks_file
         self.base_dir = os.path.abspath(os.path.join(os.getcwd(), ""))
+        self.store = open_task_store(self.tasks_file) if store is None else store
+        # 耗时追踪（未开启时为None），用于在状态栏显示耗时
+        self.tracer = tracer
+        # 版本内容按差量存储，显示时经缓存还原
+        self.history = VersionContentCache(version_reader=getattr(self.store, "read_version", None))
+        # 完成超过 archive_days 天的任务可移入归档；恢复操作写入任务文件后再从归档中移除
+        self.archive = TaskArchive(self.tasks_file)
+        self.archive_days = archive_days
+        self.restoring = {}
+        # 归档后任务文件中删除了大量任务，下次保存后压缩一次
+        self.shrink_pending = False
 
-        self.load_tasks()
+        # 后台保存：回调经队列转交UI线程
+        self.ui_calls = queue.Queue()
+        self.unsaved_ops = 0
+        # 已提交但尚未确认写入的操作（按提交顺序），以及其中因版本冲突被撤下的操作的id()
+        self.unconfirmed = deque()
+        self.withdrawn = set()
+        # 已合并的其他实例修改的次数，与 store.external_reads 相等时才能压缩
+        self.merged_reads = 0
+        self.writer = PersistenceWorker(
+            self.store,
+            on_saved=lambda submitted, written: self.call_in_ui(self.on_tasks_saved, submitted),
+            on_error=lambda error, submitted: self.call_in_ui(self.on_save_error, error, submitted),
+            on_external=lambda external, fresh, rejected: self.call_in_ui(
+                self.merge_external, external, fresh, rejected)
+        )
+        self.folder_pool = ThreadPoolExecutor(max_workers=FOLDER_WORKERS, thread_name_prefix="folders")
+        # 正在填充的版本文件夹（绝对路径） -> 填充任务，下一版本要等它完成再从中复制
+        self.seed_jobs = {}
+        self.diffs = VersionDiffService(self.call_in_ui)
+
+        # 全文搜索索引，和任务数据存在同一目录
+        self.index_file = self.tasks_file + ".index"
+        self.search_index = None
+        self.index_pending = []
+        self.index_dirty = False
+        self.search_query = ""
+        self.search_job = None
 
         self.selected_tasks = set()
         self.current_task_id = None
+        # 已完成的批量操作 (TaskBatch, 涉及任务的修改时间)，最近的在最后，供撤销使用
+        self.undo_stack = deque(maxlen=UNDO_LIMIT)
         self.filter_status = "全部"
+        # 当前排序列（None为按ID顺序）和是否降序
+        self.sort_column = None
+        self.sort_reverse = False
 
-        self.create_widgets()
-        self.update_task_list()
-        # 注释掉窗口大小变化时的字体缩放，保持14号不变
-        # self.root.bind("<Configure>", self.on_window_resize)
+        # 先显示窗口，任务在后台线程中逐批读取，由UI线程分批加入列表
+        self.loading = False
+        self.first_paint_seconds = None
+        # 加载完成后开始监视数据文件，及时显示其他实例或脚本保存的修改
+        self.watcher = None
+        # 修改只标记需要重绘的区域，空闲时统一重绘一次
+        self.refresh = RefreshScheduler(idle)
+        self.register_refresh_regions()
+        # 需要刷新的行（任务ID）；打开的详情窗口 -> 刷新函数
+        self.dirty_rows = set()
+        self.detail_windows = {}
+
+    def register_refresh_regions(self):
+        """重新筛选列表时会刷新行和状态栏，刷新行时会刷新状态栏"""
+        self.refresh.register("list", self.update_task_list, covers=("rows", "status"))
+        self.refresh.register("rows", self.refresh_dirty_rows, covers=("status",))
+        self.refresh.register("status", self.update_status)
+        self.refresh.register("detail", self.refresh_detail_windows)
+
+    def schedule_refresh(self, *regions):
+        """标记需要重绘的区域（list/rows/status/detail），空闲时统一重绘"""
+        self.refresh.mark(*regions)
+
+    def schedule_row_refresh(self, task_ids):
+        """标记需要刷新的行，空闲时一并刷新"""
+        self.dirty_rows.update(task_ids)
+        self.refresh.mark("rows")
 
     def generate_folder_path(self, project, short_desc, ver):
         """生成合法的文件夹路径（基于project和short_desc）"""
-        # 替换非法字符
-        safe_project = re.sub(r'[\\/:*?"<>|]', '_', project.strip())
-        safe_desc = re.sub(r'[\\/:*?"<>|]', '_', short_desc.strip())
-        safe_ver = re.sub(r'[\\/:*?"<>|]', '_', ver.strip())
-
-        # 构建路径：基础目录/项目/简易描述
-        folder_path = os.path.join(self.base_dir, safe_project, safe_desc, safe_ver)
-        return folder_path
-
-    def create_folder_if_not_exists(self, folder_path):
-        """创建文件夹（如果不存在）"""
-        if not os.path.exists(folder_path):
+        return task_folder_path(self.base_dir, project, short_desc, ver)
+
+    def provision_folders(self, folder_paths, open_after=False, on_done=None):
+        """在后台线程池中批量创建文件夹，不阻塞界面
+
+        全部完成后在UI线程中汇报失败的文件夹；open_after为True且开启了
+        自动打开时，打开第一个创建成功的文件夹；on_done(失败列表) 可选。
+        """
+        folder_paths = list(folder_paths)
+        if not folder_paths:
+            return
+        lock = threading.Lock()
+        state = {"remaining": len(folder_paths), "failures": []}
+
+        def finished(future, path):
+            error = future.exception()
+            with lock:
+                if error is not None:
+                    state["failures"].append((path, error))
+                state["remaining"] -= 1
+                last = state["remaining"] == 0
+            if last:
+                self.call_in_ui(self.on_folders_provisioned, folder_paths, state["failures"], open_after, on_done)
+
+        for path in folder_paths:
+            future = self.folder_pool.submit(make_folder, path)
+            future.add_done_callback(lambda f, path=path: finished(f, path))
+
+    def provision_version_folder(self, previous, folder_path, open_after=False):
+        """在后台创建新版本文件夹，并用上一版本文件夹（previous，可为None）中的文件填充
+
+        进度和结果显示在状态栏；完成后open_after为True且开启了自动打开时打开文件夹。
+        上一版本文件夹本身还在填充时（连续保存了几个版本），等它完成后再复制。
+        """
+        source = os.path.join(self.base_dir, previous) if previous else None
+        # 线程池按提交顺序取任务，等待的总是更早提交的任务，不会互相等待
+        pending = self.seed_jobs.get(os.path.abspath(source)) if source else None
+
+        def seed():
+            if pending is not None:
+                # 上一版本填充失败时照常用已有的文件，错误已由它自己汇报
+                concurrent.futures.wait([pending])
+            return seed_version_folder(source, folder_path, progress)
+
+        def progress(done, total):
+            self.call_in_ui(self.folder_state_var.set, f"填充文件夹 {done}/{total}")
+
+        def finished(future):
+            error = future.exception()
+            self.call_in_ui(self.on_version_folder_seeded, folder_path,
+                            None if error is not None else future.result(), error, open_after, future)
+
+        future = self.folder_pool.submit(seed)
+        self.seed_jobs[os.path.abspath(folder_path)] = future
+        future.add_done_callback(finished)
+
+    def on_version_folder_seeded(self, folder_path, counts, error, open_after, future):
+        """版本文件夹填充完成（UI线程中执行）"""
+        key = os.path.abspath(folder_path)
+        if self.seed_jobs.get(key) is future:
+            del self.seed_jobs[key]
+        if error is not None:
+            self.folder_state_var.set("填充文件夹失败")
+            messagebox.showerror("错误", f"创建文件夹失败:\n{folder_path}: {error}")
+            return
+        if counts:
+            self.folder_state_var.set("已填充: " + ", ".join(
+                f"{SEED_METHOD_NAMES[method]} {n}" for method, n in counts.items()))
+        if open_after and self.auto_open_var.get():
+            self.open_task_folder(folder_path)
+
+    def show_folder_usage(self, task):
+        """在后台统计任务各版本文件夹的磁盘占用，完成后显示报告"""
+        history = sorted(task["description_history"], key=lambda v: v["version"])
+        folders = [(v["version"], os.path.join(self.base_dir, v["folder_path"]))
+                   for v in history if v.get("folder_path")]
+        if not folders:
+            messagebox.showinfo("提示", "该任务没有版本文件夹！")
+            return
+
+        def finished(future):
+            error = future.exception()
+            if error is not None:
+                self.call_in_ui(messagebox.showerror, "错误", f"统计占用空间失败：{str(error)}")
+            else:
+                self.call_in_ui(self.show_usage_report, task["short_desc"], future.result())
+
+        self.folder_pool.submit(folder_disk_usage, folders).add_done_callback(finished)
+
+    def show_usage_report(self, title, report):
+        """各版本文件夹占用空间的报告窗口"""
+        usage_win = tk.Toplevel(self.root)
+        usage_win.title(f"占用空间 - {title}")
+        usage_win.geometry("700x400")
+
+        main_frame = ttk.Frame(usage_win, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        columns = ("version", "files", "size", "new")
+        tree = ttk.Treeview(main_frame, columns=columns, show="headings", height=10)
+        for col, text in zip(columns, ("版本", "文件数", "文件大小", "新占用（不含与更早版本共享的部分）")):
+            tree.heading(col, text=text)
+            tree.column(col, width=100 if col != "new" else 300, anchor=tk.CENTER)
+        tree.pack(fill=tk.BOTH, expand=True)
+        for version, files, size, new in report:
+            tree.insert("", tk.END, values=(f"v{version}", files, format_size(size), format_size(new)))
+
+        total_size = sum(row[2] for row in report)
+        total_new = sum(row[3] for row in report)
+        ttk.Label(main_frame, text=f"文件大小合计: {format_size(total_size)}，实际占用: {format_size(total_new)}",
+                  font=self.font).pack(anchor=tk.W, pady=10)
+        ttk.Button(main_frame, text="关闭", command=usage_win.destroy).pack(side=tk.RIGHT)
+
+    def show_statistics(self):
+        """统计窗口：按日期范围汇总各项目的新建、完成、完成周期和修改次数
+
+        数据来自 TaskCollection.time_rollup()，换一个范围只需对各序列切片求和；
+        窗口登记在 detail_windows 中，任务修改后随详情窗口一起原地刷新。
+        """
+        if not self.check_loaded():
+            return
+        stats_win = tk.Toplevel(self.root)
+        stats_win.title("统计")
+        stats_win.geometry("800x620")
+
+        main_frame = ttk.Frame(stats_win, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+
+        range_frame = ttk.Frame(main_frame)
+        range_frame.pack(fill=tk.X, pady=(0, 10))
+        ttk.Label(range_frame, text="范围:", font=self.font).pack(side=tk.LEFT, padx=5)
+        range_var = tk.StringVar(value="最近7天")
+        range_combo = ttk.Combobox(range_frame, textvariable=range_var, values=list(STATS_RANGES),
+                                   state="readonly", width=10, font=self.font)
+        range_combo.pack(side=tk.LEFT, padx=5)
+        first_var, last_var = tk.StringVar(), tk.StringVar()
+        ttk.Label(range_frame, text="从", font=self.font).pack(side=tk.LEFT, padx=(15, 5))
+        ttk.Entry(range_frame, textvariable=first_var, width=12, font=self.font).pack(side=tk.LEFT)
+        ttk.Label(range_frame, text="到", font=self.font).pack(side=tk.LEFT, padx=5)
+        ttk.Entry(range_frame, textvariable=last_var, width=12, font=self.font).pack(side=tk.LEFT)
+
+        summary_var = tk.StringVar()
+        ttk.Label(main_frame, textvariable=summary_var, font=self.font).pack(anchor=tk.W, pady=(0, 10))
+
+        project_frame = ttk.LabelFrame(main_frame, text="各项目", padding="10")
+        project_frame.pack(fill=tk.BOTH, expand=True)
+        columns = ("project", "created", "completed", "lead", "edits")
+        project_tree = ttk.Treeview(project_frame, columns=columns, show="headings", height=10)
+        for col, text in zip(columns, ("项目", "新建", "完成", "平均完成周期（天）", "修改次数")):
+            project_tree.heading(col, text=text)
+            project_tree.column(col, width=200 if col == "project" else 120, anchor=tk.W if col == "project" else tk.CENTER)
+        project_tree.pack(fill=tk.BOTH, expand=True)
+
+        priority_frame = ttk.LabelFrame(main_frame, text="优先级构成", padding="10")
+        priority_frame.pack(fill=tk.X, pady=10)
+        columns = ("priority", "created", "completed", "share")
+        priority_tree = ttk.Treeview(priority_frame, columns=columns, show="headings", height=3)
+        for col, text in zip(columns, ("优先级", "新建", "完成", "占完成的比例")):
+            priority_tree.heading(col, text=text)
+            priority_tree.column(col, width=150, anchor=tk.CENTER)
+        priority_tree.pack(fill=tk.X)
+
+        lead_var = tk.StringVar()
+        ttk.Label(main_frame, textvariable=lead_var, font=self.font).pack(anchor=tk.W)
+        ttk.Label(main_frame, text="完成时间按已完成任务的最后修改时间计算，已归档的任务不计入").pack(anchor=tk.W, pady=5)
+
+        # 当前显示的（汇总对象, 修改计数, 范围），未变化时不重绘
+        shown = {}
+
+        def refresh_stats():
             try:
-                os.makedirs(folder_path, exist_ok=True)
-                return True
-            except Exception as e:
-                messagebox.showerror("错误", f"创建文件夹失败: {str(e)}")
-                return False
-        return True
+                first, last = parse_day(first_var.get()), parse_day(last_var.get())
+            except ValueError:
+                summary_var.set("日期格式应为 YYYY-MM-DD")
+                shown.clear()
+                return
+            rollup = self.tasks.time_rollup()
+            state = (rollup, rollup.changes, first, last)
+            if shown.get("state") == state:
+                return
+            shown["state"] = state
+            totals = rollup.query(first, last)
+
+            projects = {}
+            for (kind, key), n in totals.items():
+                if kind in ("created", "completed", "lead", "edits"):
+                    projects.setdefault(key, dict.fromkeys(("created", "completed", "lead", "edits"), 0))[kind] = n
+            created = sum(row["created"] for row in projects.values())
+            completed = sum(row["completed"] for row in projects.values())
+            lead = sum(row["lead"] for row in projects.values())
+            edits = sum(row["edits"] for row in projects.values())
+            average = f"{lead / completed / 86400:.1f} 天" if completed else "-"
+            summary_var.set(f"新建: {created}, 完成: {completed}, 平均完成周期: {average}, 修改: {edits} 次")
+
+            project_tree.delete(*project_tree.get_children())
+            for project, row in sorted(projects.items(), key=lambda item: (-item[1]["completed"], -item[1]["created"], str(item[0]))):
+                average = f"{row['lead'] / row['completed'] / 86400:.1f}" if row["completed"] else "-"
+                project_tree.insert("", tk.END, values=(project, row["created"], row["completed"], average, row["edits"]))
+
+            priority_tree.delete(*priority_tree.get_children())
+            codes = {key for kind, key in totals if kind in ("created_priority", "completed_priority")}
+            # 按优先级从高到低，无法识别的值排在最后
+            for code in sorted(codes, key=lambda p: (p if p.__class__ is int else len(PRIORITY_LEVELS), str(p))):
+                done = totals.get(("completed_priority", code), 0)
+                share = f"{done * 100 / completed:.0f}%" if completed else "-"
+                priority_tree.insert("", tk.END, values=(unpack_priority(code), totals.get(("created_priority", code), 0), done, share))
+
+            bins = "，".join(f"{label} {totals.get(('lead_bin', i), 0)}" for i, label in enumerate(LEAD_TIME_LABELS))
+            lead_var.set(f"完成周期分布：{bins}")
+
+        def on_range_change(event=None):
+            days = STATS_RANGES[range_var.get()]
+            if days is None:
+                first_var.set("")
+                last_var.set("")
+            else:
+                today = (datetime.now() - EPOCH).days
+                first_var.set(format_day(today - days + 1))
+                last_var.set(format_day(today))
+            refresh_stats()
+
+        range_combo.bind("<<ComboboxSelected>>", on_range_change)
+        ttk.Button(range_frame, text="查询", command=refresh_stats).pack(side=tk.LEFT, padx=10)
+        ttk.Button(main_frame, text="关闭", command=stats_win.destroy).pack(side=tk.RIGHT)
+
+        on_range_change()
+        self.detail_windows[stats_win] = refresh_stats
+
+    def on_folders_provisioned(self, folder_paths, failures, open_after, on_done):
+        """文件夹创建完成（UI线程中执行）"""
+        if failures:
+            detail = "\n".join(f"{path}: {error}" for path, error in failures[:5])
+            more = f"\n……共{len(failures)}个" if len(failures) > 5 else ""
+            messagebox.showerror("错误", f"创建文件夹失败:\n{detail}{more}")
+        if open_after and self.auto_open_var.get():
+            failed = {path for path, _ in failures}
+            ok = [path for path in folder_paths if path not in failed]
+            if ok:
+                self.open_task_folder(ok[0])
+        if on_done is not None:
+            on_done(failures)
 
     def open_task_folder(self, folder):
-        """打开任务对应的文件夹（修复路径拼接问题）"""
-        folder_path = os.path.join(self.base_dir, folder)
-        if not folder_path:
+        """在后台打开任务对应的文件夹（修复路径拼接问题）"""
+        if not folder:
             messagebox.showwarning("提示", "文件夹路径未设置！")
             return
-        if not os.path.exists(folder_path):
-            messagebox.showwarning("提示", "文件夹不存在！")
-            return
+        folder_path = os.path.join(self.base_dir, folder)
 
-        # 根据操作系统调用对应命令
-        system = platform.system()
-        try:
-            if system == "Windows":
-                # Windows：使用 explorer 打开
-                subprocess.Popen(f'explorer "{folder_path}"')
-            elif system == "Darwin":
-                # macOS：使用 open 打开
-                subprocess.Popen(f'open "{folder_path}"')
-            elif system == "Linux":
-                # Linux：使用 xdg-open 打开
-                subprocess.Popen(f'xdg-open "{folder_path}"')
-            else:
-                messagebox.showwarning("提示", "暂不支持该操作系统的文件夹打开操作！")
-        except Exception as e:
-            messagebox.showerror("错误", f"打开文件夹失败：{str(e)}")
+        def launched(future):
+            error = future.exception()
+            if error is not None:
+                self.call_in_ui(messagebox.showerror, "错误", f"打开文件夹失败：{str(error)}")
+
+        self.folder_pool.submit(launch_file_manager, folder_path).add_done_callback(launched)
 
     def create_widgets(self):
         main_frame = ttk.Frame(self.root, padding="10")
@@ -109,7 +4046,7 @@ class TaskManager:
         filter_combo = ttk.Combobox(
             filter_frame, 
             textvariable=self.filter_var,
-            values=["全部", "未完成", "已完成"],
+            values=["全部", "未完成", "已完成", "已归档"],
             state="readonly",
             width=10,
             font=self.font
@@ -117,6 +4054,11 @@ class TaskManager:
         filter_combo.pack(side=tk.LEFT, padx=5)
         filter_combo.bind("<<ComboboxSelected>>", self.on_filter_change)
 
+        ttk.Label(filter_frame, text="搜索:", font=self.font).pack(side=tk.LEFT, padx=(20, 5))
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", self.on_search_change)
+        ttk.Entry(filter_frame, textvariable=self.search_var, width=30, font=self.font).pack(side=tk.LEFT, padx=5)
+
         # 任务列表区域
         list_frame = ttk.LabelFrame(main_frame, text="任务列表", padding="14")
         list_frame.grid(row=1, column=0, sticky="nsew", pady=(0, 14))
@@ -133,6 +4075,10 @@ class TaskManager:
         self.task_tree.heading("create_time", text="创建时间")
         self.task_tree.heading("modified_time", text="修改时间")
         self.task_tree.heading("completed", text="状态")
+        # 点击列标题排序，点击ID列恢复按ID顺序
+        self.sort_titles = {col: self.task_tree.heading(col, "text") for col in SORT_COLUMNS}
+        for col in ("id",) + tuple(SORT_COLUMNS):
+            self.task_tree.heading(col, command=lambda c=col: self.on_sort_column(c))
 
         self.task_tree.column("select", width=30, anchor=tk.CENTER)
         self.task_tree.column("id", width=50, anchor=tk.CENTER)
@@ -143,13 +4089,32 @@ class TaskManager:
         self.task_tree.column("modified_time", width=150, anchor=tk.CENTER)
         self.task_tree.column("completed", width=80, anchor=tk.CENTER)
 
+        # 行标签样式只需配置一次（确保字体为14号）
+        self.task_tree.tag_configure("completed", foreground="gray", font=("SimHei", 14, "italic"))
+        self.task_tree.tag_configure("high_priority", foreground="red", font=("SimHei", 14))
+        self.task_tree.tag_configure("medium_priority", foreground="orange", font=("SimHei", 14))
+        self.task_tree.tag_configure("low_priority", foreground="green", font=("SimHei", 14))
+        # 已渲染行缓存：iid(任务ID) -> (values, tags)
+        self.rendered_rows = {}
+        self.rendered_order = []
+        # 虚拟列表状态：当前筛选结果、窗口起始行、可见行数
+        self.view_tasks = []
+        self.view_offset = 0
+        self.visible_rows = 20
+        self.virtual_mode = False
+
         self.task_tree.grid(row=0, column=0, sticky="nsew")
         self.task_tree.bind("<Button-1>", self.on_tree_click)
         self.task_tree.bind("<Double-1>", self.on_tree_double_click)
+        self.task_tree.bind("<Configure>", self.on_tree_resize)
+        self.task_tree.bind("<MouseWheel>", self.on_tree_wheel)
+        self.task_tree.bind("<Button-4>", self.on_tree_wheel)
+        self.task_tree.bind("<Button-5>", self.on_tree_wheel)
 
-        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.task_tree.yview)
-        self.task_tree.configure(yscroll=scrollbar.set)
-        scrollbar.grid(row=0, column=1, sticky="ns")
+        # 滚动条由逻辑行数驱动：虚拟模式下不直接绑定Treeview
+        self.list_scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=self.on_list_scroll)
+        self.task_tree.configure(yscroll=self.on_tree_yscroll)
+        self.list_scrollbar.grid(row=0, column=1, sticky="ns")
 
         # 操作按钮区域
         button_frame = ttk.Frame(main_frame)
@@ -161,13 +4126,33 @@ class TaskManager:
         ttk.Button(button_frame, text="标记为完成", command=self.mark_tasks_completed).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="删除选中", command=self.delete_tasks).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="清空已完成", command=self.clear_completed_tasks).pack(side=tk.LEFT, padx=5)
-        ttk.Button(button_frame, text="刷新列表", command=self.update_task_list).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="归档", command=self.archive_completed_tasks).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="恢复归档", command=self.restore_archived_tasks).pack(side=tk.LEFT, padx=5)
+        ttk.Button(button_frame, text="撤销", command=self.undo_last_batch).pack(side=tk.LEFT, padx=5)
+        self.root.bind("<Control-z>", lambda event: self.undo_last_batch())
+        ttk.Button(button_frame, text="刷新列表", command=self.refresh_tasks).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="统计", command=self.show_statistics).pack(side=tk.RIGHT, padx=5)
+        ttk.Checkbutton(button_frame, text="自动打开文件夹", variable=self.auto_open_var).pack(side=tk.RIGHT, padx=5)
         ttk.Button(button_frame, text="添加任务", command=self.open_add_task_window).pack(side=tk.RIGHT, padx=5)
 
         # 状态栏
+        status_frame = ttk.Frame(main_frame)
+        status_frame.grid(row=3, column=0, sticky="ew", pady=(5, 0))
         self.status_var = tk.StringVar(value="任务总数: 0, 已完成: 0, 选中: 0")
-        status_bar = ttk.Label(main_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
-        status_bar.grid(row=3, column=0, sticky="ew", pady=(5, 0))
+        status_bar = ttk.Label(status_frame, textvariable=self.status_var, relief=tk.SUNKEN, anchor=tk.W)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        # 保存状态指示：保存中…/已保存/保存失败
+        self.save_state_var = tk.StringVar(value="已保存")
+        ttk.Label(status_frame, textvariable=self.save_state_var, relief=tk.SUNKEN, width=10, anchor=tk.CENTER).pack(side=tk.RIGHT)
+        # 新版本文件夹的填充进度
+        self.folder_state_var = tk.StringVar()
+        ttk.Label(status_frame, textvariable=self.folder_state_var, anchor=tk.E).pack(side=tk.RIGHT, padx=5)
+        if self.tracer is not None:
+            # 追踪开启时显示最近一次操作的耗时，并可随时导出追踪文件
+            ttk.Button(status_frame, text="导出追踪", command=self.dump_trace).pack(side=tk.RIGHT, padx=5)
+            self.trace_var = tk.StringVar()
+            ttk.Label(status_frame, textvariable=self.trace_var, relief=tk.SUNKEN, anchor=tk.W).pack(side=tk.RIGHT)
+            self.root.after(TRACE_STATUS_INTERVAL_MS, self.update_trace_status)
 
     # 移除窗口缩放时的字体调整逻辑，保持14号字体不变
     # def on_window_resize(self, event):
@@ -180,80 +4165,581 @@ class TaskManager:
     def on_filter_change(self, event=None):
         """筛选状态变更时更新任务列表"""
         self.filter_status = self.filter_var.get()
-        self.update_task_list()
+        self.view_offset = 0
+        self.schedule_refresh("list")
+
+    def on_sort_column(self, column):
+        """点击列标题：按该列排序，再次点击切换升序/降序"""
+        if column not in SORT_COLUMNS:
+            self.sort_column, self.sort_reverse = None, False
+        elif column == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column, self.sort_reverse = column, False
+        for col, title in self.sort_titles.items():
+            if col == self.sort_column:
+                title += " ▼" if self.sort_reverse else " ▲"
+            self.task_tree.heading(col, text=title)
+        self.view_offset = 0
+        self.schedule_refresh("list")
+
+    def on_search_change(self, *args):
+        """搜索框内容变化：停顿 SEARCH_DEBOUNCE_MS 后再搜索，连续输入只搜索一次"""
+        if self.search_job is not None:
+            self.root.after_cancel(self.search_job)
+        self.search_job = self.root.after(SEARCH_DEBOUNCE_MS, self.apply_search)
+
+    def apply_search(self):
+        self.search_job = None
+        self.search_query = self.search_var.get().strip()
+        self.view_offset = 0
+        self.schedule_refresh("list")
+
+    def load_search_index(self):
+        """在后台读取保存的搜索索引，不存在或已过期时重建"""
+        # 在UI线程取任务列表的快照，加载过程中的修改先记下，加载完再补上
+        tasks = list(self.tasks)
+        threading.Thread(target=self.build_search_index, args=(tasks, self.store.seq), daemon=True).start()
+
+    def build_search_index(self, tasks, seq):
+        """后台线程：读取索引文件，或为全部任务及历史版本重建索引"""
+        index = SearchIndex.load(self.index_file, seq)
+        if index is not None:
+            self.call_in_ui(self.on_search_index_built, index, False)
+            return
+        index = SearchIndex()
+        # 单独的缓存，避免和UI线程共用；版本内容经 read_version 读取，与压缩后换成引用互斥
+        history = VersionContentCache(version_reader=getattr(self.store, "read_version", None))
+        for t in tasks:
+            copy = dict(t, description_history=list(t["description_history"]))
+            index.add_task(copy, history.content)
+        self.call_in_ui(self.on_search_index_built, index, True)
+
+    def on_search_index_built(self, index, rebuilt):
+        """索引就绪（UI线程中执行）：补上加载期间的修改"""
+        for op in self.index_pending:
+            index.apply(op, self.tasks, self.version_content)
+        self.search_index = index
+        self.index_dirty = rebuilt or bool(self.index_pending)
+        self.index_pending = []
+        if self.search_query:
+            self.schedule_refresh("list")
+
+    def index_ops(self, ops):
+        """按修改操作增量更新搜索索引"""
+        if self.search_index is None:
+            self.index_pending.extend(ops)
+            return
+        for op in ops:
+            self.search_index.apply(op, self.tasks, self.version_content)
+        self.index_dirty = True
+
+    def update_trace_status(self):
+        """在状态栏显示最近一次被追踪操作的耗时"""
+        if self.tracer.last is not None:
+            name, duration = self.tracer.last
+            self.trace_var.set(f"{name.split('.')[-1]}: {duration * 1000:.1f}ms, 省去重绘: {self.refresh.saved()}")
+        self.root.after(TRACE_STATUS_INTERVAL_MS, self.update_trace_status)
+
+    def dump_trace(self):
+        try:
+            self.tracer.other["refresh"] = self.refresh.counts()
+            path = self.tracer.dump()
+        except OSError as e:
+            messagebox.showerror("错误", f"导出追踪失败: {str(e)}")
+            return
+        messagebox.showinfo("提示", f"追踪已导出到 {os.path.abspath(path)}")
 
     def load_tasks(self):
-        if os.path.exists(self.tasks_file):
-            try:
-                with open(self.tasks_file, "r", encoding="utf-8") as f:
-                    loaded = json.load(f)
-                    for t in loaded:
-                        if "description_history" not in t:
-                            t["description_history"] = [{"version": 1, "timestamp": t["create_time"], "action": "创建"}]
-                        if "modified_time" not in t:
-                            t["modified_time"] = t["create_time"]
-                    self.tasks = loaded
-            except Exception as e:
-                messagebox.showerror("错误", f"加载失败: {str(e)}")
-                self.tasks = []
+        """在后台线程中解析任务文件，解析结果经有界队列逐批交给UI线程"""
+        self.loading = True
+        self.loaded_count = 0
+        self.load_started = time.perf_counter()
+        self.last_load_refresh = self.load_started
+        # 队列有界：界面来不及处理时后台线程等待，内存中最多积压几批
+        self.load_queue = queue.Queue(maxsize=4)
+        threading.Thread(target=self.read_task_chunks, name="loader", daemon=True).start()
+        self.root.after(UI_POLL_INTERVAL_MS, self.feed_loaded_tasks)
+        self.update_status()
 
-    def save_tasks(self):
+    def read_task_chunks(self):
+        """后台线程：按批读取任务和日志操作"""
         try:
-            with open(self.tasks_file, "w", encoding="utf-8") as f:
-                json.dump(self.tasks, f, ensure_ascii=False, indent=2)
-            self.update_status()
+            for ops in self.store.iter_load():
+                self.load_queue.put(("ops", ops))
         except Exception as e:
-            messagebox.showerror("错误", f"保存失败: {str(e)}")
+            self.load_queue.put(("error", e))
+        else:
+            self.load_queue.put(("done", None))
 
-    def update_task_list(self):
-        for item in self.task_tree.get_children():
-            self.task_tree.delete(item)
+    def feed_loaded_tasks(self):
+        """UI线程：每次只应用一批，保证加载期间界面仍能响应"""
+        try:
+            kind, payload = self.load_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(UI_POLL_INTERVAL_MS, self.feed_loaded_tasks)
+            return
+        if kind == "ops":
+            for op in payload:
+                apply_task_op(self.tasks, op)
+            self.loaded_count += len(payload)
+            now = time.perf_counter()
+            # 列表刷新有间隔限制，避免每批都重新筛选整个列表
+            if (now - self.last_load_refresh) * 1000 >= LOAD_REFRESH_MS:
+                self.last_load_refresh = now
+                self.schedule_refresh("list")
+            else:
+                self.schedule_refresh("status")
+            self.root.after(1, self.feed_loaded_tasks)
+            return
+        if kind == "error":
+            messagebox.showerror("错误", f"加载失败: {str(payload)}")
+            self.tasks = TaskCollection()
+        self.tasks.next_id = max(self.tasks.next_id, getattr(self.store, "next_id", 1))
+        self.loading = False
+        if self.tracer is not None:
+            self.tracer.record("startup.load", self.load_started, time.perf_counter() - self.load_started)
+        self.load_search_index()
+        self.schedule_refresh("list", "detail")
+        self.watcher = FileWatcher(self.store.watched_paths(), self.read_external_changes)
+
+    def read_external_changes(self):
+        """后台线程：读取其他实例或脚本保存的修改，交给UI线程合并进列表"""
+        try:
+            external, fresh = self.store.read_changes()
+        except Exception:
+            # 文件正被替换等情况，下次变化（或刷新列表）时再读
+            return
+        if external or fresh is not None:
+            self.call_in_ui(self.merge_external, external, fresh, [])
+
+    def refresh_tasks(self):
+        """刷新列表：先在后台读取数据文件中的新修改，合并后会再次刷新"""
+        if not self.loading:
+            threading.Thread(target=self.read_external_changes, daemon=True).start()
+        self.schedule_refresh("list")
+
+    def on_first_paint(self):
+        """窗口第一次绘制完成：记录启动耗时（与任务文件大小无关）"""
+        self.root.update_idletasks()
+        self.first_paint_seconds = time.perf_counter() - STARTUP_TIME
+        if self.tracer is not None:
+            self.tracer.record("startup.first_paint", STARTUP_TIME, self.first_paint_seconds)
+
+    def check_loaded(self):
+        """任务尚未加载完时提示用户稍候，返回是否可以继续操作"""
+        if self.loading:
+            messagebox.showinfo("提示", "任务正在加载，请稍候…")
+            return False
+        return True
+
+    def get_task(self, task_id):
+        """按ID取任务（O(1)），不存在时返回None"""
+        return self.tasks.get(task_id)
+
+    def version_content(self, task, ver):
+        """取版本的完整内容（差量版本会自动还原）"""
+        return self.history.content(task, ver)
+
+    def allocate_task_id(self):
+        """为新任务分配ID（经存储预留，与同时打开同一文件的其他实例不会重复）"""
+        self.tasks.next_id = self.store.reserve_ids(1, self.tasks.next_id)
+        return self.tasks.allocate_id()
+
+    def save_tasks(self, ops):
+        """把本次修改对应的操作交给后台保存线程，立即返回"""
+        self.unsaved_ops += len(ops)
+        self.unconfirmed.extend(ops)
+        self.save_state_var.set("保存中…")
+        self.writer.submit(ops)
+        self.index_ops(ops)
+        self.schedule_refresh("status")
+
+    def call_in_ui(self, func, *args):
+        """从后台线程把回调转交给UI线程执行（线程安全）"""
+        self.ui_calls.put((func, args))
+
+    def poll_ui_calls(self):
+        """在UI线程中执行后台线程转交的回调"""
+        while True:
+            try:
+                func, args = self.ui_calls.get_nowait()
+            except queue.Empty:
+                break
+            func(*args)
+        self.root.after(UI_POLL_INTERVAL_MS, self.poll_ui_calls)
+
+    def confirm_ops(self, submitted):
+        """最早提交的submitted条操作已有结果（写入或失败），不再需要重新应用；返回这些操作"""
+        confirmed = [self.unconfirmed.popleft() for _ in range(submitted)]
+        for op in confirmed:
+            self.withdrawn.discard(id(op))
+        return confirmed
+
+    def on_tasks_saved(self, submitted):
+        """后台写入完成（UI线程中执行）"""
+        self.unsaved_ops -= submitted
+        for op in self.confirm_ops(submitted):
+            restored = self.restoring.pop(id(op), None)
+            if restored:
+                # 恢复的任务已写入任务文件，从归档中移除
+                self.archive.remove(restored)
+        if not self.unsaved_ops:
+            self.save_state_var.set("已保存")
+        if self.store.compact_error is not None:
+            error, self.store.compact_error = self.store.compact_error, None
+            messagebox.showwarning("提示", f"后台压缩任务文件失败（数据未丢失）: {str(error)}")
+        if self.tasks.frozen is None and (self.store.needs_compaction() or self.shrink_pending):
+            self.start_compaction()
+
+    def start_compaction(self):
+        """在后台压缩任务文件，UI线程只建立写时复制的快照
+
+        压缩请求排在保存队列中已提交的操作之后，这些操作写完时日志的
+        序号正好覆盖快照中的全部修改；写入时读到的其他实例的修改还在
+        UI队列中未合并时，store会跳过这次压缩。
+        """
+        snapshot = self.tasks.freeze()
+        merged_reads = self.merged_reads
+        # 归档移走任务后改写旁路文件，释放归档任务的版本内容占用的空间
+        fresh_bodies = self.shrink_pending
+        # 撤销栈中被删除的任务撤销时会加回，改写旁路文件时保留它们的内容
+        retained = [task.copy() for batch, _ in self.undo_stack for op in batch.inverse
+                    if op["op"] == "restore" for task in op["tasks"]]
+
+        def compact():
+            # 写入旁路文件的版本在UI线程中换成引用，与界面读取内容不会交错
+            started = self.store.compact(snapshot, merged_reads,
+                                         on_bodies=lambda moved: self.call_in_ui(self.store.publish_bodies, moved),
+                                         fresh_bodies=fresh_bodies, retained=retained)
+            self.call_in_ui(self.on_compaction_started, started)
 
+        self.writer.run_after_written(compact)
+
+    def on_compaction_started(self, started):
+        """压缩请求已处理（UI线程中执行）"""
+        if started:
+            self.shrink_pending = False
+
+    def on_save_error(self, error, submitted):
+        """后台写入失败（UI线程中执行）"""
+        self.unsaved_ops -= submitted
+        for op in self.confirm_ops(submitted):
+            # 恢复没有写入任务文件，任务仍留在归档中
+            self.restoring.pop(id(op), None)
+        self.save_state_var.set("保存失败")
+        messagebox.showerror("错误", f"保存失败: {str(error)}")
+
+    def merge_external(self, external, fresh, rejected):
+        """合并同时打开同一文件的其他实例写入的修改（UI线程中执行）
+
+        字段修改以本实例尚未写入的为准（它们随后写入，在文件中排在
+        后面）。同一任务上双方都生成了新版本时，撤下本实例未写入的
+        版本，把内容接在对方的版本之后重新生成（版本号顺延，文件夹
+        不变）。fresh 不为None时（其他实例压缩或批量导入后，缺少中间
+        的操作）以它为准，再重新应用本实例未写入的修改。
+        """
+        if external or fresh is not None:
+            self.merged_reads += 1
+        pending = [op for op in self.unconfirmed if id(op) not in self.withdrawn]
+        # 文件中各任务的最新版本号；本实例未写入的版本号不大于它时冲突
+        if fresh is None:
+            heads = {}
+            for op in external:
+                if op["op"] == "version":
+                    heads[op["id"]] = max(heads.get(op["id"], 0), op["version"]["version"])
+        else:
+            heads = {t["id"]: t["description_history"][-1]["version"] for t in fresh if t["description_history"]}
+        conflicts = {op["id"] for op in pending
+                     if op["op"] == "version" and heads.get(op["id"], 0) >= op["version"]["version"]}
+        conflicts.update(op["id"] for op in rejected if id(op) not in self.withdrawn)
+
+        # 先记下要撤下的版本的内容，再从历史中移除
+        detached = {}
+        for op in pending:
+            if op["op"] == "version" and op["id"] in conflicts:
+                self.withdrawn.add(id(op))
+                task = self.tasks.get(op["id"])
+                if task is not None:
+                    detached.setdefault(op["id"], []).append((op["version"], self.version_content(task, op["version"])))
+        for tid, items in detached.items():
+            self.tasks.remove_versions(tid, [ver for ver, _ in items])
+            self.history.invalidate(tid)
+            self.diffs.invalidate(tid)
+        pending = [op for op in pending if id(op) not in self.withdrawn]
+
+        if fresh is None:
+            overridden = {}
+            for op in pending:
+                if op["op"] == "update":
+                    overridden.setdefault(op["id"], set()).update(op["fields"])
+                elif op["op"] == "version":
+                    overridden.setdefault(op["id"], set()).add("modified_time")
+            applied = []
+            for op in external:
+                if op["op"] == "update" and op["id"] in overridden:
+                    op = dict(op, fields={k: v for k, v in op["fields"].items() if k not in overridden[op["id"]]})
+                apply_task_op(self.tasks, op)
+                if op["op"] == "version" and op["id"] in self.tasks:
+                    # 索引按历史中的版本记录取内容
+                    op = dict(op, version=self.tasks.get(op["id"])["description_history"][-1])
+                applied.append(op)
+            self.index_ops(applied)
+        else:
+            self.tasks = fresh
+            for op in pending:
+                apply_task_op(self.tasks, op)
+            # 撤销栈中的逆操作引用的是旧集合中的任务，重新加载后不再可靠
+            self.undo_stack.clear()
+            self.history.invalidate()
+            self.diffs.invalidate()
+            if self.search_index is not None:
+                self.search_index = None
+                self.load_search_index()
+
+        ops = []
+        for tid, items in detached.items():
+            task = self.tasks.get(tid)
+            if task is None:
+                # 任务已被其他实例删除
+                continue
+            for ver, content in items:
+                history = task["description_history"]
+                fields = {k: v for k, v in ver.items() if k not in ("version", "content", "delta", "body")}
+                new_version = self.history.make_version(
+                    task, history[-1]["version"] + 1 if history else 1, content, **fields)
+                self.tasks.add_version(tid, new_version)
+                ops.append({"op": "version", "id": tid, "version": new_version})
+            # 存储据此解除该任务的冲突状态
+            ops[-len(items)]["rebase"] = True
+        if ops:
+            self.save_tasks(ops)
+
+        self.selected_tasks.intersection_update(self.tasks.ids())
+        self.schedule_refresh("list", "detail")
+
+    def on_close(self):
+        """关闭窗口前把未写入的修改全部落盘"""
+        self.save_state_var.set("保存中…")
+        if self.tracer is not None:
+            # 退出时导出的追踪中包含本次运行的重绘统计
+            self.tracer.other["refresh"] = self.refresh.counts()
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.writer.close()
+        if self.search_index is not None and self.index_dirty:
+            try:
+                self.search_index.save(self.index_file, self.store.seq, self.tasks.ids())
+            except OSError:
+                # 索引只是缓存，保存失败下次启动时重建
+                pass
+        self.store.close()
+        self.archive.close()
+        self.diffs.close()
+        # 等待已提交的文件夹创建完成
+        self.folder_pool.shutdown(wait=True)
+        self.root.destroy()
+
+    def task_row(self, t):
+        """生成任务在列表中的显示值和标签"""
+        status = "已完成" if t["completed"] else "未完成"
+        values = (
+            "√" if t["id"] in self.selected_tasks else "",
+            t["id"], t["project"], t["short_desc"], t["priority"],
+            t["create_time"], t["modified_time"], status
+        )
+        tags = ("completed" if t["completed"] else ("high_priority" if t["priority"]=="高" else ("medium_priority" if t["priority"]=="中" else "low_priority")),)
+        return values, tags
+
+    def update_task_list(self):
         # 根据筛选条件过滤任务
-        filtered_tasks = self.tasks
-        if self.filter_status == "未完成":
-            filtered_tasks = [t for t in self.tasks if not t["completed"]]
-        elif self.filter_status == "已完成":
-            filtered_tasks = [t for t in self.tasks if t["completed"]]
+        # 状态筛选直接取集合维护的分区，耗时只与结果数量相关
+        completed = None if self.filter_status not in ("未完成", "已完成") else self.filter_status == "已完成"
+        # 搜索结果与状态筛选取交集；索引未建好时先显示空列表
+        ids = None
+        if self.search_query:
+            ids = self.search_index.search(self.search_query) if self.search_index is not None else set()
+        if self.filter_status == "已归档":
+            # 归档的任务按完成时间从新到旧，翻页时才解压；不参与搜索和排序
+            self.archive.refresh()
+            filtered_tasks = ArchivedView(self.archive, exclude=self.tasks)
+        elif self.sort_column is not None:
+            # 排序序列已缓存并增量维护，这里只按筛选条件取出
+            filtered_tasks = self.tasks.sort_order(self.sort_column).tasks_in_order(completed, ids)
+            if self.sort_reverse:
+                filtered_tasks = filtered_tasks[::-1]
+        elif ids is not None:
+            filtered_tasks = [t for t in map(self.tasks.get, sorted(ids))
+                              if t is not None and (completed is None or t["completed"] == completed)]
+        elif completed is not None:
+            filtered_tasks = self.tasks.with_status(completed)
+        else:
+            filtered_tasks = list(self.tasks)
 
-        for t in filtered_tasks:
-            status = "已完成" if t["completed"] else "未完成"
-            self.task_tree.insert("", tk.END, values=(
-                "√" if t["id"] in self.selected_tasks else "",
-                t["id"], t["project"], t["short_desc"], t["priority"],
-                t["create_time"], t["modified_time"], status
-            ), tags=("completed" if t["completed"] else ("high_priority" if t["priority"]=="高" else ("medium_priority" if t["priority"]=="中" else "low_priority"))))
-        # 确保字体为14号
-        self.task_tree.tag_configure("completed", foreground="gray", font=("SimHei", 14, "italic"))
-        self.task_tree.tag_configure("high_priority", foreground="red", font=("SimHei", 14))
-        self.task_tree.tag_configure("medium_priority", foreground="orange", font=("SimHei", 14))
-        self.task_tree.tag_configure("low_priority", foreground="green", font=("SimHei", 14))
+        self.view_tasks = filtered_tasks
+        self.virtual_mode = len(filtered_tasks) > VIRTUAL_LIST_THRESHOLD
+        # 整个列表重新渲染，标记过的行不必再单独刷新
+        self.dirty_rows.clear()
+        self.render_view()
+        self.update_status()
+
+    def render_view(self):
+        """渲染当前筛选结果；虚拟模式下只渲染窗口内的行"""
+        if self.virtual_mode:
+            max_offset = max(0, len(self.view_tasks) - self.visible_rows)
+            self.view_offset = min(max(self.view_offset, 0), max_offset)
+            end = self.view_offset + self.visible_rows + VIRTUAL_LIST_OVERSCAN
+            self.render_rows(self.view_tasks[self.view_offset:end])
+            self.task_tree.yview_moveto(0)
+            self.update_scrollbar()
+        else:
+            self.view_offset = 0
+            self.render_rows(self.view_tasks)
+
+    def render_rows(self, tasks):
+        """增量对比：行ID即任务ID，只改动值、标签或所在位置有变化的行"""
+        wanted = [str(t["id"]) for t in tasks]
+        wanted_set = set(wanted)
+        stale = [iid for iid in self.rendered_rows if iid not in wanted_set]
+        if stale:
+            self.task_tree.delete(*stale)
+            for iid in stale:
+                del self.rendered_rows[iid]
+        # 保留下来的旧行相对顺序不变时，新行直接插入到目标位置，无需整体移动
+        kept = [iid for iid in self.rendered_order if iid in wanted_set] if stale else self.rendered_order
+        in_order = kept == [iid for iid in wanted if iid in self.rendered_rows]
+
+        for index, (t, iid) in enumerate(zip(tasks, wanted)):
+            row = self.task_row(t)
+            old = self.rendered_rows.get(iid)
+            if old is None:
+                self.task_tree.insert("", index if in_order else tk.END, iid=iid, values=row[0], tags=row[1])
+            elif old != row:
+                self.task_tree.item(iid, values=row[0], tags=row[1])
+            self.rendered_rows[iid] = row
+
+        if not in_order:
+            for index, iid in enumerate(wanted):
+                self.task_tree.move(iid, "", index)
+        self.rendered_order = wanted
+
+    def update_scrollbar(self):
+        """按逻辑行数设置虚拟模式下的滚动条位置"""
+        total = len(self.view_tasks)
+        if not total:
+            self.list_scrollbar.set(0.0, 1.0)
+            return
+        first = self.view_offset / total
+        last = min(1.0, (self.view_offset + self.visible_rows) / total)
+        self.list_scrollbar.set(first, last)
+
+    def scroll_view_to(self, offset):
+        """把虚拟列表窗口移动到指定的起始行"""
+        max_offset = max(0, len(self.view_tasks) - self.visible_rows)
+        offset = min(max(int(offset), 0), max_offset)
+        if offset != self.view_offset:
+            self.view_offset = offset
+            self.render_view()
+
+    def on_list_scroll(self, *args):
+        """滚动条回调：非虚拟模式交给Treeview，虚拟模式按逻辑行移动窗口"""
+        if not self.virtual_mode:
+            self.task_tree.yview(*args)
+            return
+        if args[0] == "moveto":
+            self.scroll_view_to(float(args[1]) * len(self.view_tasks))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= self.visible_rows
+            self.scroll_view_to(self.view_offset + step)
+
+    def on_tree_yscroll(self, first, last):
+        """Treeview自身的滚动位置只在非虚拟模式下同步到滚动条"""
+        if not self.virtual_mode:
+            self.list_scrollbar.set(first, last)
+
+    def on_tree_wheel(self, event):
+        if not self.virtual_mode:
+            return
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            step = -3
+        else:
+            step = 3
+        self.scroll_view_to(self.view_offset + step)
+        return "break"
+
+    def on_tree_resize(self, event):
+        """窗口大小变化时重新计算可见行数"""
+        children = self.task_tree.get_children()
+        bbox = self.task_tree.bbox(children[0]) if children else None
+        row_height = bbox[3] if bbox else 20
+        # 表头约占一行
+        visible = max(1, event.height // row_height - 1)
+        if visible != self.visible_rows:
+            self.visible_rows = visible
+            if self.virtual_mode:
+                self.render_view()
+
+    def refresh_task_rows(self, task_ids):
+        """只刷新指定任务对应的行（不在当前列表中的跳过）"""
+        for tid in task_ids:
+            iid = str(tid)
+            old = self.rendered_rows.get(iid)
+            if old is None:
+                continue
+            t = self.get_task(tid)
+            if t is None and self.filter_status == "已归档":
+                t = self.archive.get(tid)
+            if t is None:
+                continue
+            row = self.task_row(t)
+            if row != old:
+                self.task_tree.item(iid, values=row[0], tags=row[1])
+                self.rendered_rows[iid] = row
         self.update_status()
 
+    def refresh_dirty_rows(self):
+        task_ids, self.dirty_rows = self.dirty_rows, set()
+        self.refresh_task_rows(task_ids)
+
     def update_status(self):
-        total = len(self.tasks)
-        completed = sum(1 for t in self.tasks if t["completed"])
+        stats = self.tasks.stats()
         selected = len(self.selected_tasks)
-        self.status_var.set(f"任务总数: {total}, 已完成: {completed}, 选中: {selected}")
+        status = f"任务总数: {stats['total']}, 已完成: {stats['completed']}, 选中: {selected}"
+        if self.loading:
+            status += f", 正在加载… 已读取 {self.loaded_count}"
+        if len(self.archive):
+            status += f", 已归档: {len(self.archive)}"
+        if self.search_query and self.filter_status != "已归档":
+            found = len(self.view_tasks) if self.search_index is not None else "索引建立中…"
+            status += f", 搜索结果: {found}"
+        self.status_var.set(status)
 
     def on_tree_click(self, event):
         if self.task_tree.identify_region(event.x, event.y) == "cell":
             item = self.task_tree.identify_row(event.y)
             col = self.task_tree.identify_column(event.x)
             if col == "#1":
-                task_id = int(self.task_tree.item(item, "values")[1])
+                if not item:
+                    return
+                task_id = int(item)
                 if task_id in self.selected_tasks:
                     self.selected_tasks.remove(task_id)
                 else:
                     self.selected_tasks.add(task_id)
-                self.update_task_list()
+                self.schedule_row_refresh([task_id])
                 return "break"
 
     def on_tree_double_click(self, event):
         if self.task_tree.identify_region(event.x, event.y) == "cell":
             item = self.task_tree.identify_row(event.y)
-            task_id = int(self.task_tree.item(item, "values")[1])
-            self.show_task_detail(task_id)
+            if not item:
+                return
+            if int(item) not in self.tasks and int(item) in self.archive:
+                messagebox.showinfo("提示", "已归档的任务需要先恢复（选中后点击\"恢复归档\"）才能查看和修改！")
+                return
+            self.show_task_detail(int(item))
 
     def on_history_double_click(self, event, task):
         """双击版本历史行，打印版本信息并打开文件夹"""
@@ -277,14 +4763,15 @@ class TaskManager:
         self.open_task_folder(target_ver["folder_path"])
 
     def show_task_detail(self, task_id):
+        if not self.check_loaded():
+            return
         self.current_task_id = task_id
-        task = next((t for t in self.tasks if t["id"] == task_id), None)
+        task = self.get_task(task_id)
         if not task:
             messagebox.showwarning("警告", "任务不存在！")
             return
 
         detail_win = tk.Toplevel(self.root)
-        detail_win.title(task["short_desc"])
         detail_win.geometry("900x700")
         detail_win.update_idletasks()
         x = (detail_win.winfo_screenwidth() - detail_win.winfo_width()) // 2
@@ -294,18 +4781,20 @@ class TaskManager:
         main_frame = ttk.Frame(detail_win, padding="10")
         main_frame.pack(fill=tk.BOTH, expand=True)
 
-        # 状态信息        
+        # 状态信息（内容由 refresh_detail 填写，任务修改后原地刷新）
         status_info = ttk.Frame(main_frame)
         status_info.pack(fill=tk.X, pady=5)
-        status = "已完成" if task["completed"] else "未完成"
-        status_color = "gray" if task["completed"] else "black"
-        ttk.Label(status_info, text=f"状态: {status}", foreground=status_color, font=self.font).pack(side=tk.LEFT, padx=20)
-        ttk.Label(status_info, text=f"项目: {task['project']}", font=self.font).pack(side=tk.LEFT, padx=20)
+        status_label = ttk.Label(status_info, font=self.font)
+        status_label.pack(side=tk.LEFT, padx=20)
+        project_label = ttk.Label(status_info, font=self.font)
+        project_label.pack(side=tk.LEFT, padx=20)
         priority_color = {"高":"red", "中":"orange", "低":"green"}
-        ttk.Label(status_info, text=f"优先级: {task['priority']}", foreground=priority_color[task['priority']], font=self.font).pack(side=tk.LEFT)
+        priority_label = ttk.Label(status_info, font=self.font)
+        priority_label.pack(side=tk.LEFT)
 
         ttk.Label(main_frame, text=f"创建时间: {task['create_time']}", font=self.font).pack(anchor=tk.W, pady=5)
-        ttk.Label(main_frame, text=f"最近修改: {task['modified_time']}", font=self.font).pack(anchor=tk.W, pady=10)
+        modified_label = ttk.Label(main_frame, font=self.font)
+        modified_label.pack(anchor=tk.W, pady=10)
 
         ttk.Separator(main_frame).pack(fill=tk.X, pady=10)
 
@@ -319,33 +4808,25 @@ class TaskManager:
 
         # 历史版本Treeview
         history_columns = ("timestamp", "content")
-        self.history_tree = ttk.Treeview(history_frame, columns=history_columns, show="headings", height=5, style="History.Treeview")
-        self.history_tree.heading("timestamp", text="时间")
-        self.history_tree.heading("content", text="详细描述")
-        self.history_tree.column("timestamp", width=180, anchor=tk.CENTER, stretch=False)
-        self.history_tree.column("content", width=400, stretch=True)
+        history_tree = self.history_tree = ttk.Treeview(history_frame, columns=history_columns, show="headings", height=5, style="History.Treeview")
+        history_tree.heading("timestamp", text="时间")
+        history_tree.heading("content", text="详细描述")
+        history_tree.column("timestamp", width=180, anchor=tk.CENTER, stretch=False)
+        history_tree.column("content", width=400, stretch=True)
 
         # 使用 pack 布局 Treeview
-        self.history_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
+        history_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=5)
 
         # 滚动条
-        history_scrollbar = ttk.Scrollbar(history_frame, orient=tk.VERTICAL, command=self.history_tree.yview)
-        self.history_tree.configure(yscroll=history_scrollbar.set)
+        history_scrollbar = ttk.Scrollbar(history_frame, orient=tk.VERTICAL, command=history_tree.yview)
+        history_tree.configure(yscroll=history_scrollbar.set)
 
         # 修改：使用 pack 布局滚动条
         history_scrollbar.pack(side=tk.LEFT, fill=tk.Y)
 
-        # 填充版本数据（调试输出）
-        versions = sorted(task["description_history"], key=lambda x: -x["version"])
-        for ver in versions:
-            self.history_tree.insert("", tk.END, values=(
-                ver["timestamp"],
-                ver["content"]
-            ))
-
-        self.history_tree.tag_configure("latest", background="#e6f7ff", font=self.font)
-        self.history_tree.tag_configure("", font=self.font)  # 默认
-        self.history_tree.bind("<Double-Button-1>", lambda e: self.on_history_double_click(e, task))
+        history_tree.tag_configure("latest", background="#e6f7ff", font=self.font)
+        history_tree.tag_configure("", font=self.font)  # 默认
+        history_tree.bind("<Double-Button-1>", lambda e: self.on_history_double_click(e, shown["task"]))
 
         # 描述显示区域
         desc_frame = ttk.Frame(main_frame)
@@ -353,60 +4834,109 @@ class TaskManager:
 
         ttk.Label(desc_frame, text="详细描述（编辑）:", font=("SimHei", 14, "bold")).pack(anchor=tk.W, pady=5)
 
-        # 获取最新版本内容
-        latest_version = max(task["description_history"], key=lambda x: x["version"])
-        self.desc_text = tk.Text(desc_frame, wrap=tk.WORD, height=15, font=self.font)
-        self.desc_text.pack(fill=tk.BOTH, expand=True, pady=10)
-        self.desc_text.config(state=tk.NORMAL)  # 默认可编辑
-        self.latest_version_content = latest_version["content"]  # 记录最新版本内容（用于对比）
+        desc_text = self.desc_text = tk.Text(desc_frame, wrap=tk.WORD, height=15, font=self.font)
+        desc_text.pack(fill=tk.BOTH, expand=True, pady=10)
+        desc_text.config(state=tk.NORMAL)  # 默认可编辑
 
         # 滚动条
-        scrollbar = ttk.Scrollbar(self.desc_text, orient=tk.VERTICAL, command=self.desc_text.yview)
-        self.desc_text.configure(yscroll=scrollbar.set)
+        scrollbar = ttk.Scrollbar(desc_text, orient=tk.VERTICAL, command=desc_text.yview)
+        desc_text.configure(yscroll=scrollbar.set)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
+        # 当前显示的任务、按版本号倒序的历史和最新版本，刷新时更新
+        shown = {}
+
+        def refresh_detail():
+            """按任务当前内容刷新窗口；显示的内容没有变化时什么都不做"""
+            task = self.get_task(task_id)
+            if task is None:
+                # 任务已被删除（或被其他实例删除）：保留窗口内容，禁止再修改
+                detail_win.title(f"{shown['task']['short_desc']}（已删除）")
+                save_button.config(state=tk.DISABLED)
+                # 撤销删除后需要重新填写
+                shown["key"] = None
+                return
+            history = task["description_history"]
+            key = (task["short_desc"], task["project"], task["priority"], task["completed"],
+                   task["modified_time"], tuple(v["version"] for v in history))
+            old_key = shown.get("key")
+            if key == old_key:
+                return
+            detail_win.title(task["short_desc"])
+            status = "已完成" if task["completed"] else "未完成"
+            status_label.config(text=f"状态: {status}", foreground="gray" if task["completed"] else "black")
+            project_label.config(text=f"项目: {task['project']}")
+            priority_label.config(text=f"优先级: {task['priority']}", foreground=priority_color[task['priority']])
+            modified_label.config(text=f"最近修改: {task['modified_time']}")
+            save_button.config(state=tk.NORMAL)
+
+            # 历史版本变化时才重新填充（只改了状态、优先级等时不重读版本内容）
+            versions = sorted(history, key=lambda x: -x["version"])
+            if shown.get("task") is not task or old_key is None or key[-1] != old_key[-1]:
+                history_tree.delete(*history_tree.get_children())
+                for ver in versions:
+                    history_tree.insert("", tk.END, values=(
+                        ver["timestamp"],
+                        self.version_content(task, ver)
+                    ))
+            latest_version = max(history, key=lambda x: x["version"])
+            shown.update(task=task, key=key, versions=versions, latest=latest_version,
+                         content=self.version_content(task, latest_version))  # 记录最新版本内容（用于对比）
+
         # 按钮区域
         button_frame = ttk.Frame(main_frame)
         button_frame.pack(fill=tk.X, pady=10)
         # 定义保存逻辑
         def save_changes():
-            new_desc = self.desc_text.get("1.0", tk.END).strip()
-            if new_desc == self.latest_version_content:
+            task = shown["task"]
+            new_desc = desc_text.get("1.0", tk.END).strip()
+            if new_desc == shown["content"]:
                 messagebox.showinfo("提示", "内容未变更，无需保存！")
                 return
 
             # 生成新版本
-            new_version_num = latest_version["version"] + 1
+            new_version_num = shown["latest"]["version"] + 1
 
-            # 生成文件夹
+            # 生成文件夹，后台用上一版本的文件填充，完成后按设置自动打开
             folder_path = self.generate_folder_path(task["project"], task["short_desc"], str(new_version_num))
-            if not self.create_folder_if_not_exists(folder_path):
-                return
-
-            self.open_task_folder(folder_path)
+            self.provision_version_folder(shown["latest"].get("folder_path"), folder_path, open_after=True)
 
-            new_version = {
-                "version": new_version_num,
-                "content": new_desc,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "action": "修改",
-                "folder_path" : folder_path
-            }
-            task["description_history"].append(new_version)
-            task["modified_time"] = new_version["timestamp"]
+            new_version = self.history.make_version(
+                task, new_version_num, new_desc,
+                timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                action="修改",
+                folder_path=folder_path
+            )
+            self.tasks.add_version(task["id"], new_version)
 
-            # 保存并更新任务列表
-            self.save_tasks()
-            self.update_task_list()
+            # 保存，任务列表和打开的详情窗口（包括本窗口）空闲时统一刷新
+            self.save_tasks([{"op": "version", "id": task["id"], "version": new_version}])
+            self.schedule_refresh("list", "detail")
+            desc_text.delete("1.0", tk.END)
 
-            # 刷新当前窗口（关闭后重新打开）
-            detail_win.destroy()
-            self.show_task_detail(task_id)
+        def compare_versions():
+            # 对比选中的版本（未选中时为最新版本）和上一版本
+            selection = history_tree.selection()
+            index = history_tree.index(selection[0]) if selection else 0
+            self.show_version_comparison(shown["task"], shown["versions"][index]["version"])
 
-        # 仅保留“修改”和“关闭”按钮
-        ttk.Button(button_frame, text="修改", command=save_changes).pack(side=tk.LEFT, padx=10)
+        save_button = ttk.Button(button_frame, text="修改", command=save_changes)
+        save_button.pack(side=tk.LEFT, padx=10)
+        ttk.Button(button_frame, text="版本对比", command=compare_versions).pack(side=tk.LEFT, padx=10)
+        ttk.Button(button_frame, text="占用空间", command=lambda: self.show_folder_usage(shown["task"])).pack(side=tk.LEFT, padx=10)
         ttk.Button(button_frame, text="关闭", command=detail_win.destroy).pack(side=tk.RIGHT)
 
+        refresh_detail()
+        self.detail_windows[detail_win] = refresh_detail
+
+    def refresh_detail_windows(self):
+        """原地刷新所有打开的详情窗口，顺带移除已关闭的"""
+        for win, refresh in list(self.detail_windows.items()):
+            if win.winfo_exists():
+                refresh()
+            else:
+                del self.detail_windows[win]
+
     def show_version_content(self, event, task):
         selection = self.history_tree.selection()
         if not selection:
@@ -421,7 +4951,7 @@ class TaskManager:
                 # 最新版本：允许编辑
                 self.desc_text.config(state=tk.NORMAL)
                 self.desc_text.delete("1.0", tk.END)
-                self.desc_text.insert(tk.END, version["content"])
+                self.desc_text.insert(tk.END, self.version_content(task, version))
                 self.desc_text.config(state=tk.DISABLED)
                 self.version_info.set(f"当前显示: v{version['version']} ({version['timestamp']})")
                 self.edit_btn.config(state=tk.NORMAL)
@@ -431,7 +4961,7 @@ class TaskManager:
                 # 历史版本：只读
                 self.desc_text.config(state=tk.NORMAL)
                 self.desc_text.delete("1.0", tk.END)
-                self.desc_text.insert(tk.END, version["content"])
+                self.desc_text.insert(tk.END, self.version_content(task, version))
                 self.desc_text.config(state=tk.DISABLED)
                 self.version_info.set(f"当前显示: v{version['version']} ({version['timestamp']})")
                 self.edit_btn.config(state=tk.DISABLED)
@@ -439,7 +4969,7 @@ class TaskManager:
                 self.cancel_btn.config(state=tk.DISABLED)
 
     def toggle_edit_mode(self):
-        task = next((t for t in self.tasks if t["id"] == self.current_task_id), None)
+        task = self.get_task(self.current_task_id)
         if not task:
             return
         selection = self.history_tree.selection()
@@ -469,7 +4999,7 @@ class TaskManager:
             self.show_version_content(None, task)
 
     def save_edited_desc(self):
-        task = next((t for t in self.tasks if t["id"] == self.current_task_id), None)
+        task = self.get_task(self.current_task_id)
         if not task:
             messagebox.showwarning("警告", "任务已删除！")
             return
@@ -487,25 +5017,23 @@ class TaskManager:
             return
 
         new_desc = self.desc_text.get("1.0", tk.END).strip()
-        if new_desc == latest_version["content"]:
+        if new_desc == self.version_content(task, latest_version):
             messagebox.showinfo("提示", "内容未变更！")
             self.toggle_edit_mode()
             return
 
         # 生成新版本
         new_version_num = latest_version["version"] + 1
-        new_version = {
-            "version": new_version_num,
-            "content": new_desc,
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "action": "修改"
-        }
-        task["description_history"].append(new_version)
-        task["modified_time"] = new_version["timestamp"]
+        new_version = self.history.make_version(
+            task, new_version_num, new_desc,
+            timestamp=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            action="修改"
+        )
+        self.tasks.add_version(task["id"], new_version)
 
         # 保存并更新UI
-        self.save_tasks()
-        self.update_task_list()
+        self.save_tasks([{"op": "version", "id": task["id"], "version": new_version}])
+        self.schedule_refresh("list", "detail")
 
         # 更新历史版本Treeview
         self.history_tree.delete(*self.history_tree.get_children())
@@ -525,24 +5053,23 @@ class TaskManager:
         messagebox.showinfo("成功", f"描述已更新为 v{new_version_num}")
 
     def cancel_edit(self):
-        self.show_version_content(None, next((t for t in self.tasks if t["id"] == self.current_task_id), None))
+        self.show_version_content(None, self.get_task(self.current_task_id))
         self.toggle_edit_mode()
 
     def show_version_comparison(self, task, version_num):
-        if version_num == 1:
+        """版本对比窗口：可任选两个版本，默认对比所选版本和上一版本"""
+        history = sorted(task["description_history"], key=lambda v: v["version"])
+        if len(history) < 2:
             messagebox.showinfo("提示", "无更早版本可对比！")
             return
-
-        current_version = next((v for v in task["description_history"] if v["version"] == version_num), None)
-        prev_version = next((v for v in task["description_history"] if v["version"] == version_num - 1), None)
-
-        if not current_version or not prev_version:
-            messagebox.showwarning("警告", "版本信息丢失！")
-            return
+        labels = [f"v{v['version']} ({v['timestamp']})" for v in history]
+        versions = dict(zip(labels, history))
+        new_index = next((i for i, v in enumerate(history) if v["version"] == version_num), len(history) - 1)
+        new_index = max(new_index, 1)
 
         # 对比窗口
         compare_win = tk.Toplevel(self.root)
-        compare_win.title(f"版本对比 v{prev_version['version']} → v{current_version['version']}")
+        compare_win.title(f"版本对比 - {task['short_desc']}")
         compare_win.geometry("900x500")
         compare_win.resizable(True, True)
 
@@ -554,45 +5081,71 @@ class TaskManager:
         main_frame = ttk.Frame(compare_win, padding="10")
         main_frame.pack(fill=tk.BOTH, expand=True)
 
-        # 旧版本显示
-        ttk.Label(main_frame, text=f"v{prev_version['version']} ({prev_version['timestamp']})", font=("SimHei", 14, "bold")).pack(anchor=tk.W)
-        prev_text = tk.Text(main_frame, wrap=tk.WORD, height=14, font=("SimHei", 14))
-        prev_text.pack(fill=tk.BOTH, expand=True, pady=5)
-        prev_text.insert(tk.END, prev_version["content"])
-        prev_text.config(state=tk.DISABLED)
-
-        # 新版本显示
-        ttk.Label(main_frame, text=f"v{current_version['version']} ({current_version['timestamp']})", font=("SimHei", 14, "bold")).pack(anchor=tk.W)
-        curr_text = tk.Text(main_frame, wrap=tk.WORD, height=14, font=("SimHei", 14))
-        curr_text.pack(fill=tk.BOTH, expand=True, pady=5)
-        curr_text.insert(tk.END, current_version["content"])
-        curr_text.config(state=tk.DISABLED)
-
-        # 差异显示
-        diff_text = tk.Text(main_frame, wrap=tk.WORD, height=5, font=("SimHei", 14), bg="#f0f0f0")
-        diff_text.pack(fill=tk.BOTH, expand=True, pady=5)
-
-        prev_lines = prev_version["content"].splitlines()
-        curr_lines = current_version["content"].splitlines()
-        diff = difflib.unified_diff(prev_lines, curr_lines, lineterm='')
-
-        diff_summary = []
-        for line in diff:
-            if line.startswith('+') and not line.startswith('+++'):
-                diff_summary.append(f"新增: {line[1:]}")
-            elif line.startswith('-') and not line.startswith('---'):
-                diff_summary.append(f"删除: {line[1:]}")
-
-        if not diff_summary:
-            diff_text.insert(tk.END, "无变更")
-        else:
-            diff_text.insert(tk.END, "\n".join(diff_summary))
+        # 版本选择
+        picker_frame = ttk.Frame(main_frame)
+        picker_frame.pack(fill=tk.X, pady=5)
+        old_var = tk.StringVar(value=labels[new_index - 1])
+        new_var = tk.StringVar(value=labels[new_index])
+        ttk.Label(picker_frame, text="旧版本:", font=self.font).pack(side=tk.LEFT, padx=5)
+        old_combo = ttk.Combobox(picker_frame, textvariable=old_var, values=labels, state="readonly", width=24, font=self.font)
+        old_combo.pack(side=tk.LEFT, padx=5)
+        ttk.Label(picker_frame, text="新版本:", font=self.font).pack(side=tk.LEFT, padx=5)
+        new_combo = ttk.Combobox(picker_frame, textvariable=new_var, values=labels, state="readonly", width=24, font=self.font)
+        new_combo.pack(side=tk.LEFT, padx=5)
+        summary_var = tk.StringVar()
+        ttk.Label(picker_frame, textvariable=summary_var, font=self.font).pack(side=tk.RIGHT, padx=5)
 
+        # 差异显示：删除的内容标红划线，新增的内容标绿下划线
+        diff_frame = ttk.Frame(main_frame)
+        diff_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+        diff_text = tk.Text(diff_frame, wrap=tk.WORD, font=("SimHei", 14), bg="#f0f0f0")
+        diff_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        diff_scrollbar = ttk.Scrollbar(diff_frame, orient=tk.VERTICAL, command=diff_text.yview)
+        diff_text.configure(yscroll=diff_scrollbar.set)
+        diff_scrollbar.pack(side=tk.LEFT, fill=tk.Y)
+        diff_text.tag_configure("delete", foreground="red", background="#ffecec", overstrike=True)
+        diff_text.tag_configure("insert", foreground="green", background="#e6ffec", underline=True)
         diff_text.config(state=tk.DISABLED)
+
+        def selected_key():
+            return (task["id"], versions[old_var.get()]["version"], versions[new_var.get()]["version"])
+
+        def show(key, segments, error):
+            # 窗口已关闭或结果返回前又换了版本时丢弃
+            if not compare_win.winfo_exists() or key != selected_key():
+                return
+            diff_text.config(state=tk.NORMAL)
+            diff_text.delete("1.0", tk.END)
+            if error is not None:
+                summary_var.set("对比失败")
+                diff_text.insert(tk.END, str(error))
+            else:
+                for tag, text in segments:
+                    diff_text.insert(tk.END, text, () if tag == "equal" else (tag,))
+                added = sum(len(text) for tag, text in segments if tag == "insert")
+                removed = sum(len(text) for tag, text in segments if tag == "delete")
+                summary_var.set(f"新增 {added} 字，删除 {removed} 字" if added or removed else "无变更")
+            diff_text.config(state=tk.DISABLED)
+
+        def refresh(event=None):
+            key = selected_key()
+            old_ver, new_ver = versions[old_var.get()], versions[new_var.get()]
+            summary_var.set("对比中…")
+            self.diffs.request(
+                key,
+                lambda: (self.version_content(task, old_ver), self.version_content(task, new_ver)),
+                lambda segments, error: show(key, segments, error)
+            )
+
+        old_combo.bind("<<ComboboxSelected>>", refresh)
+        new_combo.bind("<<ComboboxSelected>>", refresh)
+        refresh()
         ttk.Button(main_frame, text="关闭", command=compare_win.destroy).pack(anchor=tk.E, pady=10)
 
     def open_add_task_window(self):
         """打开添加任务的子界面"""
+        if not self.check_loaded():
+            return
         add_window = tk.Toplevel(self.root)
         add_window.title("添加新任务")
         add_window.geometry("500x350")
@@ -684,11 +5237,9 @@ class TaskManager:
             now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
             folder_path = self.generate_folder_path(project, short, "1")
-            if not self.create_folder_if_not_exists(folder_path):
-                return
 
-            new_task = {
-                "id": len(self.tasks)+1,
+            new_task = Task({
+                "id": self.allocate_task_id(),
                 "project": project,
                 "short_desc": short,
                 "priority": priority,
@@ -696,13 +5247,14 @@ class TaskManager:
                 "modified_time": now,
                 "completed": False,
                 "description_history": [{"version": 1, "content": long, "timestamp": now, "action": "创建", "folder_path" : folder_path}]
-            }
+            })
 
-            self.tasks.append(new_task)
-            self.save_tasks()
+            with self.tasks.batch("新建任务") as batch:
+                batch.add(new_task)
 
-            self.open_task_folder(folder_path)
-            self.update_task_list()
+            # 文件夹在后台创建，完成后按设置自动打开
+            self.provision_folders([folder_path], open_after=True)
+            self.finish_batch(batch)
 
             # 关闭窗口
             add_window.destroy()
@@ -722,55 +5274,274 @@ class TaskManager:
         return list(self.selected_tasks)
 
     def select_all_tasks(self):
-        self.selected_tasks = {t["id"] for t in self.tasks}
-        self.update_task_list()
+        self.selected_tasks = set(self.tasks.ids())
+        self.refresh_rendered_rows()
 
     def invert_selection(self):
-        all_ids = {t["id"] for t in self.tasks}
-        self.selected_tasks = all_ids - self.selected_tasks
-        self.update_task_list()
+        self.selected_tasks = self.tasks.ids() - self.selected_tasks
+        self.refresh_rendered_rows()
+
+    def refresh_rendered_rows(self):
+        """选中状态变化不影响筛选结果，只刷新已渲染的行（虚拟列表中即可见的几十行）"""
+        self.schedule_row_refresh(int(iid) for iid in self.rendered_order)
+
+    def finish_batch(self, batch):
+        """提交一组修改：一次保存，一次刷新列表，并记入撤销栈"""
+        if not batch.ops:
+            return
+        self.save_tasks(batch.ops)
+        # 记下涉及任务此刻的修改时间（已删除的为None），撤销前据此检查它们之后是否又被修改过
+        stamps = {tid: self.task_stamp(tid) for tid in batch.touched_ids()}
+        self.undo_stack.append((batch, stamps))
+        self.schedule_refresh("list", "detail")
+
+    def task_stamp(self, task_id):
+        task = self.tasks.get(task_id)
+        return None if task is None else task["modified_time"]
+
+    def undo_last_batch(self):
+        """撤销最近一次批量操作（可连续撤销多步）"""
+        if not self.check_loaded():
+            return
+        if not self.undo_stack:
+            messagebox.showinfo("提示", "没有可撤销的操作！")
+            return
+        last, stamps = self.undo_stack.pop()
+        if any(self.task_stamp(tid) != stamp for tid, stamp in stamps.items()):
+            # 之后的编辑（包括其他实例合并进来的修改）会被逆操作覆盖，不执行撤销
+            messagebox.showwarning("警告", f"“{last.label}”涉及的任务之后又被修改过，无法撤销！")
+            return
+        with self.tasks.batch("撤销" + last.label) as batch:
+            batch.revert(last.inverse)
+        if batch.ops:
+            self.save_tasks(batch.ops)
+        self.selected_tasks.intersection_update(self.tasks.ids())
+        self.schedule_refresh("list", "detail")
+        self.save_state_var.set(f"已撤销：{last.label}")
 
     def mark_tasks_completed(self):
         task_ids = self.get_selected_task_ids()
-        if not task_ids:
+        if not task_ids or not self.check_loaded():
             return
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        for tid in task_ids:
-            for t in self.tasks:
-                if t["id"] == tid:
-                    t["completed"] = not t["completed"]
-                    t["modified_time"] = now
-                    break
-        self.save_tasks()
-        self.update_task_list()
+        with self.tasks.batch("标记完成") as batch:
+            for tid in task_ids:
+                t = self.get_task(tid)
+                if t is None:
+                    continue
+                # 日志里记录切换后的值而不是“取反”，重放结果与顺序无关
+                fields = {"completed": not t["completed"], "modified_time": now}
+                if fields["completed"]:
+                    # 归档按标记完成的时间计算，完成后再修改不会推迟归档
+                    fields["completed_time"] = now
+                batch.update(tid, fields)
+        self.finish_batch(batch)
 
     def delete_tasks(self):
         task_ids = self.get_selected_task_ids()
-        if not task_ids:
-            return
-        descs = [next((t["short_desc"] for t in self.tasks if t["id"]==tid), "未知任务") for tid in task_ids]
-        desc_text = f"{descs[0]}等{len(descs)}个任务" if len(descs)>3 else "、".join(descs)
-        if messagebox.askyesno("确认", f"确定删除以下任务？\n{desc_text}"):
-            self.tasks = [t for t in self.tasks if t["id"] not in task_ids]
-            self.selected_tasks = {tid for tid in self.selected_tasks if tid in {t["id"] for t in self.tasks}}
-            for i, t in enumerate(self.tasks, 1):
-                t["id"] = i
-            self.save_tasks()
-            self.update_task_list()
+        if not task_ids or not self.check_loaded():
+            return
+        # 只取前几个任务的描述用于确认提示
+        descs = [(self.get_task(tid) or {}).get("short_desc", "未知任务") for tid in task_ids[:4]]
+        desc_text = f"{descs[0]}等{len(task_ids)}个任务" if len(task_ids)>3 else "、".join(descs)
+        if messagebox.askyesno("确认", f"确定删除以下任务？\n{desc_text}（可撤销）"):
+            with self.tasks.batch("删除任务") as batch:
+                batch.remove(task_ids)
+            self.selected_tasks.difference_update(task_ids)
+            self.finish_batch(batch)
 
     def clear_completed_tasks(self):
-        if not any(t["completed"] for t in self.tasks):
+        if not self.check_loaded():
+            return
+        if not self.tasks.completed_count:
             messagebox.showinfo("提示", "无已完成任务！")
             return
-        if messagebox.askyesno("确认", "确定清除所有已完成任务？"):
-            self.tasks = [t for t in self.tasks if not t["completed"]]
-            self.selected_tasks = {tid for tid in self.selected_tasks if tid in {t["id"] for t in self.tasks}}
-            for i, t in enumerate(self.tasks, 1):
-                t["id"] = i
-            self.save_tasks()
-            self.update_task_list()
+        if messagebox.askyesno("确认", "确定清除所有已完成任务？（可撤销）"):
+            with self.tasks.batch("清空已完成") as batch:
+                removed = batch.remove(list(self.tasks.status_members[True]))
+            self.selected_tasks.difference_update(t["id"] for t in removed)
+            self.finish_batch(batch)
+
+    def archive_completed_tasks(self):
+        """把完成超过 archive_days 天的任务移入归档：后台压缩写入，完成后从任务文件中删除"""
+        if not self.check_loaded():
+            return
+        candidates = archive_candidates(self.tasks, self.archive_days)
+        if not candidates:
+            messagebox.showinfo("提示", f"没有完成超过{self.archive_days}天的任务！")
+            return
+        if not messagebox.askyesno("确认", f"将{len(candidates)}个完成超过{self.archive_days}天的任务移入归档？"
+                                          f"\n（可在\"已归档\"中选中后恢复）"):
+            return
+        # 在UI线程复制任务和版本列表；版本的内容经 read_version 在后台读回，
+        # 与压缩后把内容换成引用互斥
+        copies = [dict(t, description_history=list(t["description_history"])) for t in candidates]
+        stamps = {t["id"]: (t.modified_time, len(t["description_history"])) for t in candidates}
+        reader = getattr(self.store, "read_version", None)
+
+        def write():
+            try:
+                self.archive.add([archive_record(t, reader) for t in copies])
+            except Exception as e:
+                self.call_in_ui(self.on_tasks_archived, stamps, e)
+            else:
+                self.call_in_ui(self.on_tasks_archived, stamps, None)
+
+        self.save_state_var.set("归档中…")
+        threading.Thread(target=write, name="archiver", daemon=True).start()
+
+    def on_tasks_archived(self, stamps, error):
+        """归档写入完成（UI线程中执行）：从任务列表中删除已归档的任务"""
+        if error is not None:
+            self.save_state_var.set("归档失败")
+            messagebox.showerror("错误", f"归档失败（任务未移动）: {str(error)}")
+            return
+        # 写归档期间被修改（取消完成、新增版本）的任务留在列表中，从归档里撤回；被删除的也一并撤回
+        changed = set()
+        for tid, (modified, versions) in stamps.items():
+            t = self.tasks.get(tid)
+            if t is None or not t["completed"] or (t.modified_time, len(t["description_history"])) != (modified, versions):
+                changed.add(tid)
+        if changed:
+            self.archive.remove(changed)
+        moved = [tid for tid in stamps if tid not in changed]
+        with self.tasks.batch("归档") as batch:
+            batch.remove(moved)
+        # 不记入撤销栈：撤销会让任务同时留在归档中，需要时在“已归档”中恢复
+        if batch.ops:
+            self.save_tasks(batch.ops)
+            # SQLite删除的行由数据库自己复用空间，只有旁路文件需要改写
+            if isinstance(self.store, JsonTaskStore):
+                self.shrink_pending = True
+        self.selected_tasks.difference_update(moved)
+        self.schedule_refresh("list", "detail")
+        messagebox.showinfo("提示", f"已归档{len(moved)}个任务")
+
+    def restore_archived_tasks(self):
+        """把选中的已归档任务恢复到任务列表，只解压这些任务所在的分段"""
+        if not self.check_loaded():
+            return
+        ids = [tid for tid in self.selected_tasks if tid in self.archive and tid not in self.tasks]
+        if not ids:
+            messagebox.showwarning("警告", "请先在\"已归档\"中选择要恢复的任务！")
+            return
+        found = self.archive.read(ids)
+        with self.tasks.batch("恢复归档") as batch:
+            for tid in sorted(found):
+                batch.add(found[tid])
+        if not batch.ops:
+            return
+        self.save_tasks(batch.ops)
+        # 写入任务文件后（on_tasks_saved）才从归档中移除，保存失败时任务仍在归档中
+        self.restoring[id(batch.ops[-1])] = list(found)
+        self.selected_tasks.difference_update(found)
+        self.schedule_refresh("list", "detail")
+        self.save_state_var.set(f"已恢复{len(found)}个任务")
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="任务记录工具")
+    parser.add_argument("--tasks-file", default="tasks.json",
+                        help="任务数据文件，扩展名为.db/.sqlite/.sqlite3时使用SQLite后端")
+    parser.add_argument("--no-open", action="store_true", help="新建任务或版本后不自动打开文件夹")
+    parser.add_argument("--archive-days", type=int, default=ARCHIVE_AFTER_DAYS,
+                        help=f"点击\"归档\"时归档完成超过多少天的任务（默认{ARCHIVE_AFTER_DAYS}）")
+    parser.add_argument("--trace", nargs="?", const="1", metavar="FILE",
+                        help=f"记录各操作耗时，退出时导出Chrome追踪文件（默认 {TRACE_DEFAULT_FILE}）；"
+                             f"也可设置环境变量 {TRACE_ENV_VAR}")
+    subparsers = parser.add_subparsers(dest="command")
+    migrate_parser = subparsers.add_parser("migrate", help="把tasks.json迁移到SQLite数据库")
+    migrate_parser.add_argument("source", help="JSON任务文件")
+    migrate_parser.add_argument("target", help="SQLite数据库文件")
+    convert_parser = subparsers.add_parser("convert-history", help="把版本历史转换为关键帧+差量存储")
+    convert_parser.add_argument("path", help="任务数据文件（JSON或SQLite）")
+    import_parser = subparsers.add_parser("import", help="从JSONL/CSV文件批量导入任务到 --tasks-file")
+    import_parser.add_argument("source", help="待导入的文件")
+    import_parser.add_argument("--format", choices=("jsonl", "csv"), help="文件格式，默认按扩展名判断")
+    import_parser.add_argument("--no-folders", action="store_true", help="不创建版本文件夹")
+    export_parser = subparsers.add_parser("export", help="把 --tasks-file 中的任务及完整历史导出为JSONL/CSV/Markdown")
+    export_parser.add_argument("target", help="导出文件，- 表示标准输出")
+    export_parser.add_argument("--format", choices=("jsonl", "csv", "md"), help="文件格式，默认按扩展名判断")
+    subparsers.add_parser("archive", help="把 --tasks-file 中完成超过 --archive-days 天的任务移入归档")
+    restore_parser = subparsers.add_parser("restore", help="把归档中的任务恢复到 --tasks-file")
+    restore_parser.add_argument("ids", type=int, nargs="+", help="任务ID")
+    args = parser.parse_args(argv)
+
+    tracer = None
+    trace_file = args.trace or os.environ.get(TRACE_ENV_VAR, "")
+    if trace_file and trace_file != "0":
+        tracer = Tracer(TRACE_DEFAULT_FILE if trace_file in ("1", "true") else trace_file)
+        tracer.instrument(sys.modules[__name__], TRACED_FUNCTIONS)
+        tracer.instrument(TaskManager, TRACED_METHODS, "TaskManager.")
+        for store_class in (JsonTaskStore, SQLiteTaskStore):
+            tracer.instrument(store_class, TRACED_STORE_METHODS, store_class.__name__ + ".")
+        tracer.instrument(TaskArchive, TRACED_ARCHIVE_METHODS, "TaskArchive.")
+        atexit.register(lambda: print(f"追踪已导出到 {tracer.dump()}", file=sys.stderr))
+
+    if args.command == "import":
+        try:
+            count, failures = import_tasks_file(
+                args.tasks_file, args.source, args.format, create_folders=not args.no_folders,
+                on_progress=lambda n: print(f"已读取 {n} 条记录", file=sys.stderr)
+            )
+        except (OSError, ValueError) as e:
+            parser.exit(1, f"导入失败，未写入任何任务:\n{e}\n")
+        print(f"已导入 {count} 个任务到 {args.tasks_file}")
+        for path, error in failures:
+            print(f"创建文件夹失败 {path}: {error}", file=sys.stderr)
+        return
+
+    if args.command == "export":
+        try:
+            if args.target == "-":
+                fmt = args.format or "jsonl"
+                count = export_tasks_file(args.tasks_file, sys.stdout, fmt)
+            else:
+                fmt = data_file_format(args.target, ("jsonl", "csv", "md"), args.format)
+                # CSV带BOM，Excel打开时中文不乱码
+                encoding = "utf-8-sig" if fmt == "csv" else "utf-8"
+                with open(args.target, "w", encoding=encoding, newline="") as out:
+                    count = export_tasks_file(args.tasks_file, out, fmt)
+        except (OSError, ValueError) as e:
+            parser.exit(1, f"导出失败: {e}\n")
+        print(f"已导出 {count} 个任务", file=sys.stderr)
+        return
+
+    if args.command == "archive":
+        try:
+            count = archive_tasks_file(args.tasks_file, args.archive_days)
+        except (OSError, ValueError) as e:
+            parser.exit(1, f"归档失败: {e}\n")
+        print(f"已归档 {count} 个完成超过 {args.archive_days} 天的任务")
+        return
+
+    if args.command == "restore":
+        try:
+            count = restore_tasks_file(args.tasks_file, args.ids)
+        except (OSError, ValueError) as e:
+            parser.exit(1, f"恢复失败: {e}\n")
+        print(f"已恢复 {count} 个任务" + ("（其余ID不在归档中）" if count < len(set(args.ids)) else ""))
+        return
+
+    if args.command == "convert-history":
+        before, after = convert_history(args.path)
+        saved = (1 - after / before) * 100 if before else 0
+        print(f"版本历史: {before} 字节 -> {after} 字节（减少 {saved:.1f}%）")
+        return
+
+    if args.command == "migrate":
+        try:
+            count = migrate_json_to_sqlite(args.source, args.target)
+        except ValueError as e:
+            parser.exit(1, f"迁移失败: {e}\n")
+        print(f"已迁移 {count} 个任务到 {args.target}")
+        return
 
-if __name__ == "__main__":
     root = tk.Tk()
-    app = TaskManager(root)
+    TaskManager(root, args.tasks_file, auto_open_folders=not args.no_open, tracer=tracer,
+                archive_days=args.archive_days)
     root.mainloop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# task_manager.py 是单文件脚本，不安装即可导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
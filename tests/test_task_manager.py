@@ -0,0 +1,1151 @@
+import io
+import json
+import os
+import random
+import threading
+
+import pytest
+
+import task_manager as tm
+
+STAMP = "2024-03-01 09:00:00"
+
+
+def make_task(task_id, content="内容", completed=False, project="项目"):
+    return tm.Task({
+        "id": task_id,
+        "project": project,
+        "short_desc": f"任务{task_id}",
+        "priority": "中",
+        "create_time": STAMP,
+        "modified_time": STAMP,
+        "completed": completed,
+        "description_history": [{"version": 1, "timestamp": STAMP, "action": "创建", "content": content}],
+    })
+
+
+def task_with_versions(history, task_id, texts):
+    """按程序的实际方式（关键帧+差量）生成一个带多个版本的任务"""
+    task = make_task(task_id)
+    task["description_history"] = []
+    for n, text in enumerate(texts, 1):
+        task["description_history"].append(history.make_version(
+            task, n, text, timestamp=STAMP, action="创建" if n == 1 else "修改", folder_path=""))
+    return task
+
+
+def contents(store, task):
+    history = tm.VersionContentCache(version_reader=store.read_version)
+    return [history.content(task, ver) for ver in task["description_history"]]
+
+
+def fields(task):
+    return {k: v for k, v in dict(task).items() if k != "description_history"}
+
+
+class StubVar:
+    def set(self, value):
+        pass
+
+
+def headless_manager(store, tasks):
+    """不创建窗口的TaskManager：不重绘，后台线程转交的回调由 run_ui_calls 执行"""
+    app = object.__new__(tm.TaskManager)
+    app.init_state(store.path, lambda func: None, store=store, tasks=tasks)
+    app.save_state_var = StubVar()
+    return app
+
+
+def run_ui_calls(app):
+    """等后台保存完成，再执行它转交给UI线程的回调（可能又提交新的保存）"""
+    while True:
+        app.writer.flush()
+        if app.ui_calls.empty():
+            return
+        while not app.ui_calls.empty():
+            func, args = app.ui_calls.get_nowait()
+            func(*args)
+
+
+def close_manager(app):
+    app.writer.close()
+    app.store.close()
+    app.archive.close()
+    app.diffs.close()
+    app.folder_pool.shutdown(wait=True)
+
+
+# ---- 日志重放 ----
+
+def test_journal_replay(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    assert list(store.load()) == []
+    store.append([{"op": "add", "task": make_task(i)} for i in (1, 2, 3)])
+    version = {"version": 2, "timestamp": "2024-03-02 10:00:00", "action": "修改", "content": "修改后"}
+    store.append([
+        {"op": "update", "id": 1, "fields": {"completed": True, "project": "另一个项目"}},
+        {"op": "version", "id": 2, "version": version},
+        {"op": "delete", "ids": [3]},
+    ])
+    store.close()
+
+    loaded = tm.JsonTaskStore(path).load()
+    assert [t["id"] for t in loaded] == [1, 2]
+    first, second = loaded
+    assert first["completed"] and first["project"] == "另一个项目"
+    assert second["modified_time"] == "2024-03-02 10:00:00"
+    assert [v["version"] for v in second["description_history"]] == [1, 2]
+
+
+def test_compaction_keeps_later_ops(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    store.load()
+    tasks = tm.TaskCollection([make_task(i) for i in (1, 2)])
+    store.append([{"op": "add", "task": t} for t in tasks])
+    store.compact(tasks.freeze(), store.external_reads)
+    # 压缩期间的修改写入新日志，序号接在快照之后
+    store.append([{"op": "update", "id": 2, "fields": {"priority": "高"}}])
+    store.close()
+    assert not os.path.exists(path + ".journal.old")
+
+    with open(path, encoding="utf-8") as f:
+        assert json.load(f)["seq"] == 2
+    loaded = tm.JsonTaskStore(path).load()
+    assert [(t["id"], t["priority"]) for t in loaded] == [(1, "中"), (2, "高")]
+
+
+def test_ids_are_not_reused(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    tasks = store.load()
+    ops = []
+    for _ in range(3):
+        task = make_task(tasks.allocate_id())
+        tasks.add(task)
+        ops.append({"op": "add", "task": task})
+    tasks.remove([3])
+    ops.append({"op": "delete", "ids": [3]})
+    store.append(ops)
+    store.compact(tasks.freeze(), store.external_reads)
+    store.close()
+
+    # 删除最后一个任务后，下一个ID仍然不会与它重复
+    loaded = tm.JsonTaskStore(path).load()
+    assert list(loaded.ids()) == [1, 2]
+    assert loaded.allocate_id() == 4
+
+
+def test_legacy_list_format(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump([{"id": 1, "project": "项目", "short_desc": "旧任务", "priority": "低",
+                    "create_time": STAMP, "completed": False}], f, ensure_ascii=False)
+    task, = tm.JsonTaskStore(path).load()
+    assert task["modified_time"] == STAMP
+    assert [v["version"] for v in task["description_history"]] == [1]
+
+
+def test_iter_load_chunks(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    tasks = store.load()
+    for i in range(1, 8):
+        tasks.add(make_task(tasks.allocate_id()))
+    store.rewrite(tasks)
+    store.append([{"op": "update", "id": 3, "fields": {"priority": "低"}}, {"op": "delete", "ids": [7]}])
+    store.close()
+
+    # 快照逐行读成add操作，之后是日志中的操作，按批交给调用方
+    store = tm.JsonTaskStore(path)
+    chunks = list(store.iter_load(chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3]
+    loaded = tm.TaskCollection()
+    for chunk in chunks:
+        for op in chunk:
+            tm.apply_task_op(loaded, op)
+    assert list(loaded.ids()) == [1, 2, 3, 4, 5, 6]
+    assert loaded.get(3)["priority"] == "低"
+    assert (store.seq, store.next_id) == (3, 8)
+    store.close()
+
+
+def test_iter_load_merges_journal(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    tasks = store.load()
+    for i in range(1, 8):
+        tasks.add(make_task(tasks.allocate_id()))
+    store.rewrite(tasks)
+    version = {"version": 2, "timestamp": "2024-03-02 10:00:00", "action": "修改", "content": "修改后"}
+    store.append([
+        {"op": "update", "id": 3, "fields": {"priority": "低"}},
+        {"op": "add", "task": make_task(8)},
+        {"op": "delete", "ids": [7, 1]},
+        {"op": "version", "id": 2, "version": version},
+        {"op": "update", "id": 8, "fields": {"completed": True}},
+    ])
+    store.close()
+
+    # 每批都是已应用日志的任务，日志中新增的任务在最后一批
+    store = tm.JsonTaskStore(path)
+    chunks = list(store.iter_load(chunk_size=3, merge_journal=True))
+    assert all(op["op"] == "add" for chunk in chunks for op in chunk)
+    assert [[op["task"]["id"] for op in chunk] for chunk in chunks] == [[2, 3], [4, 5, 6], [8]]
+    assert (store.seq, store.next_id) == (6, 8)
+    store.close()
+    reader = tm.JsonTaskStore(path)
+    assert [op["task"].to_dict() for chunk in chunks for op in chunk] == [t.to_dict() for t in reader.load()]
+    reader.close()
+
+
+def test_journal_replay_skips_torn_line(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    store.load()
+    store.append([{"op": "add", "task": make_task(i)} for i in (1, 2)])
+    store.append([{"op": "update", "id": 1, "fields": {"priority": "高"}}])
+    store.close()
+    # 崩溃时只写了一半的最后一行
+    with open(path + ".journal", "ab") as f:
+        f.write(b'{"op": "delete", "ids": [')
+
+    store = tm.JsonTaskStore(path)
+    tasks = store.load()
+    assert list(tasks.ids()) == [1, 2] and tasks.get(1)["priority"] == "高"
+    # 下一次写入截掉半行，新操作不会接在它后面
+    store.append([{"op": "update", "id": 2, "fields": {"priority": "低"}}])
+    store.close()
+
+    loaded = tm.JsonTaskStore(path).load()
+    assert [t["priority"] for t in loaded] == ["高", "低"]
+
+
+# ---- 状态计数 ----
+
+def test_collection_counters():
+    tasks = tm.TaskCollection([make_task(1), make_task(2, completed=True), make_task(3, project="乙")])
+    tasks.update(1, {"completed": True, "priority": "高"})
+    tasks.update(3, {"project": "项目"})
+    tasks.remove([2])
+    tasks.add(make_task(4, project="丙"))
+    assert tasks.stats() == {
+        "total": 3,
+        "completed": 1,
+        "pending": 2,
+        "by_priority": {"高": 1, "中": 2},
+        "by_project": {"项目": 2, "丙": 1},
+    }
+    assert [t["id"] for t in tasks.with_status(False)] == [3, 4]
+    assert [t["id"] for t in tasks.with_status(True)] == [1]
+    # 重新加入同一ID的任务时先移出旧任务的计数
+    tasks.add(make_task(1))
+    assert tasks.stats()["completed"] == 0 and tasks.stats()["by_priority"] == {"中": 3}
+
+
+def test_snapshot_copy_on_write():
+    tasks = tm.TaskCollection([make_task(1), make_task(2)])
+    snapshot = tasks.freeze()
+    tasks.update(1, {"priority": "高"})
+    task = tasks.get(2)
+    tasks.preserve(task)
+    task["description_history"].append({"version": 2, "timestamp": STAMP, "action": "修改", "content": "新"})
+    tasks.add(make_task(3))
+    # 快照停留在建立时刻，修改过的任务由集合留下副本
+    assert [(t["id"], t["priority"], len(t["description_history"])) for t in snapshot] == [(1, "中", 1), (2, "中", 1)]
+    assert snapshot.next_id == 3
+    snapshot.release()
+    assert tasks.frozen is None
+    tasks.update(2, {"priority": "低"})
+    assert snapshot.saved[2]["priority"] == "中"
+
+
+def test_run_after_written(tmp_path):
+    store = tm.JsonTaskStore(str(tmp_path / "tasks.json"))
+    store.load()
+    saved = []
+    worker = tm.PersistenceWorker(store, on_saved=lambda submitted, written: saved.append(submitted),
+                                  on_error=None, delay=60)
+    worker.submit([{"op": "add", "task": make_task(1)}, {"op": "add", "task": make_task(2)}])
+    seen = []
+    # 不等防抖延时，已提交的操作写完后立即在保存线程中调用
+    worker.run_after_written(lambda: seen.append(store.seq))
+    worker.close()
+    store.close()
+    assert seen == [2] and saved == [2]
+
+
+# ---- SQLite存储 ----
+
+def test_sqlite_round_trip(tmp_path):
+    path = str(tmp_path / "tasks.db")
+    store = tm.SQLiteTaskStore(path)
+    store.append([{"op": "add", "task": make_task(i, completed=i == 2, project="甲" if i < 3 else "乙")}
+                  for i in (1, 2, 3, 4)])
+    version = {"version": 2, "timestamp": "2024-03-02 10:00:00", "action": "修改", "content": "修改后",
+               "folder_path": "项目/任务1/v2", "note": "额外字段"}
+    store.append([
+        {"op": "update", "id": 1, "fields": {"priority": "高", "completed": True}},
+        {"op": "version", "id": 1, "version": version},
+        {"op": "delete", "ids": [4]},
+    ])
+    store.close()
+
+    store = tm.SQLiteTaskStore(path)
+    assert store.seq == 7
+    loaded = store.load()
+    assert [t["id"] for t in loaded] == [1, 2, 3]
+    first = loaded.get(1)
+    assert (first["priority"], first["completed"], first["modified_time"]) == ("高", True, "2024-03-02 10:00:00")
+    assert first["description_history"][-1].to_dict() == version
+    assert store.count_tasks() == (3, 2)
+    store.close()
+
+
+def test_migrate_json_to_sqlite(tmp_path):
+    json_path = str(tmp_path / "tasks.json")
+    db_path = str(tmp_path / "tasks.db")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump([{"id": 1, "project": "项目", "short_desc": "旧任务", "priority": "低",
+                    "create_time": STAMP, "completed": False}], f, ensure_ascii=False)
+    store = tm.JsonTaskStore(json_path)
+    store.append([{"op": "add", "task": make_task(2)}])
+    store.close()
+
+    assert tm.migrate_json_to_sqlite(json_path, db_path) == 2
+    store = tm.SQLiteTaskStore(db_path)
+    loaded = store.load()
+    store.close()
+    assert [t["id"] for t in loaded] == [1, 2]
+    legacy = loaded.get(1)
+    assert legacy["modified_time"] == STAMP and legacy["description_history"][0]["version"] == 1
+    # 已有任务的数据库不会被覆盖
+    with pytest.raises(ValueError):
+        tm.migrate_json_to_sqlite(json_path, db_path)
+
+
+def test_sqlite_reads_other_instances(tmp_path):
+    path = str(tmp_path / "tasks.db")
+    store_a = tm.SQLiteTaskStore(path)
+    store_a.load()
+    store_b = tm.SQLiteTaskStore(path)
+    tasks_b = store_b.load()
+
+    store_b.append([{"op": "add", "task": make_task(1)}])
+    external, fresh, rejected = store_a.append([{"op": "add", "task": make_task(2)}])
+    assert [op["op"] for op in external] == ["add"] and external[0]["task"]["id"] == 1
+    assert fresh is None and not rejected
+
+    # 重写版本记录不进入ops表，缺少中间的操作时整体重新加载
+    tasks_b.add(make_task(1))
+    store_b.rewrite(tasks_b)
+    external, fresh, rejected = store_a.append([{"op": "update", "id": 2, "fields": {"priority": "高"}}])
+    assert external == [] and [t["id"] for t in fresh] == [1, 2]
+    assert store_a.seq == store_b.seq + 1
+    store_a.close()
+    store_b.close()
+
+
+# ---- 多实例合并与版本重新生成 ----
+
+def test_split_version_conflicts():
+    heads = {1: 2, 2: 1}
+    conflicted = set()
+    ops = [
+        {"op": "version", "id": 1, "version": {"version": 2}},
+        {"op": "update", "id": 1, "fields": {"priority": "高"}},
+        {"op": "version", "id": 1, "version": {"version": 3}},
+        {"op": "version", "id": 2, "version": {"version": 2}},
+    ]
+    accepted, rejected = tm.split_version_conflicts(ops, lambda tid: heads.get(tid, 0), conflicted)
+    # 任务1冲突后，其后的版本也拒绝，直到重新生成的版本到来
+    assert accepted == [ops[1], ops[3]]
+    assert rejected == [ops[0], ops[2]]
+    assert conflicted == {1}
+
+    rebased = {"op": "version", "id": 1, "version": {"version": 3}, "rebase": True}
+    accepted, rejected = tm.split_version_conflicts([rebased], lambda tid: heads.get(tid, 0), conflicted)
+    assert accepted == [rebased] and not rejected
+    assert "rebase" not in rebased and not conflicted
+
+
+def test_concurrent_versions_are_rebased(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    store.load()
+    store.append([{"op": "add", "task": task_with_versions(tm.VersionContentCache(), 1, ["原始内容"])}])
+    store.close()
+    store_a = tm.JsonTaskStore(path)
+    app = headless_manager(store_a, store_a.load())
+
+    # 另一个实例先写入了版本2
+    store_b = tm.JsonTaskStore(path)
+    tasks_b = store_b.load()
+    ver_b = tm.VersionContentCache(version_reader=store_b.read_version).make_version(
+        tasks_b.get(1), 2, "对方的内容", timestamp=STAMP, action="修改", folder_path="b")
+    store_b.append([{"op": "version", "id": 1, "version": ver_b}])
+    store_b.close()
+
+    task = app.tasks.get(1)
+    ver_a = app.history.make_version(task, 2, "本实例的内容", timestamp=STAMP, action="修改", folder_path="a")
+    app.tasks.add_version(1, ver_a)
+    app.diffs.invalidate(1)
+    app.save_tasks([{"op": "version", "id": 1, "version": ver_a}])
+    run_ui_calls(app)
+
+    # 本实例的版本接在对方的版本之后，版本号顺延，文件夹不变
+    task = app.tasks.get(1)
+    expected = ["原始内容", "对方的内容", "本实例的内容"]
+    assert [v["version"] for v in task["description_history"]] == [1, 2, 3]
+    assert [app.version_content(task, v) for v in task["description_history"]] == expected
+    assert task["description_history"][-1]["folder_path"] == "a"
+    assert not app.unconfirmed and not app.withdrawn and not store_a.conflicted
+    close_manager(app)
+
+    reader = tm.JsonTaskStore(path)
+    loaded = reader.load().get(1)
+    assert [v["version"] for v in loaded["description_history"]] == [1, 2, 3]
+    assert contents(reader, loaded) == expected
+    reader.close()
+
+
+def test_concurrent_field_updates_merge(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    store.load()
+    store.append([{"op": "add", "task": make_task(i)} for i in (1, 2)])
+    store.close()
+    store_a = tm.JsonTaskStore(path)
+    app = headless_manager(store_a, store_a.load())
+
+    store_b = tm.JsonTaskStore(path)
+    store_b.load()
+    store_b.append([
+        {"op": "update", "id": 1, "fields": {"project": "对方的项目", "short_desc": "对方的描述"}},
+        {"op": "delete", "ids": [2]},
+    ])
+    store_b.close()
+
+    # 同一字段以本实例随后写入的修改为准，其他字段取对方的修改
+    app.tasks.update(1, {"project": "本实例的项目"})
+    app.save_tasks([{"op": "update", "id": 1, "fields": {"project": "本实例的项目"}}])
+    run_ui_calls(app)
+
+    task = app.tasks.get(1)
+    assert (task["project"], task["short_desc"]) == ("本实例的项目", "对方的描述")
+    assert list(app.tasks.ids()) == [1]
+    close_manager(app)
+
+    loaded = tm.JsonTaskStore(path).load()
+    assert [fields(t) for t in loaded] == [fields(task)]
+
+
+def test_read_changes_after_compaction(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store_a = tm.JsonTaskStore(path)
+    store_a.load()
+    store_b = tm.JsonTaskStore(path)
+    tasks_b = store_b.load()
+    assert store_a.read_changes() == ([], None)
+
+    tasks_b.add(make_task(1))
+    store_b.append([{"op": "add", "task": tasks_b.get(1)}])
+    external, fresh = store_a.read_changes()
+    assert [op["task"]["id"] for op in external] == [1] and fresh is None
+
+    # 对方压缩后，本实例没读到的部分从保留的旧日志中读出，不必重新加载
+    tasks_b.update(1, {"priority": "高"})
+    store_b.append([{"op": "update", "id": 1, "fields": {"priority": "高"}}])
+    store_b.compact(tasks_b.freeze(), store_b.external_reads)
+    store_b.append([{"op": "delete", "ids": [1]}])
+    external, fresh = store_a.read_changes()
+    assert [op["op"] for op in external] == ["update", "delete"] and fresh is None
+    assert store_a.read_changes() == ([], None)
+    store_a.close()
+    store_b.close()
+
+
+@pytest.mark.parametrize("inotify", [True, False])
+def test_file_watcher_reports_changes(tmp_path, monkeypatch, inotify):
+    if not inotify:
+        monkeypatch.setattr(tm.FileWatcher, "open_inotify", staticmethod(lambda directory: None))
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    store.load()
+    changed = threading.Event()
+    watcher = tm.FileWatcher(store.watched_paths(), changed.set, poll_interval=0.05, debounce=0.01)
+    store.append([{"op": "add", "task": make_task(1)}])
+    assert changed.wait(5)
+    watcher.stop()
+    store.close()
+
+
+# ---- 差量与关键帧 ----
+
+def random_edit(rng, text, alphabet):
+    pos = rng.randrange(len(text) + 1)
+    cut = rng.randrange(0, 6)
+    return text[:pos] + "".join(rng.choices(alphabet, k=rng.randrange(0, 6))) + text[pos + cut:]
+
+
+def random_texts(seed, first, count):
+    rng = random.Random(seed)
+    texts = [first]
+    for _ in range(count - 1):
+        texts.append(random_edit(rng, texts[-1], "甲乙丙丁。"))
+    return texts
+
+
+def test_delta_round_trip():
+    rng = random.Random(1)
+    alphabet = "任务记录工具版本。\n"
+    for _ in range(300):
+        old = "".join(rng.choices(alphabet, k=rng.randrange(0, 40)))
+        new = random_edit(rng, old, alphabet)
+        assert tm.apply_delta(old, tm.encode_delta(old, new)) == new
+    # 超过 DELTA_CHAR_DIFF_LIMIT 时按行比对
+    lines = [f"第{i}行：" + "内容" * rng.randrange(1, 20) + "\n" for i in range(400)]
+    old = "".join(lines)
+    lines[17] = "改写的一行\n"
+    del lines[200:210]
+    lines.insert(300, "新增的一行\n")
+    new = "".join(lines)
+    assert len(old) > tm.DELTA_CHAR_DIFF_LIMIT
+    delta = tm.encode_delta(old, new)
+    assert tm.apply_delta(old, delta) == new
+    assert sum(len(item) for item in delta if isinstance(item, str)) < 100
+
+
+def test_keyframes_and_reconstruction():
+    texts = random_texts(2, "初始内容。" * 20, 40)
+    task = task_with_versions(tm.VersionContentCache(), 1, texts)
+    keyframes = [v["version"] for v in task["description_history"] if not tm.is_delta_version(v)]
+    assert keyframes == list(range(1, len(texts) + 1, tm.HISTORY_KEYFRAME_INTERVAL))
+
+    # 缓存容量为1，几乎每次都要从最近的关键帧开始还原
+    cold = tm.VersionContentCache(capacity=1)
+    order = list(range(len(texts)))
+    random.Random(2).shuffle(order)
+    for i in order:
+        assert cold.content(task, task["description_history"][i]) == texts[i]
+
+
+def test_convert_history(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    texts = random_texts(3, "旧格式的完整内容。" * 10, 20)
+    task = make_task(1)
+    task["description_history"] = [{"version": n, "timestamp": STAMP, "action": "修改", "content": text}
+                                   for n, text in enumerate(texts, 1)]
+    store = tm.JsonTaskStore(path)
+    store.append([{"op": "add", "task": task}])
+    store.close()
+
+    before, after = tm.convert_history(path)
+    assert after < before
+    task = tm.JsonTaskStore(path).load().get(1)
+    assert sum(tm.is_delta_version(v) for v in task["description_history"]) == len(texts) - 2
+    history = tm.VersionContentCache(version_reader=tm.JsonTaskStore(path).read_version)
+    assert [history.content(task, v) for v in task["description_history"]] == texts
+
+
+def test_reconstruction_from_bodies_file(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    texts = random_texts(4, "正文。" * 30, 21)
+    store = tm.JsonTaskStore(path)
+    tasks = store.load()
+    task = task_with_versions(tm.VersionContentCache(), 1, texts)
+    tasks.add(task)
+    store.rewrite(tasks)
+    # 写出快照后内存中的版本也换成旁路文件中的引用
+    assert all("body" in ver for ver in task["description_history"])
+    store.close()
+
+    store = tm.JsonTaskStore(path)
+    task = store.load().get(1)
+    assert all("body" in ver for ver in task["description_history"])
+    cold = tm.VersionContentCache(capacity=1, version_reader=store.read_version)
+    assert [cold.content(task, v) for v in task["description_history"]] == texts
+    assert store.read_version({"version": 1}) == {}
+    store.close()
+
+
+# ---- 全文搜索 ----
+
+def plain_content(task, ver):
+    return ver.get("content", "")
+
+
+def test_search_index():
+    index = tm.SearchIndex()
+    index.add_task(make_task(1, content="修复登录页面的 Timeout 问题", project="网站"), plain_content)
+    index.add_task(make_task(2, content="abc cde", project="工具"), plain_content)
+    index.add_task(make_task(3, content="ab cd", project="工具"), plain_content)
+    assert index.search("登录") == {1}
+    assert index.search("登录问题") == set()
+    assert index.search("TIME") == {1}
+    assert index.search("工具") == {2, 3}
+    # 只有最后一个词按前缀匹配
+    assert index.search("ab cd") == {3}
+    assert index.search("ab c") == {3}
+    assert index.search("abc c") == {2}
+    assert index.search("  ") is None
+
+    # 新增任务和新版本增量索引
+    tasks = tm.TaskCollection([make_task(1), make_task(2), make_task(3)])
+    index.apply({"op": "add", "task": make_task(4, content="新的任务")}, tasks, plain_content)
+    version = {"version": 2, "timestamp": STAMP, "action": "修改", "content": "部署脚本"}
+    index.apply({"op": "version", "id": 2, "version": version}, tasks, plain_content)
+    assert index.search("新的") == {4}
+    assert index.search("部署") == {2}
+
+
+def test_search_index_updates_and_deletes():
+    tasks = tm.TaskCollection([make_task(1, content="修复登录页面", project="网站"),
+                               make_task(2, content="abc cde", project="工具")])
+    index = tm.SearchIndex()
+    for task in tasks:
+        index.add_task(task, plain_content)
+
+    # 改名后旧项目名不再匹配，内容照常可搜
+    tasks.update(1, {"project": "后台"})
+    index.apply({"op": "update", "id": 1, "fields": {"project": "后台"}}, tasks, plain_content)
+    assert index.search("网站") == set()
+    assert index.search("后台") == {1}
+    assert index.search("登录") == {1}
+
+    # 删除的任务从倒排表中去掉，只属于它的索引词一并删除
+    tasks.remove([2])
+    index.apply({"op": "delete", "ids": [2]}, tasks, plain_content)
+    assert index.search("工具") == set()
+    assert index.search("ab") == set()
+    assert "abc" not in index.postings and "abc" not in index.words
+
+
+def test_search_index_save_and_load(tmp_path):
+    path = str(tmp_path / "index.json")
+    index = tm.SearchIndex()
+    for i in (1, 2):
+        index.add_task(make_task(i, content=f"任务内容 word{i}"), plain_content)
+    index.save(path, 5, {1})
+    # 序号不一致时视为过期
+    assert tm.SearchIndex.load(path, 6) is None
+    loaded = tm.SearchIndex.load(path, 5)
+    # 已删除任务的倒排表在保存时清理
+    assert loaded.search("内容") == {1}
+    assert loaded.search("word") == {1}
+    assert loaded.search("word2") == set()
+
+
+# ---- Myers 差异比对 ----
+
+def lcs_length(a, b):
+    row = [0] * (len(b) + 1)
+    for x in a:
+        prev = 0
+        for j, y in enumerate(b, 1):
+            prev, row[j] = row[j], prev + 1 if x == y else max(row[j], row[j - 1])
+    return row[-1]
+
+
+def check_opcodes(a, b, ops):
+    """操作列表首尾相接地覆盖两个序列，并能把a变成b"""
+    i = j = 0
+    out = []
+    for tag, i1, i2, j1, j2 in ops:
+        assert (i1, j1) == (i, j)
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+        out.extend(b[j1:j2])
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+    assert "".join(out) == b
+
+
+def test_myers_opcodes_minimal():
+    rng = random.Random(4)
+    for _ in range(500):
+        a = "".join(rng.choices("abc", k=rng.randrange(0, 14)))
+        b = "".join(rng.choices("abc", k=rng.randrange(0, 14)))
+        ops = tm.myers_opcodes(a, b)
+        check_opcodes(a, b, ops)
+        assert sum(i2 - i1 for tag, i1, i2, _, _ in ops if tag == "equal") == lcs_length(a, b)
+
+
+def test_myers_opcodes_beyond_search_limit():
+    rng = random.Random(5)
+    a = "".join(rng.choices("abcdefgh", k=3000))
+    b = "".join(rng.choices("abcdefgh", k=3000))
+    check_opcodes(a, b, tm.myers_opcodes(a, b))
+
+
+def test_diff_texts():
+    old = "第一句。" + "甲" * 500 + "乙" + "丙" * 500 + "。\n最后一句。"
+    new = "第一句。" + "甲" * 500 + "丁" + "丙" * 500 + "。\n最后一句。新的一句。"
+    result = tm.diff_texts(old, new)
+    assert "".join(text for tag, text in result if tag != "insert") == old
+    assert "".join(text for tag, text in result if tag != "delete") == new
+    changed = [(tag, text) for tag, text in result if tag != "equal"]
+    assert changed == [("delete", "乙"), ("insert", "丁"), ("insert", "新的一句。")]
+
+
+# ---- 导入导出 ----
+
+def export_text(path, fmt):
+    out = io.StringIO()
+    tm.export_tasks_file(path, out, fmt)
+    return out.getvalue()
+
+
+def test_import_export_round_trip(tmp_path):
+    source = tmp_path / "import.jsonl"
+    records = [
+        {"short_desc": "写周报", "project": "日常", "priority": "高", "completed": "是",
+         "create_time": STAMP, "description_history": [
+             {"content": "第一版\n第二行", "folder_path": "日常/写周报/v1"},
+             {"content": "第二版\n第二行", "timestamp": "2024-03-02 10:00:00"}]},
+        {"short_desc": "无项目", "description": "只有内容 # 标题"},
+    ]
+    source.write_text("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records), encoding="utf-8")
+    first = str(tmp_path / "first.json")
+    assert tm.import_tasks_file(first, str(source), base_dir=str(tmp_path), create_folders=False) == (2, [])
+
+    tasks = tm.JsonTaskStore(first).load()
+    task = tasks.get(1)
+    assert (task["priority"], task["completed"], task["modified_time"]) == ("高", True, "2024-03-02 10:00:00")
+    assert tasks.get(2)["project"] == "未分类"
+    exported = export_text(first, "jsonl")
+
+    # 导出的JSONL和CSV都能原样导入，再导出的内容不变
+    for fmt in ("jsonl", "csv"):
+        dump = tmp_path / f"export.{fmt}"
+        dump.write_text(export_text(first, fmt), encoding="utf-8")
+        again = str(tmp_path / f"again-{fmt}.json")
+        assert tm.import_tasks_file(again, str(dump), create_folders=False) == (2, [])
+        assert export_text(again, "jsonl") == exported
+    assert "> 只有内容 # 标题" in export_text(first, "md")
+
+
+def test_import_rejects_invalid_records(tmp_path):
+    source = tmp_path / "import.jsonl"
+    source.write_text('{"short_desc": "正常"}\n{"short_desc": ""}\n{"short_desc": "x", "priority": "急"}\nnot json\n',
+                      encoding="utf-8")
+    path = str(tmp_path / "tasks.json")
+    with pytest.raises(ValueError) as info:
+        tm.import_tasks_file(path, str(source), create_folders=False)
+    assert [line.split(":")[0] for line in str(info.value).splitlines()] == ["第2行", "第3行", "第4行"]
+    # 有错误时一条也不导入
+    assert len(tm.JsonTaskStore(path).load()) == 0
+
+
+# ---- 紧凑记录 ----
+
+def test_record_packing_round_trip():
+    record = {
+        "id": 7, "project": "项目", "short_desc": "任务", "priority": "高",
+        "create_time": STAMP, "modified_time": "不是时间", "completed": False, "tags": ["额外"],
+        "description_history": [
+            {"version": 1, "timestamp": STAMP, "action": "创建", "body": [0, 12, 0]},
+            {"version": 2, "timestamp": "2024-03-02 10:00:00", "action": "修改", "delta": [3, "新"], "note": 1},
+        ],
+    }
+    task = tm.Task(record)
+    # 属性上是紧凑值，按键读写的是原来的值
+    assert isinstance(task.create_time, int) and isinstance(task.priority, int)
+    assert task.modified_time == "不是时间"
+    assert task["create_time"] == STAMP and task["priority"] == "高"
+    first, second = task["description_history"]
+    assert isinstance(first, tm.Version) and first.body == (0, 12, 0)
+    assert tm.is_delta_version(second) and not tm.is_delta_version(first)
+    assert json.loads(json.dumps(task, default=tm.record_json, ensure_ascii=False)) == record
+    assert task.to_dict() == dict(task, description_history=[v.to_dict() for v in task["description_history"]])
+
+    del task["completed"]
+    assert "completed" not in task and task.get("completed") is None
+    task.update({"priority": "低", "tags": []})
+    assert task.pop("tags") == [] and "tags" not in task
+    assert task.keys() == ["id", "project", "short_desc", "priority", "create_time", "modified_time",
+                           "description_history"]
+
+
+def test_record_copy_is_independent():
+    task = tm.Task(dict(make_task(1), note={"a": 1}))
+    copy = task.copy()
+    copy["priority"] = "高"
+    copy["note"] = "改过"
+    copy["description_history"].append(tm.Version({"version": 2, "content": "新"}))
+    assert task["priority"] == "中" and task["note"] == {"a": 1}
+    assert len(task["description_history"]) == 1
+    # 版本记录本身共用
+    assert copy["description_history"][0] is task["description_history"][0]
+
+
+# ---- 按列排序 ----
+
+def random_time(rng):
+    return f"2024-0{rng.randrange(1, 10)}-1{rng.randrange(10)} 0{rng.randrange(10)}:00:00"
+
+
+def expected_order(tasks, column, completed=None, ids=None):
+    order = sorted(tasks, key=lambda t: tuple(tm.SORT_FIELD_VALUES[f](t) for f in tm.SORT_COLUMNS[column]) + (t.id,))
+    return [t.id for t in order if (completed is None or t["completed"] == completed) and (ids is None or t.id in ids)]
+
+
+def test_sort_order_incremental():
+    rng = random.Random(6)
+    projects = ["甲", "乙", "丙"]
+    tasks = tm.TaskCollection()
+    for _ in range(400):
+        task = make_task(tasks.allocate_id(), completed=rng.random() < 0.3, project=rng.choice(projects))
+        task.update({"priority": rng.choice("高中低"), "modified_time": random_time(rng)})
+        tasks.add(task)
+    orders = {column: tasks.sort_order(column) for column in tm.SORT_COLUMNS}
+    # 少量修改逐个移动，大量修改（超过 SORT_INSORT_LIMIT）整体归并
+    for changes in (5, 300):
+        for _ in range(changes):
+            tid = rng.choice(list(tasks.ids()))
+            tasks.update(tid, {"priority": rng.choice("高中低"), "modified_time": random_time(rng),
+                               "completed": rng.random() < 0.5, "project": rng.choice(projects)})
+        tasks.remove(rng.sample(list(tasks.ids()), changes // 5 + 1))
+        task = make_task(tasks.allocate_id(), project="丁")
+        task["modified_time"] = "无法解析"
+        tasks.add(task)
+        ids = set(rng.sample(list(tasks.ids()), 20))
+        for column, order in orders.items():
+            assert [t.id for t in order.tasks_in_order()] == expected_order(tasks, column)
+            assert [t.id for t in order.tasks_in_order(True)] == expected_order(tasks, column, True)
+            assert [t.id for t in order.tasks_in_order(False, ids)] == expected_order(tasks, column, False, ids)
+            assert [t.id for t in order.tasks_in_order(None, set(tasks.ids()))] == expected_order(tasks, column)
+
+
+# ---- 批量修改与撤销 ----
+
+def test_batch_undo_restores_tasks():
+    tasks = tm.TaskCollection([make_task(1), make_task(2, completed=True), make_task(3, completed=True)])
+    before = [t.to_dict() for t in tasks]
+    with tasks.batch("清空已完成") as batch:
+        batch.update(1, {"priority": "高", "project": "项目"})
+        batch.remove([2, 3])
+    assert batch.ops == [{"op": "update", "id": 1, "fields": {"priority": "高"}}, {"op": "delete", "ids": [2, 3]}]
+    assert list(tasks.ids()) == [1] and tasks.completed_count == 0
+
+    # 撤销本身也是一组修改，写入日志的操作把删除的任务重新加回
+    with tasks.batch("撤销") as undo:
+        undo.revert(batch.inverse)
+    assert [op["op"] for op in undo.ops] == ["add", "add", "update"]
+    # 恢复的任务回到原来的位置
+    assert [t.to_dict() for t in tasks] == before
+    assert tasks.completed_count == 2
+
+
+def test_batch_rolls_back_on_error():
+    tasks = tm.TaskCollection([make_task(1), make_task(2)])
+    with pytest.raises(RuntimeError):
+        with tasks.batch("删除") as batch:
+            batch.remove([1])
+            batch.update(2, {"completed": True})
+            raise RuntimeError
+    assert not batch.ops
+    assert list(tasks.ids()) == [1, 2] and tasks.completed_count == 0
+
+
+def test_undo_rejects_tasks_modified_later(tmp_path, monkeypatch):
+    warnings = []
+    monkeypatch.setattr(tm.messagebox, "showwarning", lambda title, message: warnings.append(message))
+    store = tm.JsonTaskStore(str(tmp_path / "tasks.json"))
+    tasks = store.load()
+    for i in (1, 2):
+        tasks.add(make_task(i))
+    app = headless_manager(store, tasks)
+    with app.tasks.batch("标记完成") as batch:
+        batch.update(1, {"completed": True, "modified_time": "2024-03-02 10:00:00"})
+    app.finish_batch(batch)
+    with app.tasks.batch("删除任务") as batch:
+        batch.remove([2])
+    app.finish_batch(batch)
+    run_ui_calls(app)
+
+    # 其他实例之后修改了任务1：撤销删除不受影响，撤销标记完成会覆盖对方的修改
+    app.merge_external([{"op": "update", "id": 1, "fields": {"project": "对方的项目",
+                                                            "modified_time": "2024-03-03 10:00:00"}}], None, [])
+    app.undo_last_batch()
+    assert list(app.tasks.ids()) == [1, 2] and not warnings
+    app.undo_last_batch()
+    assert len(warnings) == 1 and app.tasks.get(1)["completed"]
+    assert not app.undo_stack
+
+    # 整体重新加载后撤销栈清空
+    with app.tasks.batch("删除任务") as batch:
+        batch.remove([2])
+    app.finish_batch(batch)
+    app.merge_external([], tm.TaskCollection([make_task(1), make_task(2)]), [])
+    assert not app.undo_stack
+    close_manager(app)
+
+
+# ---- 界面刷新合并 ----
+
+def test_refresh_scheduler_coalesces():
+    scheduled = []
+    painted = []
+    refresh = tm.RefreshScheduler(scheduled.append)
+    refresh.register("list", lambda: painted.append("list"), covers=("rows", "status"))
+    refresh.register("rows", lambda: painted.append("rows"), covers=("status",))
+    refresh.register("status", lambda: painted.append("status"))
+
+    # 同一轮中多次标记只安排一次重绘
+    refresh.mark("status")
+    refresh.mark("rows", "status")
+    refresh.mark("rows")
+    assert len(scheduled) == 1
+    scheduled.pop()()
+    assert painted == ["rows"]
+
+    # 重新筛选列表顺带完成了行和状态栏
+    refresh.mark("status", "rows", "list")
+    scheduled.pop()()
+    assert painted == ["rows", "list"]
+    assert refresh.saved() == 5
+    assert refresh.counts()["status"] == {"requested": 3, "painted": 0}
+    with pytest.raises(KeyError):
+        refresh.mark("detail")
+
+
+# ---- 版本文件夹 ----
+
+def test_seed_version_folder(tmp_path):
+    src = tmp_path / "v1"
+    (src / "子目录").mkdir(parents=True)
+    (src / "a.txt").write_text("甲" * 1000, encoding="utf-8")
+    (src / "子目录" / "b.txt").write_text("乙", encoding="utf-8")
+    os.symlink("a.txt", src / "link")
+    dst = tmp_path / "v2"
+    dst.mkdir()
+    (dst / "a.txt").write_text("已有的文件", encoding="utf-8")
+
+    counts = tm.seed_version_folder(str(src), str(dst))
+    assert sum(counts.values()) == 2 and counts["symlink"] == 1
+    # 已有的文件不覆盖，其余文件与上一版本内容相同
+    assert (dst / "a.txt").read_text(encoding="utf-8") == "已有的文件"
+    assert (dst / "子目录" / "b.txt").read_text(encoding="utf-8") == "乙"
+    assert os.readlink(dst / "link") == "a.txt"
+    assert tm.seed_version_folder(None, str(tmp_path / "空")) == {} and (tmp_path / "空").is_dir()
+
+
+def test_seeding_waits_for_previous_folder(tmp_path, monkeypatch):
+    v1, v2, v3 = (str(tmp_path / f"v{i}") for i in (1, 2, 3))
+    os.mkdir(v1)
+    for i in range(20):
+        (tmp_path / "v1" / f"{i}.txt").write_text(str(i), encoding="utf-8")
+    release, started = threading.Event(), threading.Event()
+    seed = tm.seed_version_folder
+
+    def slow_seed(src, dst, on_progress=None):
+        if dst == v2:
+            release.wait(5)
+        else:
+            started.set()
+        return seed(src, dst, on_progress)
+
+    monkeypatch.setattr(tm, "seed_version_folder", slow_seed)
+    store = tm.JsonTaskStore(str(tmp_path / "tasks.json"))
+    app = headless_manager(store, store.load())
+    app.folder_state_var = StubVar()
+
+    # 连续保存两个版本：第3版要等第2版填充完成，才能复制到全部文件
+    app.provision_version_folder(v1, v2)
+    app.provision_version_folder(v2, v3)
+    assert not started.wait(0.2)
+    release.set()
+    app.folder_pool.shutdown(wait=True)
+    assert sorted(os.listdir(v3)) == sorted(os.listdir(v1))
+    run_ui_calls(app)
+    assert not app.seed_jobs
+    close_manager(app)
+
+
+def test_folder_disk_usage_counts_shared_files_once(tmp_path):
+    v1, v2 = tmp_path / "v1", tmp_path / "v2"
+    v1.mkdir()
+    (v1 / "a.bin").write_bytes(os.urandom(64 * 1024))
+    tm.seed_version_folder(str(v1), str(v2))
+    (v2 / "b.bin").write_bytes(os.urandom(16 * 1024))
+
+    (_, files1, size1, new1), (_, files2, size2, new2) = tm.folder_disk_usage([(1, str(v1)), (2, str(v2))])
+    assert (files1, size1) == (1, 64 * 1024) and (files2, size2) == (2, 80 * 1024)
+    # 第二个版本只新占用了新文件的空间
+    assert new1 >= 64 * 1024 and new2 < 64 * 1024
+
+
+# ---- 归档 ----
+
+def test_task_archive_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(tm, "ARCHIVE_SEGMENT_TASKS", 2)
+    path = str(tmp_path / "tasks.json")
+    records = []
+    for i in range(1, 6):
+        task = make_task(i, content=f"内容{i}", completed=True).to_dict()
+        task["modified_time"] = f"2024-03-0{i} 09:00:00"
+        records.append(task)
+    archive = tm.TaskArchive(path)
+    assert archive.add(records) == 5
+    # 按完成时间从新到旧排列，每段两个任务
+    assert len(archive) == 5 and 3 in archive and 6 not in archive
+    assert archive.ids_by_time() == [5, 4, 3, 2, 1]
+    assert len(os.listdir(archive.dir)) == 4
+
+    # 其他实例读到同一份索引，只解压用到的分段
+    other = tm.TaskArchive(path)
+    found = other.read([1, 4, 6])
+    assert sorted(found) == [1, 4] and list(other.cache) == [3, 1]
+    assert found[4]["description_history"][0]["content"] == "内容4"
+    assert found[4].to_dict() == records[3]
+
+    # 恢复后从索引中移除，任务全部恢复的分段随之删除
+    other.remove([1, 4, 5])
+    archive.refresh()
+    assert archive.ids_by_time() == [3, 2]
+    assert archive.get(5) is None and archive.get(2)["short_desc"] == "任务2"
+    assert sorted(os.listdir(archive.dir)) == ["index", os.path.basename(archive.segment_path(2))]
+    archive.close()
+    other.close()
+
+
+def test_archive_candidates_use_completion_time(tmp_path):
+    now = tm.datetime(2024, 5, 1)
+    tasks = tm.TaskCollection([make_task(i, completed=True) for i in (1, 2, 3)])
+    # 完成很久后又修改过的任务照常归档；刚标记完成的不归档；旧数据按最后修改时间
+    tasks.update(1, {"completed_time": STAMP, "modified_time": "2024-04-30 09:00:00"})
+    tasks.update(2, {"completed_time": "2024-04-30 09:00:00"})
+    assert [t["id"] for t in tm.archive_candidates(tasks, 30, now)] == [1, 3]
+
+    # 标记完成时记录完成时间，SQLite存储中同样保留
+    path = str(tmp_path / "tasks.db")
+    store = tm.SQLiteTaskStore(path)
+    store.append([{"op": "add", "task": make_task(1)}])
+    app = headless_manager(store, store.load())
+    app.selected_tasks = {1}
+    app.mark_tasks_completed()
+    run_ui_calls(app)
+    task = app.tasks.get(1)
+    assert task["completed"] and task["completed_time"] == task["modified_time"]
+    close_manager(app)
+    reader = tm.SQLiteTaskStore(path)
+    assert reader.load().get(1)["completed_time"] == task["completed_time"]
+    reader.close()
+
+
+def test_archive_and_restore_tasks_file(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    tasks = store.load()
+    history = tm.VersionContentCache()
+    for i in (1, 2, 3):
+        task = task_with_versions(history, i, [f"第{i}个任务", f"第{i}个任务，修改后"])
+        task["completed"] = i != 2
+        tasks.add(task)
+    store.rewrite(tasks)
+    store.close()
+    bodies_size = os.path.getsize(path + ".bodies")
+
+    # 归档后改写旁路文件，归档任务的版本内容不再占用空间
+    assert tm.archive_tasks_file(path, 30) == 2
+    assert os.path.getsize(path + ".bodies") < bodies_size / 2
+    loaded = tm.JsonTaskStore(path).load()
+    assert list(loaded.ids()) == [2]
+    assert tm.restore_tasks_file(path, [3, 4]) == 1
+
+    reader = tm.JsonTaskStore(path)
+    loaded = reader.load()
+    assert list(loaded.ids()) == [2, 3]
+    assert contents(reader, loaded.get(3)) == ["第3个任务", "第3个任务，修改后"]
+    reader.close()
+    archive = tm.TaskArchive(path)
+    assert archive.ids_by_time() == [1]
+    archive.close()
+
+
+
+def test_bodies_rewrite_reloads_other_instances(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    tasks = store.load()
+    history = tm.VersionContentCache()
+    for i in (1, 2, 3):
+        tasks.add(task_with_versions(history, i, [f"第{i}个任务", f"第{i}个任务，修改后"]))
+    store.rewrite(tasks)
+    store.close()
+    store_b = tm.JsonTaskStore(path)
+    tasks_b = store_b.load()
+
+    # 另一个实例删除任务后整体改写旁路文件，内容的位置都变了
+    store_a = tm.JsonTaskStore(path)
+    tasks_a = store_a.load()
+    tasks_a.remove([1])
+    store_a.commit_batch(tasks_a, [{"op": "delete", "ids": [1]}], fresh_bodies=True)
+    expected = ["第3个任务", "第3个任务，修改后"]
+    assert contents(store_a, tasks_a.get(3)) == expected
+
+    # 重新加载之前仍从原来的旁路文件读取；发现代号变化后整体重新加载
+    assert contents(store_b, tasks_b.get(3)) == expected
+    external, fresh = store_b.read_changes()
+    assert external == [] and list(fresh.ids()) == [2, 3]
+    assert contents(store_b, fresh.get(3)) == expected
+    assert store_b.read_changes() == ([], None)
+    store_a.close()
+    store_b.close()
+
+
+def test_bodies_rewrite_keeps_undo_tasks(tmp_path):
+    path = str(tmp_path / "tasks.json")
+    store = tm.JsonTaskStore(path)
+    tasks = store.load()
+    history = tm.VersionContentCache()
+    for i in (1, 2):
+        tasks.add(task_with_versions(history, i, [f"第{i}个任务", f"第{i}个任务，修改后"]))
+    store.rewrite(tasks)
+    with tasks.batch("删除") as batch:
+        batch.remove([1])
+    store.append(batch.ops)
+
+    # 撤销栈中被删除的任务不在快照里，改写旁路文件时它的内容也要复制过去
+    removed = [task for op in batch.inverse if op["op"] == "restore" for task in op["tasks"]]
+    store.compact(tasks.freeze(), store.external_reads, fresh_bodies=True,
+                  retained=[task.copy() for task in removed])
+    store.compact_thread.join()
+    with tasks.batch("撤销") as undo:
+        undo.revert(batch.inverse)
+    expected = ["第1个任务", "第1个任务，修改后"]
+    assert contents(store, tasks.get(1)) == expected
+    store.append(undo.ops)
+    store.close()
+    reopened = tm.JsonTaskStore(path)
+    assert contents(reopened, reopened.load().get(1)) == expected
+    reopened.close()
+
+# ---- 统计汇总 ----
+
+def test_time_rollup_incremental():
+    tasks = tm.TaskCollection([make_task(1), make_task(2, project="乙")])
+    tasks.update(2, {"completed": True, "modified_time": "2024-03-03 09:00:00"})
+    rollup = tasks.time_rollup()
+    # 优先级在内存中存为序号
+    medium = tm.PRIORITY_LEVELS.index("中")
+    day = tm.parse_day("2024-03-01")
+    assert rollup.query(day, day) == {("created", "项目"): 1, ("created", "乙"): 1, ("created_priority", medium): 2}
+    assert rollup.query(day + 2, day + 2) == {("completed", "乙"): 1, ("completed_priority", medium): 1,
+                                              ("lead", "乙"): 2 * 86400, ("lead_bin", 1): 1}
+
+    # 之后的修改增量计入，与重新建立的汇总一致
+    version = {"version": 2, "timestamp": "2024-04-01 10:00:00", "action": "修改", "content": "修改后"}
+    tasks.add_version(1, version)
+    tasks.update(1, {"project": "丙", "completed": True})
+    tasks.add(make_task(3))
+    tasks.remove([2])
+    totals = rollup.query()
+    assert totals[("edits", "丙")] == 1 and ("completed", "乙") not in totals
+    assert totals == tm.TimeRollup(tasks).query()
+    assert rollup.query(tm.parse_day("2024-04-01")) == {
+        ("edits", "丙"): 1, ("completed", "丙"): 1, ("completed_priority", medium): 1,
+        ("lead", "丙"): 31 * 86400 + 3600, ("lead_bin", 4): 1}
+    assert tm.format_day(day) == "2024-03-01"